@@ -5,31 +5,61 @@ Modified by Caleigh and Ryley
 This file handles all visuals and user input
 """
 
+import math
+import threading
+import traceback
 from tkinter import *
+from analysis import heatmap, describe
+from board import SWAP_MOVE
 from player import GuiPlayer
+from record import GameRecorder, GameWriter, player_name, player_value
+
+# milliseconds between checks on the game while a computer player is thinking, and while waiting for a human
+THINKING_INTERVAL = 50
+WAITING_INTERVAL = 200
+
+# the colour of each player's stones and sides, and of empty spaces
+COLOURS = {1: "#323792", -1: "#ED3838", 0: "#E8E8E8"}
+# the outline colour and width of a space that isn't highlighted, the last move, and the winning group
+OUTLINES = {None: ("#808080", 1), 'last': ("#F2C12E", 3), 'win': ("#2EB82E", 3)}
+# the size of the hexagons, from their middle to a corner, as a fraction of the space size
+HEX_RADIUS = 0.57
+# the number of shades in the analysis heatmap, and the colour of each shade, from empty to the best move
+HEAT_LEVELS = 8
+HEAT_COLOURS = ['#%02X%02X%02X' % tuple(round(a + (b - a) * level / HEAT_LEVELS) for a, b in
+                                       zip((0xE8, 0xE8, 0xE8), (0xFF, 0x8C, 0x00)))
+                for level in range(HEAT_LEVELS + 1)]
+# milliseconds between checks on the analysis
+ANALYSIS_INTERVAL = 250
 
 
 # Board class
-# Deals with drawing the game board and all its spaces and their colours, to be placed inside the window class
+# Deals with drawing the game board and all its spaces and their colours, to be placed inside the window class.
+# Each space is a hexagon drawn on the window's canvas, and only spaces that have changed since the last update
+# are drawn again
 class Board:
-    # Initialize the board piece images
+    # Initialize the board spaces
     def __init__(self, frame, hex_board):
         self.hexBoard = hex_board
-        self.buttons = [[None]*self.hexBoard.size for i in range(self.hexBoard.size)]
+        # the canvas item of each space
+        self.cells = [[None]*self.hexBoard.size for i in range(self.hexBoard.size)]
+        # what each space was last drawn as: (player, highlight, heat)
+        self.drawn = [[None]*self.hexBoard.size for i in range(self.hexBoard.size)]
+        # the moves on the board when it was last drawn, and the spaces that were highlighted then
+        self.drawn_moves = []
+        self.highlighted = dict()
+        # how good the analysis thinks each empty space is, from 1 to HEAT_LEVELS
+        self.heat = dict()
         self.frame = frame
-        # Images for the game spaces
-        self.empty_space = PhotoImage(file="blank.png")
-        self.red_space = PhotoImage(file="red.png")
-        self.blue_space = PhotoImage(file="blue.png")
         # Initialize the remembered moves
         self.last_move = None
         self.last_move_player = 0
         # Square this to get the amount of spaces on the board
         self.SIZE = self.hexBoard.size
         self.IMG_SIZE = 35
-        # button size DO NOT CHANGE EVER!!!
+        # space size DO NOT CHANGE EVER!!!
         self.SPACE_SIZE = 35
-        # Padding between window edges and buttons
+        # Padding between window edges and spaces
         self.XPADDING = 70
         self.YPADDING = 40
         # Window height/width
@@ -50,18 +80,24 @@ class Board:
         message.place(anchor=SW, x=self.XPADDING + 140, y=self.WIN_HEIGHT - self.YPADDING,
                       width=self.WIN_WIDTH - 2 * self.XPADDING - 140)
 
+        # analysis label - what the analysis has found, when there is one
+        self.analysis_string = StringVar(value="")
+        analysis = Label(self.frame, textvariable=self.analysis_string, justify=LEFT, anchor=W, font=("courier new", 11))
+        analysis.place(anchor=SW, x=self.XPADDING, y=self.WIN_HEIGHT - self.YPADDING - 35,
+                       width=self.WIN_WIDTH - 2 * self.XPADDING)
+
         # borders:
         # top border
-        self.frame.create_line(30, 20, self.IMG_SIZE * self.SIZE * 2 + 20, 20, fill="#ED3838", width=10)
+        self.frame.create_line(30, 20, self.IMG_SIZE * self.SIZE * 2 + 20, 20, fill=COLOURS[-1], width=10)
         # left border
-        self.frame.create_line(20, 60, self.IMG_SIZE * self.SIZE + 10, self.WIN_HEIGHT-130, fill="#323792",
+        self.frame.create_line(20, 60, self.IMG_SIZE * self.SIZE + 10, self.WIN_HEIGHT-130, fill=COLOURS[1],
                                width=10)
         # right border
         self.frame.create_line(self.WIN_WIDTH - self.IMG_SIZE * self.SIZE-50, 30, self.WIN_WIDTH - 60,
-                               self.WIN_HEIGHT-160, fill="#323792", width=10)
+                               self.WIN_HEIGHT-160, fill=COLOURS[1], width=10)
         # bottom border
         self.frame.create_line(40 + self.IMG_SIZE * self.SIZE, self.WIN_HEIGHT - 115,
-                               self.WIN_WIDTH - self.XPADDING, self.WIN_HEIGHT - 115, fill="#ED3838", width=10)
+                               self.WIN_WIDTH - self.XPADDING, self.WIN_HEIGHT - 115, fill=COLOURS[-1], width=10)
 
     # The below methods deal with button handling for undo and resign
     # resign
@@ -76,40 +112,95 @@ class Board:
 
     # Now put everything together!
     def draw_board(self):
+        radius = HEX_RADIUS * self.SPACE_SIZE
+        corners = [(radius * math.cos(math.radians(angle)), radius * math.sin(math.radians(angle)))
+                   for angle in range(30, 360, 60)]
         for row in range(0, self.hexBoard.size):
-            j = row * self.SPACE_SIZE + self.XPADDING
             for col in range(0, self.hexBoard.size):
-                label = Label(self.frame, image=self.empty_space)
-                self.buttons[row][col] = label
-                label.pack()
-                label.image = self.empty_space
-                label.place(anchor=NW, x=j, y=self.YPADDING + row * self.SPACE_SIZE)
-                label.bind('<Button-1>', self.on_click_maker(row, col))
-                j += 2 * self.SPACE_SIZE
-
-    # Board gets players next move and updates itself with the correct space colours
+                # the middle of the space
+                x = self.XPADDING + (row + 2 * col) * self.SPACE_SIZE + self.SPACE_SIZE / 2
+                y = self.YPADDING + row * self.SPACE_SIZE + self.SPACE_SIZE / 2
+                points = [coord for dx, dy in corners for coord in (x + dx, y + dy)]
+                outline, width = OUTLINES[None]
+                cell = self.frame.create_polygon(points, fill=COLOURS[0], outline=outline, width=width)
+                self.frame.tag_bind(cell, '<Button-1>', self.on_click_maker(row, col))
+                self.cells[row][col] = cell
+                self.drawn[row][col] = (0, None, 0)
+
+    # Board gets players next move and updates itself with the correct space colours.
+    # only the spaces of moves made or undone since the last update, and the highlighted spaces, can change
     def update(self):
-        for y in range(self.hexBoard.size):
-            for x in range(self.hexBoard.size):
-                self.give_colour(y, x, self.hexBoard[y][x])
+        board = self.hexBoard
+        moves = board.move_list
+        common = 0
+        for old, new in zip(self.drawn_moves, moves):
+            if old != new:
+                break
+            common += 1
+        dirty = set(self.highlighted)
+        for move_list in (self.drawn_moves, moves):
+            for move in move_list[common:]:
+                dirty.update(move_cells(move_list, move))
+        self.drawn_moves = list(moves)
+        self.highlighted = self.highlights()
+        dirty.update(self.highlighted)
+        for y, x in dirty:
+            self.give_colour(y, x, board[y][x], self.highlighted.get((y, x)), self.heat.get((y, x), 0))
 
-        if self.hexBoard.winner != 0:
-            self.message_string.set('%s Player Wins!' % ('Blue' if self.hexBoard.winner == 1 else 'Red'))
+        if board.winner != 0:
+            self.message_string.set('%s Player Wins!' % ('Blue' if board.winner == 1 else 'Red'))
         else:
-            self.message_string.set("%s Player's turn to move" % ('Blue' if self.hexBoard.turn == 1 else 'Red'))
-
-    # Change the colour of a board piece
-    def give_colour(self, y, x, player):
-        widget = self.buttons[y][x]
-        if player == -1:
-            widget.config(image=self.red_space)
-            widget.image = self.red_space
-        elif player == 1:
-            widget.config(image=self.blue_space)
-            widget.image = self.blue_space
-        else:
-            widget.config(image=self.empty_space)
-            widget.image = self.empty_space
+            self.message_string.set("%s Player's turn to move" % ('Blue' if board.turn == 1 else 'Red'))
+
+    # the spaces to highlight: the winning group, if there is one, and the last move
+    def highlights(self):
+        board = self.hexBoard
+        highlighted = dict()
+        if board.winner != 0 and board.winning_group:
+            for cell in board.winning_group:
+                highlighted[cell] = 'win'
+        if board.move_list:
+            for cell in move_cells(board.move_list, board.move_list[-1])[-1:]:
+                highlighted[cell] = 'last'
+        return highlighted
+
+    # lets the viewer know what a computer player is currently thinking about
+    def show_progress(self, progress):
+        message = '%s Player is thinking' % ('Blue' if self.hexBoard.turn == 1 else 'Red')
+        if progress:
+            details = []
+            for key, value in progress.items():
+                if key == 'move' and value is not None:
+                    value = '%d,%d' % (value[0] + 1, value[1] + 1)
+                details.append('%s %s' % (key, value))
+            message += ': ' + ', '.join(details)
+        self.message_string.set(message)
+
+    # shows the latest report of an analysis as a heatmap over the empty spaces, or clears it if there's no report
+    def show_analysis(self, report):
+        heat = dict()
+        for cell, score in heatmap(report).items():
+            level = round(score * HEAT_LEVELS)
+            if level > 0:
+                heat[cell] = level
+        dirty = set(self.heat) | set(heat)
+        self.heat = heat
+        board = self.hexBoard
+        for y, x in dirty:
+            self.give_colour(y, x, board[y][x], self.highlighted.get((y, x)), heat.get((y, x), 0))
+        self.analysis_string.set(describe(report) if board.winner == 0 else "")
+
+    # Change the colour of a board piece, if it isn't already drawn that way
+    def give_colour(self, y, x, player, highlight=None, heat=0):
+        if self.drawn[y][x] == (player, highlight, heat):
+            return
+        self.drawn[y][x] = (player, highlight, heat)
+        outline, width = OUTLINES[highlight]
+        fill = HEAT_COLOURS[heat] if player == 0 else COLOURS[player]
+        self.frame.itemconfig(self.cells[y][x], fill=fill, outline=outline, width=width)
+        if highlight is not None:
+            # keeps the thicker outline on top of the spaces around it
+            self.frame.tag_raise(self.cells[y][x])
 
     # on_click_maker allows us to pass parameters to a button's on-click event so that we can modify variables
     # outside scope
@@ -122,6 +213,14 @@ class Board:
         return on_click
 
 
+# the spaces a move changes. a swap takes the first stone off its space and puts it on the mirrored one
+def move_cells(move_list, move):
+    if move == SWAP_MOVE:
+        row, col = move_list[0]
+        return [(row, col), (col, row)]
+    return [move]
+
+
 # The window containing the game board, continuously stays open
 class MainWindow:
     def __init__(self, window, hex_board):
@@ -145,9 +244,48 @@ class MainWindow:
         self.Board.last_move = None
         self.Board.last_move_player = 0
 
+    def show_progress(self, progress):
+        self.Board.show_progress(progress)
+
+    def show_analysis(self, report):
+        self.Board.show_analysis(report)
+
+
+# runs a computer player's move on a copy of the board, so that the window keeps drawing while it thinks
+class SearchThread(threading.Thread):
+    def __init__(self, player, hex_board):
+        super(SearchThread, self).__init__(daemon=True)
+        self.player = player
+        self.board = hex_board.copy()
+        self.start_moves = len(hex_board.move_list)
+        self.cancelled = False
+        self.error = None
+        player.stopped = False
+        player.progress = None
+
+    def run(self):
+        try:
+            self.player.move(self.board)
+        except Exception as e:
+            self.error = e
+            traceback.print_exc()
 
-# GUI main
-def main(hex_board, player):
+    # the result of a cancelled search is thrown away
+    def cancel(self):
+        self.cancelled = True
+        self.player.stop()
+
+    # the move the player made, 'resign' if they gave up, or None if they did nothing
+    def result(self):
+        if len(self.board.move_list) > self.start_moves:
+            return self.board.move_list[self.start_moves]
+        elif self.board.winner != 0:
+            return 'resign'
+        return None
+
+
+# GUI main. if an Analysis is given, it analyses every position of the game and is shown as a heatmap
+def main(hex_board, player, record_path=None, analysis=None):
     window = Tk()
     window.wm_title("Hex")
     game_window = MainWindow(window, hex_board)
@@ -155,16 +293,112 @@ def main(hex_board, player):
         if isinstance(player[i], GuiPlayer):
             player[i].set_gui(game_window)
 
+    recorder = GameRecorder(hex_board, (player_name(player[1]), player_name(player[-1])))
+
+    # the search currently running, and searches that were cancelled but haven't finished yet
+    searches = {'current': None, 'cancelled': []}
+
+    def cancel_search():
+        search = searches['current']
+        if search is not None:
+            search.cancel()
+            searches['cancelled'].append(search)
+            searches['current'] = None
+
+    # a computer player's turn. its move is found on another thread, and checked on every loop.
+    # returns True once the player has moved
+    def computer_turn(current):
+        # the buttons can be used while the computer is thinking
+        clicked = game_window.get_move(hex_board.turn)
+        game_window.reset_move()
+        if clicked == 'resign' or clicked == 'undo':
+            cancel_search()
+            # if a human is playing against the computer, they're the one who clicked
+            other = player[-hex_board.turn]
+            if clicked == 'resign':
+                hex_board.resign(-hex_board.turn if other.is_human() else hex_board.turn)
+            elif hex_board.move_list:
+                hex_board.undo()
+            recorder.update()
+            game_window.update()
+            return False
+
+        search = searches['current']
+        if search is None:
+            searches['cancelled'] = [s for s in searches['cancelled'] if s.is_alive()]
+            # a player can't start thinking again until its cancelled search has stopped
+            if any(s.player is current for s in searches['cancelled']):
+                return
+            search = SearchThread(current, hex_board)
+            searches['current'] = search
+            search.start()
+            game_window.show_progress(None)
+        elif search.is_alive():
+            game_window.show_progress(current.progress)
+        else:
+            searches['current'] = None
+            result = search.result()
+            if result == 'resign':
+                hex_board.resign()
+            elif result is not None:
+                hex_board.play(*result)
+            recorder.update(player_value(current))
+            game_window.update()
+            return True
+        return False
+
     # Keep the main window updating
     def game_loop():
-        game_window.update()
-        player[hex_board.turn].move(hex_board)
-        game_window.update()
+        current = player[hex_board.turn]
+        moved = False
+        if current.is_human():
+            game_window.update()
+            current.move(hex_board)
+            recorder.update()
+            game_window.update()
+        else:
+            moved = computer_turn(current)
         if hex_board.winner == 0:
-            window.after(200, game_loop)
+            if moved:
+                # the next player can start straight away, once the move has been drawn
+                window.after_idle(game_loop)
+            else:
+                window.after(WAITING_INTERVAL if current.is_human() else THINKING_INTERVAL, game_loop)
         else:
             # somebody won, show that.
-            pass
+            stop_pondering()
+            if record_path:
+                with GameWriter(record_path) as writer:
+                    writer.write(recorder.record())
+
+    # computer players might still be searching in the background
+    def stop_pondering():
+        for i in (1, -1):
+            if not player[i].is_human():
+                player[i].stop_pondering()
+
+    # restarts the analysis whenever the position changes, and shows its latest report
+    shown = {'report': None}
+
+    def analysis_loop():
+        if not analysis.is_current(hex_board):
+            analysis.start(hex_board)
+            shown['report'] = None
+            game_window.show_analysis(None)
+        elif analysis.report is not shown['report']:
+            shown['report'] = analysis.report
+            game_window.show_analysis(analysis.report)
+        window.after(ANALYSIS_INTERVAL, analysis_loop)
+
+    def close():
+        cancel_search()
+        stop_pondering()
+        if analysis is not None:
+            analysis.stop()
+        window.destroy()
 
+    window.protocol('WM_DELETE_WINDOW', close)
     window.after(1000, game_loop)
+    if analysis is not None:
+        window.after(ANALYSIS_INTERVAL, analysis_loop)
     window.mainloop()
@@ -0,0 +1,215 @@
+"""
+Analyses a position continuously in the background, and reports what the search has found so far.
+An alpha-beta player reports the heuristic's value for every move, then the value and expected moves each time
+it finishes a depth. A monte carlo player reports the share of visits each move has had, the value and the
+expected moves. Reports are only built every so often, so watching the search never slows it down
+
+    python3 analysis.py --size 7 --moves d4 c5 --player '{"type": "monte_carlo"}' --time 10
+
+Each report is printed as a line of JSON, with moves written like a1 and values from player 1's point of view:
+
+    {"moves": 2, "turn": 1, "elapsed": 1.5, "value": 0.12, "searches": 4096, "pv": ["e3", "d3"],
+     "visits": {"e3": 0.31, "d3": 0.12, ...}}
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from math import inf
+from timeit import default_timer
+
+from board import HexBoard, SWAP_MOVE
+from clock import TimeManager
+from player import AlphaBetaPlayer, MonteCarloPlayer, build_player, principal_variation
+from record import sgf_move, parse_sgf_move
+
+DEFAULT_PLAYER = {'type': 'alpha_beta', 'heuristic': 'two_distance', 'max_time': 1}
+# the least time between reports, in seconds
+REPORT_INTERVAL = 0.5
+# the number of monte carlo searches between checks of the clock
+CHECK_INTERVAL = 64
+
+
+# runs a player's search on another thread for as long as the position stays the same
+class Analysis:
+    def __init__(self, spec=None, size=11, interval=REPORT_INTERVAL):
+        # the analysing player never plays a move, so it has no need for statistics
+        self.spec = dict(DEFAULT_PLAYER if spec is None else spec, collect_stats=False)
+        self.interval = interval
+        self.player = build_player(self.spec, 1, size)
+        if not isinstance(self.player, (AlphaBetaPlayer, MonteCarloPlayer)):
+            raise ValueError('%s players cannot analyze positions' % self.spec['type'])
+        # the moves of the position being analysed
+        self.moves = None
+        # the latest report. a new one replaces it rather than changing it, so it can be read from any thread
+        self.report = None
+        self._thread = None
+
+    # whether the report is about the position on the board
+    def is_current(self, board):
+        return self.moves == board.move_list
+
+    # starts analysing the board's position, unless it's already being analysed
+    def follow(self, board):
+        if not self.is_current(board):
+            self.start(board)
+        return self.report
+
+    def start(self, board):
+        self.stop()
+        self.moves = list(board.move_list)
+        self.report = None
+        if board.winner != 0:
+            return
+        player = self.player
+        player.player_num = board.turn
+        player.stopped = False
+        self._thread = threading.Thread(target=self.search, args=(board.copy(),), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.player.stopped = True
+            self._thread.join()
+            self._thread = None
+
+    # whether the search has stopped by itself, after searching as far as it can
+    def finished(self):
+        return self.report is not None and self.report.get('finished', False)
+
+    def search(self, board):
+        start = default_timer()
+        base = {'moves': len(board.move_list), 'turn': board.turn}
+
+        def publish(**fields):
+            report = dict(self.report or base)
+            report.update(fields, elapsed=default_timer() - start)
+            self.report = report
+
+        player = self.player
+        if isinstance(player, AlphaBetaPlayer):
+            values = player.heuristic.get_child_values(board)
+            publish(move_values={(y, x): values[y][x] for y in range(board.size) for x in range(board.size)
+                                 if board[y][x] == 0})
+            player.transposition_table.clear_before(len(board.move_list))
+            player.ordering.new_search(board)
+            time_manager = TimeManager(move_time=inf)
+            time_manager.start_move(board)
+            player.iterative_deepening(board, time_manager, player.transposition_table, False,
+                                       on_iteration=lambda depth, value, move_list:
+                                       publish(depth=depth, value=value, pv=principal_variation(move_list)))
+        else:
+            root = player.tree_node(board)
+            count = 0
+            next_check = CHECK_INTERVAL
+            next_report = start
+            # a proven position has nothing left to search, so the analysis finishes
+            while not player.stopped and root[4] == 0:
+                count += player.search(board)
+                if count >= next_check and default_timer() >= next_report:
+                    next_check = count + CHECK_INTERVAL
+                    publish(searches=count, **monte_carlo_summary(player, board))
+                    next_report = default_timer() + self.interval
+            publish(searches=count, **monte_carlo_summary(player, board))
+        if not player.stopped:
+            publish(finished=True)
+
+
+# the value, expected moves and share of visits of each move from a monte carlo search
+def monte_carlo_summary(player, board):
+    summary = player.summary(board)
+    total = sum(summary['visits'].values())
+    summary['visits'] = {move: count / total for move, count in summary['visits'].items()}
+    return summary
+
+
+# how promising each empty cell looks to the player to move, from 0 to 1
+def heatmap(report):
+    if report is None:
+        return dict()
+    if 'visits' in report:
+        best = max(report['visits'].values(), default=0)
+        return {move: share / best for move, share in report['visits'].items() if move != SWAP_MOVE and best > 0}
+    scores = {move: value * report['turn'] for move, value in report.get('move_values', {}).items()}
+    finite = [score for score in scores.values() if abs(score) != inf]
+    low, high = min(finite, default=0), max(finite, default=0)
+    heat = dict()
+    for move, score in scores.items():
+        if score == inf or score == -inf:
+            heat[move] = 1.0 if score > 0 else 0.0
+        else:
+            heat[move] = (score - low) / (high - low) if high > low else 0.5
+    return heat
+
+
+# a line of text summarising a report
+def describe(report):
+    if report is None:
+        return 'analysing...'
+    details = []
+    if 'depth' in report:
+        details.append('depth %d' % report['depth'])
+    if 'searches' in report:
+        details.append('searches %d' % report['searches'])
+    if 'value' in report:
+        details.append('value %.3g' % report['value'])
+    if report.get('pv'):
+        details.append('pv ' + ' '.join(sgf_move(move) for move in report['pv'][:8]))
+    return ', '.join(details) or 'analysing...'
+
+
+# the report with its moves written like a1, so it can be saved as json
+def report_json(report):
+    data = dict(report)
+    if 'pv' in data:
+        data['pv'] = [sgf_move(move) for move in data['pv']]
+    for key in ('move_values', 'visits'):
+        if key in data:
+            data[key] = {sgf_move(move): value for move, value in data[key].items()}
+    return data
+
+
+# prints every new report as a line of json, checking at most once an interval.
+# runs until the stopped event is set, or if there isn't one, until the analysis finishes or max_time is up
+def print_reports(analysis, out=sys.stdout, stopped=None, max_time=None):
+    start = default_timer()
+    last = None
+    while not (stopped is not None and stopped.is_set()):
+        time.sleep(analysis.interval)
+        report = analysis.report
+        if report is not None and report is not last:
+            last = report
+            out.write(json.dumps(report_json(report)) + '\n')
+            out.flush()
+        if stopped is None and (analysis.finished() or (max_time is not None and default_timer() - start >= max_time)):
+            break
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse a position, printing what the search finds as json lines')
+    parser.add_argument('--player', type=json.loads, default=DEFAULT_PLAYER,
+                        help='json description of the analysing player (default %s)' % json.dumps(DEFAULT_PLAYER))
+    parser.add_argument('--size', type=int, default=11)
+    parser.add_argument('--swap', action='store_true', help='play with the swap rule')
+    parser.add_argument('--moves', nargs='*', default=[], help='the moves leading to the position, like a1 b2')
+    parser.add_argument('--interval', type=float, default=REPORT_INTERVAL, help='seconds between reports')
+    parser.add_argument('--time', type=float, help='stop after this many seconds (default: until interrupted)')
+    args = parser.parse_args(argv)
+
+    board = HexBoard(args.size, args.swap)
+    for move in args.moves:
+        if not board.play(*parse_sgf_move(move.lower())):
+            parser.error('illegal move %s' % move)
+    analysis = Analysis(args.player, args.size, args.interval)
+    analysis.start(board)
+    try:
+        print_reports(analysis, max_time=args.time)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        analysis.stop()
+
+
+if __name__ == '__main__':
+    main()
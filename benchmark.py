@@ -0,0 +1,404 @@
+"""
+A benchmark suite for the hot paths of the board, heuristics and search players.
+Runs against a fixed corpus of positions so results are comparable between runs
+
+    python3 benchmark.py --output bench.json
+    python3 benchmark.py --compare bench.json
+    python3 benchmark.py --scaling --output scaling.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from math import inf
+from timeit import default_timer
+
+from board import HexBoard
+from clock import TimeManager
+from heuristic import ShortestPathHeuristic, TwoDistanceHeuristic, ChargeHeuristic, PatternHeuristic
+from locality import LocalityWindow
+from player import AlphaBetaPlayer, MonteCarloPlayer
+from transposition import TranspositionTable
+
+# numpy is only needed for the batch heuristics
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the seed used to generate the corpus. changing this invalidates every saved baseline
+CORPUS_SEED = 2718
+# board sizes and the fraction of the board filled in each corpus position
+CORPUS_SIZES = (5, 7, 9, 11)
+CORPUS_FILL = (0.0, 0.25, 0.5)
+# relative slowdown allowed before a comparison counts as a regression
+DEFAULT_THRESHOLD = 0.10
+# the number of positions evaluated together by the batch heuristics
+BATCH_SIZE = 32
+# the board sizes and fill of the scaling report, and the time each move gets. the radii are the large-board settings,
+# for the moves searched and for the charge heuristic
+SCALING_SIZES = (7, 11, 13, 15, 19)
+SCALING_FILL = 0.1
+SCALING_MOVE_TIME = 2
+SCALING_CANDIDATE_RADIUS = 1
+SCALING_CHARGE_RADIUS = 4
+
+
+# builds a list of random moves that doesn't end the game
+def random_position(size, num_moves, rng):
+    board = HexBoard(size)
+    cells = [(y, x) for y in range(size) for x in range(size)]
+    rng.shuffle(cells)
+    for move in cells:
+        if len(board.move_list) >= num_moves:
+            break
+        board.play(*move)
+        # a finished game isn't interesting to search, so skip moves that win
+        if board.winner != 0:
+            board.undo()
+    return list(board.move_list)
+
+
+# the fixed set of positions every benchmark runs on, as (name, size, move_list)
+def build_corpus(sizes=CORPUS_SIZES, fills=CORPUS_FILL, seed=CORPUS_SEED):
+    rng = random.Random(seed)
+    corpus = []
+    for size in sizes:
+        for fill in fills:
+            num_moves = int(size * size * fill)
+            corpus.append(('%dx%d_%dmoves' % (size, size, num_moves), size, random_position(size, num_moves, rng)))
+    return corpus
+
+
+def load_board(size, move_list):
+    board = HexBoard(size)
+    for move in move_list:
+        board.play(*move)
+    return board
+
+
+# repeatedly calls func until min_time has passed, and returns the mean time per call
+def time_call(func, min_time):
+    calls = 0
+    start = default_timer()
+    elapsed = 0
+    while elapsed < min_time or calls == 0:
+        func()
+        calls += 1
+        elapsed = default_timer() - start
+    return {'calls': calls, 'seconds': elapsed / calls, 'ops_per_sec': calls / elapsed}
+
+
+def bench_board(board, min_time):
+    results = {}
+    empty = [(y, x) for y in range(board.size) for x in range(board.size) if board[y][x] == 0]
+
+    def play_undo():
+        for move in empty:
+            board.play(*move)
+            board.undo()
+    result = time_call(play_undo, min_time)
+    result['ops_per_sec'] *= len(empty)
+    result['seconds'] /= len(empty)
+    results['play_undo'] = result
+
+    # the connection check itself, for both players. board.winner skips it on boards with fewer than size moves,
+    # which most of the corpus has, so timing that would mostly time the shortcut
+    def is_connected():
+        return board.is_connected(1), board.is_connected(-1)
+    results['is_connected'] = time_call(is_connected, min_time)
+    results['hashable'] = time_call(board.hashable, min_time)
+    return results
+
+
+def bench_heuristics(board, min_time):
+    results = {}
+    for name, heuristic in (('shortest_path', ShortestPathHeuristic()), ('two_distance', TwoDistanceHeuristic()),
+                            ('pattern', PatternHeuristic())):
+        results[name + '.get_value'] = time_call(lambda: heuristic.get_value(board), min_time)
+        results[name + '.get_child_values'] = time_call(lambda: heuristic.get_child_values(board), min_time)
+
+    charge = ChargeHeuristic(board.size)
+
+    def charge_fresh():
+        # clear the remembered states so every call does the full work
+        charge.states = []
+        return charge.get_child_values(board)
+    results['charge.get_child_values'] = time_call(charge_fresh, min_time)
+    results['charge.get_child_values_cached'] = time_call(lambda: charge.get_child_values(board), min_time)
+
+    # the batch versions, on the same position repeated, timed per position so they compare with the above
+    if np is not None:
+        batch = np.array([board.board] * BATCH_SIZE, dtype=np.int8)
+        for name, batched in (('shortest_path', ShortestPathHeuristic()), ('charge', charge),
+                              ('pattern', PatternHeuristic())):
+            timing = time_call(lambda: batched.get_child_values_batch(batch), min_time)
+            timing['seconds'] /= BATCH_SIZE
+            timing['ops_per_sec'] *= BATCH_SIZE
+            results[name + '.get_child_values_batch'] = timing
+    return results
+
+
+# times a fixed depth alpha-beta search for every depth up to max_depth
+def bench_alpha_beta(board, max_depth, sorted_search=False):
+    results = {}
+    for depth in range(1, max_depth + 1):
+        player = AlphaBetaPlayer(board.turn, ShortestPathHeuristic(), depth,
+                                 sorter=ChargeHeuristic(board.size) if sorted_search else None)
+        stats = player.new_stats()
+        stats.begin_iteration(depth)
+        start = default_timer()
+        val, move_list, _ = player.alpha_beta(board, depth, -inf, inf, board.turn, TranspositionTable(),
+                                              sorter=player.sorter)
+        elapsed = default_timer() - start
+        results['depth_%d' % depth] = {
+            'seconds': elapsed,
+            'nodes': stats.nodes,
+            'nodes_per_sec': stats.nodes / elapsed if elapsed else 0,
+            'leaf_evals': stats.leaf_evals,
+            'tt_hits': stats.tt_hits,
+            'value': val,
+        }
+    return results
+
+
+# the nodes needed by iterative deepening to reach each depth, which is where move ordering pays off
+def bench_iterative_deepening(board, max_depth):
+    player = AlphaBetaPlayer(board.turn, ShortestPathHeuristic(), max_time=inf)
+    stats = player.new_stats()
+    player.ordering.new_search(board)
+    player.time_manager.start_move(board)
+    start = default_timer()
+    player.iterative_deepening(board, player.time_manager, player.transposition_table, verbose=False,
+                               max_depth=max_depth)
+    elapsed = default_timer() - start
+    results = {}
+    nodes = 0
+    for iteration in stats.iterations:
+        nodes += iteration['nodes']
+        results['depth_%d' % iteration['depth']] = {
+            'seconds': elapsed if iteration is stats.iterations[-1] else iteration['seconds'],
+            'nodes': nodes,
+            'nodes_per_sec': iteration['nodes'] / iteration['seconds'] if iteration['seconds'] else 0,
+            'value': iteration['value'],
+        }
+    return results
+
+
+def bench_monte_carlo(board, min_time):
+    player = MonteCarloPlayer(board.turn, board.size, collect_stats=False)
+    results = {'playout': time_call(lambda: player.playout(board), min_time)}
+    # the tree only knows about the empty board, so the corpus position needs to be added as a root
+    player.tree_node(board)
+    # run the full tree search for a fixed amount of time
+    start = default_timer()
+    count = 0
+    while default_timer() - start < min_time or count == 0:
+        player.MCTS(board)
+        count += 1
+    elapsed = default_timer() - start
+    results['mcts'] = {'calls': count, 'seconds': elapsed / count, 'ops_per_sec': count / elapsed}
+
+    # with the network, a leaf is evaluated in a batch instead of played out, so the time per leaf of a batch
+    # compares with a playout, and the time per leaf of a batched search with a search
+    if np is not None:
+        from network import load_network
+        network = load_network()
+        player = MonteCarloPlayer(board.turn, board.size, collect_stats=False, evaluator=network)
+        boards = np.array([board.board] * player.batch_size, dtype=np.int8)
+        turns = [board.turn] * player.batch_size
+        timing = time_call(lambda: network.evaluate(boards, turns), min_time)
+        timing['seconds'] /= player.batch_size
+        timing['ops_per_sec'] *= player.batch_size
+        results['network_evaluate'] = timing
+        root = player.tree_node(board)
+        start = default_timer()
+        count = 0
+        # a position that's solved has nothing left to search
+        while (default_timer() - start < min_time or count == 0) and root[4] == 0:
+            count += player.search(board)
+        elapsed = default_timer() - start
+        if count:
+            results['network_search'] = {'calls': count, 'seconds': elapsed / count, 'ops_per_sec': count / elapsed}
+    return results
+
+
+# how the cost of a move grows with the board size. the move is timed on its own, then searched again to the same
+# depth while tracing allocations, since tracing slows everything down
+def bench_scaling(board, min_time, move_time=SCALING_MOVE_TIME):
+    results = {}
+    shortest_path = ShortestPathHeuristic()
+    results['shortest_path.get_value'] = time_call(lambda: shortest_path.get_value(board), min_time)
+    # a new two-distance heuristic every call, since one that has seen the position already has its value
+    results['two_distance.get_value'] = time_call(lambda: TwoDistanceHeuristic().get_value(board), min_time)
+    for name, radius in (('charge', None), ('charge_radius', SCALING_CHARGE_RADIUS)):
+        charge = ChargeHeuristic(board.size, radius)
+
+        def charge_fresh():
+            charge.states = []
+            return charge.get_child_values(board)
+        results[name + '.get_child_values'] = time_call(charge_fresh, min_time)
+    window = LocalityWindow(SCALING_CANDIDATE_RADIUS)
+    results['window.allowed'] = time_call(lambda: window.allowed(board, 2), min_time)
+
+    for name, options in (('move', {}), ('move_local', {'candidate_radius': SCALING_CANDIDATE_RADIUS})):
+        player = AlphaBetaPlayer(board.turn, TwoDistanceHeuristic(), max_time=move_time, negamax=True, **options)
+        stats = player.new_stats()
+        player.ordering.new_search(board)
+        time_manager = TimeManager(move_time=move_time)
+        time_manager.start_move(board)
+        start = default_timer()
+        _, _, depth = player.iterative_deepening(board, time_manager, player.transposition_table, False)
+        elapsed = default_timer() - start
+        result = {'seconds': elapsed, 'nodes': stats.nodes, 'nodes_per_sec': stats.nodes / elapsed if elapsed else 0,
+                  'depth': depth, 'tt_entries': len(player.transposition_table)}
+
+        player = AlphaBetaPlayer(board.turn, TwoDistanceHeuristic(), max_time=inf, negamax=True, collect_stats=False,
+                                 **options)
+        player.ordering.new_search(board)
+        time_manager = TimeManager(move_time=inf)
+        time_manager.start_move(board)
+        tracemalloc.start()
+        player.iterative_deepening(board, time_manager, player.transposition_table, False, depth)
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = result
+    return results
+
+
+# a report on how the heuristics and a timed move scale from small boards to big ones, on a position per size
+def scaling(sizes=SCALING_SIZES, fill=SCALING_FILL, min_time=0.5, move_time=SCALING_MOVE_TIME, name_filter=None):
+    rng = random.Random(CORPUS_SEED)
+    corpus = []
+    for size in sizes:
+        num_moves = int(size * size * fill)
+        corpus.append(('%dx%d_%dmoves' % (size, size, num_moves), size, random_position(size, num_moves, rng)))
+    results = {}
+    for name, size, move_list in corpus:
+        board = load_board(size, move_list)
+        prefix = '%s/scaling' % name
+        if name_filter and not any(f in prefix for f in name_filter):
+            continue
+        for key, result in bench_scaling(board, min_time, move_time).items():
+            results[prefix + '.' + key] = result
+            print('%-60s %s' % (prefix + '.' + key, format_result(result)), file=sys.stderr)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': CORPUS_SEED,
+            'min_time': min_time,
+            'move_time': move_time,
+        },
+        'results': results,
+    }
+
+
+# search benchmarks are expensive, so they only run on a few of the positions
+SEARCH_POSITIONS = {'5x5_6moves': 3, '7x7_12moves': 2, '11x11_30moves': 2}
+
+
+def run(min_time=0.5, name_filter=None, corpus=None):
+    if corpus is None:
+        corpus = build_corpus()
+    results = {}
+    for name, size, move_list in corpus:
+        board = load_board(size, move_list)
+        groups = [('board', lambda: bench_board(board, min_time)),
+                  ('heuristic', lambda: bench_heuristics(board, min_time)),
+                  ('monte_carlo', lambda: bench_monte_carlo(board, min_time))]
+        if name in SEARCH_POSITIONS:
+            groups.append(('alpha_beta', lambda: bench_alpha_beta(board, SEARCH_POSITIONS[name])))
+            groups.append(('alpha_beta_sorted', lambda: bench_alpha_beta(board, SEARCH_POSITIONS[name], True)))
+            groups.append(('iterative_deepening', lambda: bench_iterative_deepening(board, SEARCH_POSITIONS[name] + 1)))
+        for group, bench in groups:
+            prefix = '%s/%s' % (name, group)
+            if name_filter and not any(f in prefix for f in name_filter):
+                continue
+            for key, result in bench().items():
+                results[prefix + '.' + key] = result
+                print('%-60s %s' % (prefix + '.' + key, format_result(result)), file=sys.stderr)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': CORPUS_SEED,
+            'min_time': min_time,
+        },
+        'results': results,
+    }
+
+
+def format_result(result):
+    if 'peak_bytes' in result:
+        return '%10.4fs %8d nodes %10.0f nodes/s  depth %d  %d tt entries  %.1f MB peak' % (
+            result['seconds'], result['nodes'], result['nodes_per_sec'], result['depth'], result['tt_entries'],
+            result['peak_bytes'] / 1e6)
+    if 'nodes_per_sec' in result:
+        return '%10.4fs %8d nodes %10.0f nodes/s' % (result['seconds'], result['nodes'], result['nodes_per_sec'])
+    return '%12.3fus %12.0f ops/s' % (result['seconds'] * 1e6, result['ops_per_sec'])
+
+
+# the time per operation is the number we compare, since it's available for every benchmark
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    regressions = []
+    for key, result in sorted(current['results'].items()):
+        if key not in baseline['results']:
+            continue
+        old = baseline['results'][key]['seconds']
+        new = result['seconds']
+        if not old:
+            continue
+        change = (new - old) / old
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(key)
+        elif change < -threshold:
+            flag = 'faster'
+        print('%-60s %+7.1f%% %s' % (key, change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hex board, heuristics and search players')
+    parser.add_argument('--output', '-o', help='write the results as JSON to this file')
+    parser.add_argument('--compare', '-c', help='compare the results against a baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown counted as a regression (default %(default)s)')
+    parser.add_argument('--min-time', type=float, default=0.5, help='minimum seconds spent on each benchmark')
+    parser.add_argument('--quick', action='store_true', help='shorthand for a very short --min-time')
+    parser.add_argument('--filter', '-k', action='append', help='only run benchmarks containing this string')
+    parser.add_argument('--scaling', action='store_true',
+                        help='report how time and memory grow with the board size, up to 19x19, instead')
+    parser.add_argument('--move-time', type=float, default=SCALING_MOVE_TIME,
+                        help='seconds for each move in the scaling report (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    min_time = 0.02 if args.quick else args.min_time
+    if args.scaling:
+        results = scaling(min_time=min_time, move_time=args.move_time, name_filter=args.filter)
+    else:
+        results = run(min_time, args.filter)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('%d regression(s) found' % len(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
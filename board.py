@@ -26,9 +26,50 @@ class HexBoard:
         self.turn = 1
         # the player that's won the game
         self._winner = 0
+        # the only player who can have connected since the winner was last known, or None if it could be either.
+        # a move can't connect the other player, and play refuses moves once the game is over
+        self._mover = None
         # the group of stones that connect the sides
         self._winning_group = None
 
+    # builds a board from a grid of 1, -1 and 0, such as a row of a numpy array.
+    # the order the stones were played in is unknown, so the move list alternates between the players' stones
+    @staticmethod
+    def from_array(cells, turn=None, swap_rule=False):
+        board = HexBoard(len(cells), swap_rule)
+        board.board = [[int(v) for v in row] for row in cells]
+        stones = {1: [], -1: []}
+        for i, row in enumerate(board.board):
+            for j, v in enumerate(row):
+                if v:
+                    stones[v].append((i, j))
+        if turn is None:
+            turn = 1 if len(stones[1]) == len(stones[-1]) else -1
+        board.turn = turn
+        # the player who moved first has at least as many stones
+        first, second = (stones[1], stones[-1]) if len(stones[1]) >= len(stones[-1]) else (stones[-1], stones[1])
+        for i in range(len(first)):
+            board.move_list.append(first[i])
+            if i < len(second):
+                board.move_list.append(second[i])
+        board._winner = None
+        board._mover = None
+        return board
+
+    # a much faster alternative to deepcopy
+    def copy(self):
+        board = HexBoard.__new__(HexBoard)
+        board.board = [row[:] for row in self.board]
+        board.move_list = self.move_list[:]
+        board.size = self.size
+        board.swap_rule = self.swap_rule
+        board.turn = self.turn
+        board._winner = self._winner
+        board._mover = self._mover
+        # the winning group is never changed once it's found, so it can be shared
+        board._winning_group = self._winning_group
+        return board
+
     # for convenience, treat indexing on the hex board as indexing on the board itself
     def __getitem__(self, item):
         return self.board[item]
@@ -66,6 +107,7 @@ class HexBoard:
         if self.in_bounds(row, col) and self.board[row][col] is 0:
             self.board[row][col] = self.turn
             self.move_list.append((row, col))
+            self._mover = self.turn
             self.turn *= -1
             moved = True
             # in this new board state, we don't know if somebody's won
@@ -98,19 +140,22 @@ class HexBoard:
         else:
             self.board[row][col] = 0
 
-    # sets the winner of the match
-    def resign(self):
-        self._winner = -self.turn
+    # sets the winner of the match. by default, the player with the next move is the one resigning
+    def resign(self, player=None):
+        if player is None:
+            player = self.turn
+        self._winner = -player
         # print('Player',self.turn%3,'resigned')
         # print('Winner is',self.winner%3)
 
     # checks if a player has made a connection between their walls
     def is_connected(self, player, debug=False):
-        # search ordered by intended direction
+        # search ordered by intended direction. it starts from cells just past the far side, which each touch
+        # two cells of the side, except on a 1x1 board
         if player == 1:
-            searchq = [(self.size, i, self.size) for i in range(self.size-1)]
+            searchq = [(self.size, i, self.size) for i in range(max(self.size-1, 1))]
         else:
-            searchq = [(self.size, self.size, i) for i in range(self.size-1)]
+            searchq = [(self.size, self.size, i) for i in range(max(self.size-1, 1))]
         if debug: dist_grid = [['-'] * self.size for _ in range(self.size)]
         # the open set for adjacent cells
         parent = dict()
@@ -158,16 +203,17 @@ class HexBoard:
 
     # checks if either player has won
     def _update_winner(self):
-        group = self.is_connected(1)
-        if group:
-            self._winner = 1
-            self._winning_group = group
-            return
-        group = self.is_connected(-1)
-        if group:
-            self._winner = -1
-            self._winning_group = group
+        # a connection needs a stone in every row or column, which takes at least as many moves as the size
+        if len(self.move_list) < self.size:
+            self._winner = 0
+            self._winning_group = None
             return
+        for player in ((1, -1) if self._mover is None else (self._mover,)):
+            group = self.is_connected(player)
+            if group:
+                self._winner = player
+                self._winning_group = group
+                return
 
         self._winner = 0
         self._winning_group = None
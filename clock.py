@@ -0,0 +1,99 @@
+"""
+Time management for searches that are given a time limit,
+either a fixed amount of time per move, or a budget for the whole game
+"""
+from math import inf
+from timeit import default_timer
+
+# the fraction of the empty cells expected to be filled before somebody wins
+EXPECTED_FILL = 0.6
+# never plan for fewer than this many of our own moves remaining
+MIN_MOVES_LEFT = 4
+# how far past its planned time a move is allowed to run, and the most of the remaining budget it can ever use
+HARD_LIMIT_FACTOR = 4
+MAX_BUDGET_FRACTION = 0.5
+# planned time is extended when the best move keeps changing, and cut when it has settled
+UNSTABLE_FACTOR = 1.5
+STABLE_FACTOR = 0.6
+STABLE_ITERATIONS = 3
+# the guess at how much longer each iteration takes than the last, before there's any measurement
+DEFAULT_BRANCHING = 6
+MIN_BRANCHING = 1.5
+MAX_BRANCHING = 60
+
+
+# decides how long each move can take, and whether there's time for another iteration of iterative deepening
+class TimeManager:
+    def __init__(self, move_time=0, game_time=0, increment=0):
+        # a fixed amount of time for every move. used when there's no game budget
+        self.move_time = move_time
+        # the time left for the rest of the game, and the time added after every move
+        self.remaining = game_time
+        self.increment = increment
+        # the time the move started, the time it's planned to take, and the time it can never go past
+        self.start_time = None
+        self.soft_limit = 0
+        self.hard_limit = 0
+        # the results of each iteration of the current move, as (seconds, best move)
+        self.iterations = []
+
+    @property
+    def uses_game_time(self):
+        return not self.move_time
+
+    # plans the time for a move on the given board
+    def start_move(self, board):
+        self.start_time = default_timer()
+        self.iterations = []
+        if not self.uses_game_time:
+            self.soft_limit = self.hard_limit = self.move_time
+            return
+        empty = sum(row.count(0) for row in board.board)
+        # each player makes about half of the remaining moves
+        moves_left = max(MIN_MOVES_LEFT, empty * EXPECTED_FILL / 2)
+        self.soft_limit = self.remaining / moves_left + self.increment
+        self.hard_limit = min(self.soft_limit * HARD_LIMIT_FACTOR, self.remaining * MAX_BUDGET_FRACTION + self.increment)
+        self.soft_limit = min(self.soft_limit, self.hard_limit)
+
+    def elapsed(self):
+        return default_timer() - self.start_time
+
+    # records the result of a finished iteration of iterative deepening
+    def end_iteration(self, seconds, best_move):
+        self.iterations.append((seconds, best_move))
+
+    # the expected time for the next iteration, from the growth between the last two
+    def predict_next_iteration(self):
+        if not self.iterations:
+            return 0
+        last = self.iterations[-1][0]
+        if len(self.iterations) < 2 or self.iterations[-2][0] <= 0:
+            branching = DEFAULT_BRANCHING
+        else:
+            branching = min(max(last / self.iterations[-2][0], MIN_BRANCHING), MAX_BRANCHING)
+        return last * branching
+
+    # the planned time, stretched or shrunk by how settled the best move is
+    def target_time(self):
+        if not self.uses_game_time or len(self.iterations) < 2:
+            return self.soft_limit
+        moves = [move for seconds, move in self.iterations]
+        if moves[-1] != moves[-2]:
+            return min(self.soft_limit * UNSTABLE_FACTOR, self.hard_limit)
+        if len(moves) >= STABLE_ITERATIONS and len(set(moves[-STABLE_ITERATIONS:])) == 1:
+            return self.soft_limit * STABLE_FACTOR
+        return self.soft_limit
+
+    # only start another iteration if it's expected to finish in time
+    def should_start_iteration(self):
+        if self.hard_limit == inf:
+            return True
+        elapsed = self.elapsed()
+        return elapsed < self.target_time() and elapsed + self.predict_next_iteration() <= self.hard_limit
+
+    # charges the time used to the game budget
+    def end_move(self):
+        used = self.elapsed()
+        if self.uses_game_time:
+            self.remaining = max(self.remaining - used, 0) + self.increment
+        return used
@@ -0,0 +1,296 @@
+"""
+Runs a computer player as a long-running engine that speaks a GTP-like line protocol over stdin and stdout,
+so it can be driven by tournament managers, analysis GUIs and match scripts.
+The board, transposition table and search tree are kept between commands
+
+    python3 engine.py --player '{"type": "alpha_beta", "heuristic": "two_distance", "max_time": 5}'
+
+Moves are written like a1, with a letter for the column and a number for the row. Player 1 is black (b),
+and player 2 is white (w). A swap is written as swap-pieces. Supported commands:
+
+    protocol_version, name, version, known_command, list_commands, quit
+    boardsize <n>, clear_board, swap_rule <on|off>
+    play <b|w> <move|resign>, genmove <b|w>, undo
+    time_settings <main time> <byo-yomi time> <byo-yomi stones>, time_left <b|w> <seconds> <stones>
+    showboard, analyze [seconds], final_score
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import sys
+
+from board import HexBoard, SWAP_MOVE
+from clock import TimeManager
+from player import AlphaBetaPlayer, MonteCarloPlayer, build_player
+from record import sgf_move, parse_sgf_move
+
+PROTOCOL_VERSION = 2
+NAME = 'HexBoardGame'
+VERSION = '1.0'
+DEFAULT_PLAYER = {'type': 'alpha_beta', 'heuristic': 'shortest_path', 'max_time': 5}
+
+COLOURS = {'b': 1, 'black': 1, 'w': -1, 'white': -1}
+# the number of moves shown by analyze for a monte carlo search
+ANALYZE_MOVES = 10
+
+
+# a command that can't be carried out. the message is sent back as a failure response
+class EngineError(Exception):
+    pass
+
+
+def parse_colour(text):
+    colour = COLOURS.get(text.lower())
+    if colour is None:
+        raise EngineError('invalid color %r' % text)
+    return colour
+
+
+def parse_move(text):
+    if text.lower() in ('swap', 'swap-pieces'):
+        return SWAP_MOVE
+    try:
+        return parse_sgf_move(text.lower())
+    except ValueError:
+        raise EngineError('invalid move %r' % text)
+
+
+# the state of a game, and the player asked to make moves in it
+class Engine:
+    def __init__(self, spec=None, size=11, swap_rule=False):
+        self.spec = dict(DEFAULT_PLAYER if spec is None else spec)
+        self.swap_rule = swap_rule
+        self.board = HexBoard(size, swap_rule)
+        self.player = build_player(self.spec, 1, size)
+        # a clock for each colour, once time settings are given. until then the player uses its own limits
+        self.clocks = None
+        self.own_time_manager = getattr(self.player, 'time_manager', None)
+        self.running = True
+        self.commands = {
+            'protocol_version': self.protocol_version,
+            'name': self.name,
+            'version': self.version,
+            'known_command': self.known_command,
+            'list_commands': self.list_commands,
+            'quit': self.quit,
+            'boardsize': self.boardsize,
+            'clear_board': self.clear_board,
+            'swap_rule': self.set_swap_rule,
+            'play': self.play,
+            'genmove': self.genmove,
+            'undo': self.undo,
+            'time_settings': self.time_settings,
+            'time_left': self.time_left,
+            'showboard': self.showboard,
+            'analyze': self.analyze,
+            'final_score': self.final_score,
+        }
+
+    # handles one line of input, and returns the response to send back, or None for a blank line
+    def handle(self, line):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            return None
+        words = line.split()
+        command_id = ''
+        if words[0].isdigit():
+            command_id = words.pop(0)
+            if not words:
+                return '?%s missing command\n\n' % command_id
+        name, args = words[0].lower(), words[1:]
+        command = self.commands.get(name)
+        try:
+            if command is None:
+                raise EngineError('unknown command')
+            try:
+                inspect.signature(command).bind(*args)
+            except TypeError:
+                raise EngineError('wrong number of arguments')
+            result = command(*args)
+        except EngineError as error:
+            return '?%s %s\n\n' % (command_id, error)
+        return '=%s %s\n\n' % (command_id, '' if result is None else result)
+
+    # reads commands until quit or the end of the input. anything the players print goes to the log,
+    # so that it can't get mixed up with the responses
+    def run(self, commands=sys.stdin, responses=sys.stdout, log=sys.stderr):
+        with contextlib.redirect_stdout(log):
+            for line in commands:
+                response = self.handle(line)
+                if response is not None:
+                    responses.write(response)
+                    responses.flush()
+                if not self.running:
+                    break
+        self.player.stop_pondering()
+
+    def protocol_version(self):
+        return PROTOCOL_VERSION
+
+    def name(self):
+        return NAME
+
+    def version(self):
+        return VERSION
+
+    def known_command(self, name):
+        return 'true' if name.lower() in self.commands else 'false'
+
+    def list_commands(self):
+        return '\n'.join(self.commands)
+
+    def quit(self):
+        self.running = False
+
+    # a new board size needs a new player, since the players' tables are built for one size
+    def boardsize(self, size, *other):
+        try:
+            size = int(size)
+        except ValueError:
+            raise EngineError('boardsize not an integer')
+        if other and other[0] != str(size):
+            raise EngineError('only square boards are supported')
+        if size < 1:
+            raise EngineError('unacceptable size')
+        self.player.stop_pondering()
+        self.board = HexBoard(size, self.swap_rule)
+        self.player = build_player(self.spec, 1, size)
+        self.own_time_manager = getattr(self.player, 'time_manager', None)
+
+    # the player's tables are kept, since positions from the last game can come up again
+    def clear_board(self):
+        self.player.stop_pondering()
+        self.board = HexBoard(self.board.size, self.swap_rule)
+
+    def set_swap_rule(self, setting):
+        if setting.lower() not in ('on', 'off'):
+            raise EngineError('expected on or off')
+        if self.board.move_list:
+            raise EngineError('the swap rule can only be changed before the first move')
+        self.swap_rule = setting.lower() == 'on'
+        self.board.swap_rule = self.swap_rule
+
+    def play(self, colour, move):
+        colour = parse_colour(colour)
+        if self.board.winner != 0:
+            raise EngineError('the game is over')
+        if colour != self.board.turn:
+            raise EngineError('it is not %s\'s turn' % ('black' if colour == 1 else 'white'))
+        if move.lower() == 'resign':
+            self.board.resign(colour)
+            return None
+        if not self.board.play(*parse_move(move)):
+            raise EngineError('illegal move')
+        return None
+
+    def genmove(self, colour):
+        colour = parse_colour(colour)
+        board = self.board
+        if board.winner != 0:
+            raise EngineError('the game is over')
+        if colour != board.turn:
+            raise EngineError('it is not %s\'s turn' % ('black' if colour == 1 else 'white'))
+        player = self.player
+        player.player_num = colour
+        player.stopped = False
+        clock = self.clocks[colour] if self.clocks else None
+        num_moves = len(board.move_list)
+        if isinstance(player, AlphaBetaPlayer) and player.search_depth < 0:
+            player.time_manager = clock or self.own_time_manager
+            player.move(board)
+        elif isinstance(player, MonteCarloPlayer) and clock:
+            # the monte carlo player only has a time per move, so the clock plans it
+            clock.start_move(board)
+            player.max_time = clock.soft_limit
+            player.move(board)
+            clock.end_move()
+        else:
+            player.move(board)
+        if len(board.move_list) == num_moves:
+            if board.winner == 0:
+                board.resign(colour)
+            return 'resign'
+        return sgf_move(board.move_list[-1])
+
+    def undo(self):
+        if not self.board.move_list:
+            raise EngineError('cannot undo')
+        self.player.stop_pondering()
+        self.board.undo()
+
+    # main time is shared by the whole game, and byo-yomi is treated as an increment for every move
+    def time_settings(self, main_time, byo_yomi_time, byo_yomi_stones):
+        try:
+            main_time, byo_yomi_time, byo_yomi_stones = float(main_time), float(byo_yomi_time), int(byo_yomi_stones)
+        except ValueError:
+            raise EngineError('syntax error')
+        if main_time <= 0 and byo_yomi_time <= 0:
+            self.clocks = None
+            return None
+        increment = byo_yomi_time / byo_yomi_stones if byo_yomi_stones > 0 else 0
+        self.clocks = {colour: TimeManager(0, main_time, increment) for colour in (1, -1)}
+        return None
+
+    def time_left(self, colour, seconds, stones):
+        colour = parse_colour(colour)
+        try:
+            seconds = float(seconds)
+        except ValueError:
+            raise EngineError('syntax error')
+        if self.clocks:
+            self.clocks[colour].remaining = seconds
+        return None
+
+    def showboard(self):
+        text = io.StringIO()
+        with contextlib.redirect_stdout(text):
+            self.board.pretty_print()
+        return text.getvalue()
+
+    # searches the current position without playing a move, and reports the value and the expected moves.
+    # values are from black's point of view
+    def analyze(self, seconds=None):
+        if self.board.winner != 0:
+            raise EngineError('the game is over')
+        try:
+            seconds = None if seconds is None else float(seconds)
+        except ValueError:
+            raise EngineError('syntax error')
+        self.player.player_num = self.board.turn
+        self.player.stopped = False
+        result = self.player.analyze(self.board, seconds)
+        if result is None:
+            raise EngineError('this player cannot analyze positions')
+        lines = ['value %s' % result['value']]
+        if 'depth' in result:
+            lines.append('depth %d' % result['depth'])
+        if 'searches' in result:
+            lines.append('searches %d' % result['searches'])
+        lines.append('pv %s' % ' '.join(sgf_move(move) for move in result['pv']))
+        if 'visits' in result:
+            best = sorted(result['visits'].items(), key=lambda item: -item[1])[:ANALYZE_MOVES]
+            lines.append('visits %s' % ' '.join('%s %d' % (sgf_move(move), count) for move, count in best))
+        return '\n'.join(lines)
+
+    def final_score(self):
+        winner = self.board.winner
+        if winner == 0:
+            return '0'
+        return 'B+' if winner == 1 else 'W+'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a computer player as a GTP-style engine over stdin/stdout')
+    parser.add_argument('--player', type=json.loads, default=DEFAULT_PLAYER,
+                        help='json description of the player (default %s)' % json.dumps(DEFAULT_PLAYER))
+    parser.add_argument('--size', type=int, default=11)
+    parser.add_argument('--swap', action='store_true', help='play with the swap rule')
+    args = parser.parse_args(argv)
+
+    Engine(args.player, args.size, args.swap).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,74 @@
 A collection of heuristic functions,
 used by players to evaluate board positions
 """
+import array
 import itertools
+import json
 import math
+import os
+import sys
 from abc import ABC
-from copy import deepcopy
-from heapq import heappush, heappop
+from heapq import heappush, heappop, heapify
 from math import inf
 
-from board import SWAP_MOVE, ADJACENT
+from board import SWAP_MOVE, ADJACENT, HexBoard
+
+# numpy is only needed for evaluating many positions at once, so it isn't imported until then.
+# importing it takes longer than everything else the program needs to start
+np = None
+
+# where slow to compute tables are saved between runs
+CACHE_DIR = os.environ.get('HEX_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'HexBoardGame'))
+# part of the name of every cached charge grid. it has to change whenever base_charge or add_charge changes what
+# they work out, so grids saved by an older version are never loaded
+CHARGE_CACHE_VERSION = 2
+# the characters distances are shown with when debugging. anything further than the last one is shown as '+'
+DISTANCE_GLYPHS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('evaluating batches of positions requires numpy')
+        np = numpy
+    return np
+
+
+# the character a distance is shown with in a debug grid
+def distance_glyph(distance):
+    if distance == inf:
+        return '-'
+    return DISTANCE_GLYPHS[distance] if distance < len(DISTANCE_GLYPHS) else '+'
+
+
+# batches of positions are numpy arrays of shape (N, size, size), holding 1, -1 and 0 like HexBoard.board.
+# if the player to move isn't given, it's worked out from the number of stones
+def batch_turns(boards, turns=None):
+    require_numpy()
+    if turns is not None:
+        return np.asarray(turns)
+    stones = boards.reshape(len(boards), -1)
+    return np.where((stones == 1).sum(axis=1) == (stones == -1).sum(axis=1), 1, -1)
+
+
+# every child position of each board in a batch, stacked into one batch, along with the board and cell of each
+def batch_children(boards, turns):
+    n, size, _ = boards.shape
+    parent, rows, cols = np.nonzero(boards == 0)
+    children = boards[parent].copy()
+    children[np.arange(len(parent)), rows, cols] = turns[parent]
+    return children, parent, rows, cols
 
 
 # a heuristic interface
 class Heuristic(ABC):
+    # the most a single move is expected to change the value by, for futility pruning.
+    # None if the heuristic can't say, which turns the pruning off
+    futility_margin = None
+
     # gets the value of a given board state
     # if a player has won, the board value is maximally positive or negative
     def get_value(self, board, debug=False):
@@ -39,10 +95,41 @@ class Heuristic(ABC):
                 board.undo()
         return heuristic
 
+    # gets the value of every position in a batch, as a numpy array of shape (N,)
+    def get_values(self, boards, turns=None):
+        require_numpy()
+        boards = np.asarray(boards, dtype=np.int8)
+        turns = batch_turns(boards, turns)
+        return np.array([self.get_value(HexBoard.from_array(cells, int(turn))) for cells, turn in zip(boards, turns)],
+                        dtype=np.float64)
+
+    # the batch version of get_child_values, as a numpy array of shape (N, size, size).
+    # all of the children are evaluated together with get_values
+    def get_child_values_batch(self, boards, turns=None):
+        require_numpy()
+        boards = np.asarray(boards, dtype=np.int8)
+        turns = batch_turns(boards, turns)
+        result = np.zeros(boards.shape, dtype=np.float64)
+        values = self.get_values(boards, turns)
+        # finished games have the same value everywhere
+        over = np.isinf(values)
+        result[over] = values[over][:, None, None]
+        live = ~over
+        if live.any():
+            children, parent, rows, cols = batch_children(boards[live], turns[live])
+            live_result = result[live]
+            live_result[parent, rows, cols] = self.get_values(children, -turns[live][parent])
+            result[live] = live_result
+        return result
+
 
 # finds out which player has fewer moves remaining
 # in the shortest straight-line path across the board
 class ShortestPathHeuristic(Heuristic):
+    # a stone shortens its owner's path by at most one cell. blocking the opponent's path usually costs them
+    # one more, but can cost more when there's no other way around
+    futility_margin = 2
+
     def get_value(self, board, debug=False):
         if board.winner != 0:
             return board.winner * inf
@@ -52,12 +139,46 @@ class ShortestPathHeuristic(Heuristic):
             p2_dist = self.shortest_distance(board, -1, debug)
             return p2_dist - p1_dist
 
+    # evaluates every board in the batch at once, relaxing all of the distance grids together.
+    # the distances don't depend on who moves next, so the turns are only taken to match the other heuristics
+    def get_values(self, boards, turns=None):
+        require_numpy()
+        boards = np.asarray(boards, dtype=np.int8)
+        p1_dist = ShortestPathHeuristic.batch_distance(boards, 1)
+        # player 2 connects the top and bottom, which is player 1's problem on the transposed board
+        p2_dist = ShortestPathHeuristic.batch_distance(boards.transpose(0, 2, 1), -1)
+        values = p2_dist - p1_dist
+        values[p1_dist == 0] = inf
+        values[p2_dist == 0] = -inf
+        return values
+
+    # the shortest distance from the right edge to the left edge of each board, for the given player.
+    # empty cells cost 1, the player's stones cost 0 and the opponent's stones can't be crossed.
+    # every cell is relaxed from its six neighbours until nothing changes
+    @staticmethod
+    def batch_distance(boards, player):
+        require_numpy()
+        n, size, _ = boards.shape
+        cost = np.where(boards == player, 0.0, np.where(boards == 0, 1.0, inf))
+        # padded with a border of infinite distance, so that neighbours can be taken with slices
+        dist = np.full((n, size + 2, size + 2), inf)
+        inner = dist[:, 1:-1, 1:-1]
+        inner[:, :, -1] = cost[:, :, -1]
+        while True:
+            best = inner.copy()
+            for dy, dx in ADJACENT:
+                np.minimum(best, dist[:, 1 + dy:size + 1 + dy, 1 + dx:size + 1 + dx] + cost, out=best)
+            if np.array_equal(best, inner):
+                break
+            inner[...] = best
+        return inner[:, :, 0].min(axis=1)
+
     def shortest_distance(self, board, player, debug=False):
         # search ordered by min distance, intended direction
         if player == 1:
-            searchq = [(0, board.size, i, board.size) for i in range(board.size-1)]
+            searchq = [(0, board.size, i, board.size) for i in range(max(board.size - 1, 1))]
         else:
-            searchq = [(0, board.size, board.size, i) for i in range(board.size - 1)]
+            searchq = [(0, board.size, board.size, i) for i in range(max(board.size - 1, 1))]
         if debug: dist_grid = [['-'] * board.size for _ in range(board.size)]
         # the open set for adjacent cells
         searched = set()
@@ -90,12 +211,12 @@ class ShortestPathHeuristic(Heuristic):
                 if board_val == player and (next_row, next_col) not in searched:
                     searched.add((next_row, next_col))
                     heappush(searchq, (dist, next_col if player == 1 else next_row, next_row, next_col))
-                    if debug: dist_grid[next_row][next_col] = '0123456789ABCDEFGHIJKLMNOP'[dist]
+                    if debug: dist_grid[next_row][next_col] = distance_glyph(dist)
                 # unoccupied cells increase the distance
                 elif board_val == 0 and (next_row, next_col) not in searched:
                     searched.add((next_row, next_col))
                     heappush(searchq, (dist + 1, next_col if player == 1 else next_row, next_row, next_col))
-                    if debug: dist_grid[next_row][next_col] = '0123456789ABCDEFGHIJKLMNOP'[dist + 1]
+                    if debug: dist_grid[next_row][next_col] = distance_glyph(dist + 1)
 
         if debug: board.pretty_print(chars=dist_grid)
         if connected:
@@ -104,99 +225,617 @@ class ShortestPathHeuristic(Heuristic):
         else:
             return inf
 
+    # the empty cells of one of the player's shortest paths across the board, found the same way as
+    # shortest_distance. empty if the player can't get across
+    def shortest_path(self, board, player):
+        size = board.size
+        if player == 1:
+            searchq = [(0, size, i, size) for i in range(max(size - 1, 1))]
+        else:
+            searchq = [(0, size, size, i) for i in range(max(size - 1, 1))]
+        cells = board.board
+        # the cell each cell was reached from. the cells off the edge the search starts from have none
+        parent = dict()
+        while searchq:
+            dist, weight, row, col = heappop(searchq)
+            if weight == 0:
+                break
+            for dy, dx in ADJACENT:
+                next_row = row + dy
+                next_col = col + dx
+                if not (0 <= next_row < size and 0 <= next_col < size) or (next_row, next_col) in parent:
+                    continue
+                board_val = cells[next_row][next_col]
+                if board_val == player or board_val == 0:
+                    parent[(next_row, next_col)] = (row, col)
+                    heappush(searchq, (dist if board_val else dist + 1, next_col if player == 1 else next_row,
+                                       next_row, next_col))
+        else:
+            return []
+        path = []
+        cell = (row, col)
+        while cell in parent:
+            if cells[cell[0]][cell[1]] == 0:
+                path.append(cell)
+            cell = parent[cell]
+        return path
+
+
+# a heuristic that keeps some state about the position it last evaluated.
+# rather than starting again for every board, it undoes and replays only the moves that differ,
+# which during a search is usually just the last one or two
+class IncrementalHeuristic(Heuristic):
+    def __init__(self):
+        # the size and moves of the position the state is currently for
+        self.size = 0
+        self.moves = []
+
+    # brings the state up to date with the board
+    def update(self, board):
+        moves = board.move_list
+        if board.size != self.size:
+            self.reset(board.size)
+        common = len(self.moves)
+        if moves[:common] != self.moves:
+            common = 0
+            for old, new in zip(self.moves, moves):
+                if old != new:
+                    break
+                common += 1
+        while len(self.moves) > common:
+            self.unplay()
+        for move in moves[common:]:
+            self.play(move)
+
+    # starts again from an empty board
+    def reset(self, size):
+        self.size = size
+        self.moves = []
+
+    # adds a move to the state. the player who made it is worked out from the number of moves
+    def play(self, move):
+        self.moves.append(move)
+
+    # takes the last move back out of the state
+    def unplay(self):
+        self.moves.pop()
+
+
+# the cells next to each cell of a board, as flat indices (row * size + col). worked out once for each size
+_cell_adjacency = dict()
+
+
+def cell_adjacency(size):
+    adjacency = _cell_adjacency.get(size)
+    if adjacency is None:
+        adjacency = [[(row + dy) * size + col + dx for dy, dx in ADJACENT
+                      if 0 <= row + dy < size and 0 <= col + dx < size]
+                     for row, col in itertools.product(range(size), repeat=2)]
+        _cell_adjacency[size] = adjacency
+    return adjacency
+
+
+# the two-distance of every empty cell for one player, kept up to date as stones are added.
+# a cell's two-distance is one more than the second lowest two-distance of its neighbours, since the opponent can
+# always block the best one. the player's own stones are see-through, so the neighbours of a cell include every empty
+# cell next to a group it touches. cells touching the side the player is heading for have a two-distance of 1
+class TwoDistanceMap:
+    def __init__(self, player, size, grid):
+        self.player = player
+        self.size = size
+        # the flat board, shared with the other player's map
+        self.grid = grid
+        self.adjacency = cell_adjacency(size)
+        # player 1 is measured from the right side to the left, and player 2 from the bottom to the top
+        if player == 1:
+            self.target = [col == size - 1 for row, col in itertools.product(range(size), repeat=2)]
+            self.source = [col == 0 for row, col in itertools.product(range(size), repeat=2)]
+        else:
+            self.target = [row == size - 1 for row, col in itertools.product(range(size), repeat=2)]
+            self.source = [row == 0 for row, col in itertools.product(range(size), repeat=2)]
+        # the result of neighbours for each cell, until a stone changes it
+        self.cache = [None] * (size * size)
+        self.labels = None
+        self.compute()
+
+    # the empty cells next to a cell, looking through the player's own stones,
+    # and whether the cell touches the target side (directly or through a group).
+    # the set is shared with the cache, so it mustn't be changed
+    def neighbours(self, cell):
+        entry = self.cache[cell]
+        if entry is None:
+            entry = self.cache[cell] = self.find_neighbours(cell)
+        return entry
+
+    # forgets the neighbours of every cell that a stone being added to or taken from a cell changes.
+    # the neighbours of a cell never depend on the cell itself, so the same cells are affected either way
+    def invalidate(self, cell):
+        cache = self.cache
+        cache[cell] = None
+        for other in self.find_neighbours(cell)[0]:
+            cache[other] = None
+
+    def find_neighbours(self, cell):
+        grid = self.grid
+        adjacency = self.adjacency
+        player = self.player
+        found = set()
+        touches = self.target[cell]
+        stones = []
+        seen = set()
+        for other in adjacency[cell]:
+            value = grid[other]
+            if value == 0:
+                found.add(other)
+            elif value == player:
+                seen.add(other)
+                stones.append(other)
+        while stones:
+            stone = stones.pop()
+            if self.target[stone]:
+                touches = True
+            for other in adjacency[stone]:
+                value = grid[other]
+                if value == 0:
+                    found.add(other)
+                elif value == player and other not in seen:
+                    seen.add(other)
+                    stones.append(other)
+        found.discard(cell)
+        return found, touches
+
+    # the two-distance a cell should have, given the labels of its neighbours
+    def evaluate(self, cell):
+        found, touches = self.neighbours(cell)
+        if touches:
+            return 1
+        labels = self.labels
+        best = second = inf
+        for other in found:
+            value = labels[other]
+            if value < second:
+                if value < best:
+                    best, second = value, best
+                else:
+                    second = value
+        return second + 1
+
+    # works out every label from scratch. cells are finished in order of distance, like dijkstra's algorithm,
+    # and a cell gets its label from the second of its neighbours to finish
+    def compute(self):
+        grid = self.grid
+        cells = len(grid)
+        # the list is reused, since undoing a move restores it in place
+        if self.labels is None:
+            self.labels = [inf] * cells
+        labels = self.labels
+        labels[:] = [inf] * cells
+        finished = [False] * cells
+        reached = [0] * cells
+        queue = []
+        for cell in range(cells):
+            if grid[cell] == 0 and self.neighbours(cell)[1]:
+                labels[cell] = 1
+                queue.append((1, cell))
+        heapify(queue)
+        while queue:
+            value, cell = heappop(queue)
+            if finished[cell]:
+                continue
+            finished[cell] = True
+            for other in self.neighbours(cell)[0]:
+                if finished[other]:
+                    continue
+                reached[other] += 1
+                if reached[other] == 2 and value + 1 < labels[other]:
+                    labels[other] = value + 1
+                    heappush(queue, (value + 1, other))
+
+    # the empty cells next to a group of the player's stones, including the given cell's.
+    # only empty cells are cached, since a group's liberties change without a stone next to every one of them
+    def liberties(self, cell):
+        return self.find_neighbours(cell)[0]
+
+    # updates the labels after the player puts a stone on a cell. the grid must already have the stone.
+    # joining groups can only bring cells closer, so labels are lowered outwards from the stone's group.
+    # every change is added to changes as (labels, cell, old label), so it can be undone
+    def add_own(self, cell, changes):
+        labels = self.labels
+        changes.append((labels, cell, labels[cell]))
+        labels[cell] = inf
+        queue = []
+        for other in self.liberties(cell):
+            value = self.evaluate(other)
+            if value < labels[other]:
+                queue.append((value, other))
+        self.lower(queue, changes)
+
+    # lowers labels from a queue of (new label, cell), and anything that's then closer because of them
+    def lower(self, queue, changes, allowed=None):
+        labels = self.labels
+        cache = self.cache
+        heapify(queue)
+        while queue:
+            value, cell = heappop(queue)
+            if value >= labels[cell]:
+                continue
+            if changes is not None:
+                changes.append((labels, cell, labels[cell]))
+            labels[cell] = value
+            for other in self.neighbours(cell)[0]:
+                # a neighbour can't get below one more than this cell
+                label = labels[other]
+                if label > value + 1 and (allowed is None or other in allowed):
+                    # the same as evaluate, which is called here more than anywhere else on big boards
+                    entry = cache[other]
+                    if entry is None:
+                        entry = cache[other] = self.find_neighbours(other)
+                    found, touches = entry
+                    if touches:
+                        new_value = 1
+                    else:
+                        best = second = inf
+                        for neighbour in found:
+                            neighbour_value = labels[neighbour]
+                            if neighbour_value < second:
+                                if neighbour_value < best:
+                                    best, second = neighbour_value, best
+                                else:
+                                    second = neighbour_value
+                        new_value = second + 1
+                    if new_value < label:
+                        heappush(queue, (new_value, other))
+
+    # updates the labels after the opponent puts a stone on a cell. the grid must already have the stone.
+    # blocking a cell can only push cells further away. first every cell that relied on the blocked cell is found,
+    # in order of distance, then just those cells are worked out again from the neighbours that are still valid
+    def add_opponent(self, cell, changes):
+        labels = self.labels
+        blocked = labels[cell]
+        changes.append((labels, cell, blocked))
+        labels[cell] = inf
+        if blocked == inf:
+            return
+        queue = [(labels[other], other) for other in self.find_neighbours(cell)[0] if blocked < labels[other] < inf]
+        heapify(queue)
+        checked = set()
+        invalid = set()
+        while queue:
+            value, other = heappop(queue)
+            if other in checked:
+                continue
+            checked.add(other)
+            found, touches = self.neighbours(other)
+            if touches:
+                continue
+            # a label is still right if two neighbours that are still valid are closer
+            support = 0
+            for neighbour in found:
+                if labels[neighbour] < value and neighbour not in invalid:
+                    support += 1
+                    if support == 2:
+                        break
+            if support == 2:
+                continue
+            invalid.add(other)
+            for neighbour in found:
+                if value < labels[neighbour] < inf and neighbour not in checked:
+                    heappush(queue, (labels[neighbour], neighbour))
+        for other in invalid:
+            changes.append((labels, other, labels[other]))
+            labels[other] = inf
+        queue = []
+        for other in invalid:
+            value = self.evaluate(other)
+            if value < inf:
+                queue.append((value, other))
+        # the invalid cells were already recorded, so their new labels don't need to be
+        self.lower(queue, None, invalid)
+
+    # the empty cells touching the side the player starts from, directly or through a group
+    def source_cells(self):
+        grid = self.grid
+        cells = set()
+        for cell, touches in enumerate(self.source):
+            if touches:
+                if grid[cell] == 0:
+                    cells.add(cell)
+                elif grid[cell] == self.player:
+                    cells |= self.liberties(cell)
+        return cells
+
+    # the two-distance across the board. if there isn't a two-distance path, the normal distance is used instead,
+    # plus a penalty large enough that it's never mistaken for a two-distance
+    def distance(self):
+        labels = self.labels
+        best = second = inf
+        for cell in self.source_cells():
+            value = labels[cell]
+            if value < second:
+                if value < best:
+                    best, second = value, best
+                else:
+                    second = value
+        if second < inf:
+            return second
+        return TwoDistanceHeuristic.DISCONNECTED + self.one_distance()
+
+    # the shortest distance across the board, the number of empty cells the player still has to fill
+    def one_distance(self):
+        cells = len(self.grid)
+        distance = [inf] * cells
+        queue = []
+        for cell in range(cells):
+            if self.grid[cell] == 0 and self.neighbours(cell)[1]:
+                distance[cell] = 1
+                queue.append((1, cell))
+        while queue:
+            value, cell = heappop(queue)
+            if value > distance[cell]:
+                continue
+            for other in self.neighbours(cell)[0]:
+                if value + 1 < distance[other]:
+                    distance[other] = value + 1
+                    heappush(queue, (value + 1, other))
+        return min((distance[cell] for cell in self.source_cells()), default=inf)
+
+
+# finds out which player has fewer moves remaining, if the opponent always blocks their best path.
+# the two-distance of every cell is kept for both players, and only the cells a move affects are updated
+class TwoDistanceHeuristic(IncrementalHeuristic):
+    # added to the distance of a player without any two-distance path, so it's never confused with one that has
+    DISCONNECTED = 100
+    # like the shortest path, but a move can also give the opponent's second best path a detour
+    futility_margin = 3
+
+    def __init__(self):
+        super(TwoDistanceHeuristic, self).__init__()
+        self.grid = None
+        self.maps = None
+        # the label changes made by each move, so they can be undone
+        self.history = []
 
-# finds out which player has the shorter remaining path using "Two Distance"
-# which picks the second best options as it moves across the board
-class TwoDistanceHeuristic(Heuristic):
     def get_value(self, board, debug=False):
         if board.winner != 0:
             return board.winner * inf
+        self.update(board)
+        if debug:
+            for player in (1, -1):
+                labels = self.maps[player].labels
+                board.pretty_print(chars=[[distance_glyph(labels[row * board.size + col])
+                                           for col in range(board.size)] for row in range(board.size)])
+        return self.maps[-1].distance() - self.maps[1].distance()
+
+    def reset(self, size):
+        super(TwoDistanceHeuristic, self).reset(size)
+        self.grid = [0] * (size * size)
+        self.maps = {1: TwoDistanceMap(1, size, self.grid), -1: TwoDistanceMap(-1, size, self.grid)}
+        self.history = []
+
+    def play(self, move):
+        changes = []
+        if move == SWAP_MOVE:
+            # the swap moves the only stone on the board, so it's simplest to start again
+            row, col = self.moves[0]
+            self.grid[row * self.size + col] = 0
+            self.grid[col * self.size + row] = -1
+            for board_map in self.maps.values():
+                changes.append((board_map.labels, None, board_map.labels[:]))
+                board_map.cache[:] = [None] * len(self.grid)
+                board_map.compute()
         else:
-            # find the player that's closer to winning
-            p1_dist = self.two_distance(board, 1, debug=debug)
-            p2_dist = self.two_distance(board, -1, debug=debug)
-            val = p2_dist - p1_dist
-            # if a player does not have a 2-distance path, pick a high finite number, so we dont confuse it with a
-            # definite win or a definite loss
-            if math.isinf(val):
-                val = int(math.copysign(100, val))
-                fallback = ShortestPathHeuristic()
-                val += fallback.get_value(board)
-            if math.isnan(val):
-                # if neither player has a path to their opposite side, we get nan
-                # in this rare case, revert to normal distance
-                fallback = ShortestPathHeuristic()
-                val = fallback.get_value(board)
-            return val
-
-    def two_distance(self, board, player, debug=False):
-        # search ordered by min distance, intended direction, then perpendicular direction
-        if player == 1:
-            searchq = [(0, board.size, i, board.size, (i, board.size)) for i in range(-1, board.size)]
+            player = 1 if len(self.moves) % 2 == 0 else -1
+            cell = move[0] * self.size + move[1]
+            self.grid[cell] = player
+            for board_map in self.maps.values():
+                board_map.invalidate(cell)
+            self.maps[player].add_own(cell, changes)
+            self.maps[-player].add_opponent(cell, changes)
+        self.history.append(changes)
+        super(TwoDistanceHeuristic, self).play(move)
+
+    def unplay(self):
+        move = self.moves[-1]
+        super(TwoDistanceHeuristic, self).unplay()
+        if move == SWAP_MOVE:
+            row, col = self.moves[0]
+            self.grid[col * self.size + row] = 0
+            self.grid[row * self.size + col] = 1
+            for board_map in self.maps.values():
+                board_map.cache[:] = [None] * len(self.grid)
         else:
-            searchq = [(0, board.size, board.size, i, (board.size, i)) for i in range(-1, board.size)]
-        # the best cell adjacent to each cell on the board
-        best_neighbor = [[None] * board.size for _ in range(board.size)]
-        # the best cell that's adjacent to the opposite wall
-        best_opposite = None
-        if debug: dist_grid = [['-'] * board.size for _ in range(board.size)]
-        # the open set for adjacent cells
-        searched = set()
-        # track the distance travelled
-        dist = -1
-        # track the last cell visited
-        row, col = -1, -1
-        connected = False
-        while searchq:
-            dist, weight, row, col, neighbor = heappop(searchq)
+            cell = move[0] * self.size + move[1]
+            for board_map in self.maps.values():
+                board_map.invalidate(cell)
+            self.grid[cell] = 0
+        for labels, cell, old in reversed(self.history.pop()):
+            if cell is None:
+                labels[:] = old
+            else:
+                labels[cell] = old
 
-            # if the main axis is at 0, we've crossed the whole board
-            if weight == 0:
-                if best_opposite is None:
-                    best_opposite = neighbor
-                elif best_opposite != neighbor:
-                    connected = True
-                    break
 
+# a cell and its neighbours, in the order they make up a pattern index
+NEIGHBOURHOOD = [(0, 0)] + ADJACENT
+# each cell of a pattern is empty, player 1's or player 2's. the sides of the board belong to the player connecting them
+EMPTY_CODE = 0
+PLAYER_CODE = {1: 1, -1: 2}
+NUM_PATTERNS = 3 ** len(NEIGHBOURHOOD)
+# the trained weights are stored as integers, in thousandths
+WEIGHT_SCALE = 1000
+DEFAULT_WEIGHTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pattern_weights.bin')
+
+
+# the code of every cell of a board padded by one cell on each side, with the padding set to the owner of that side
+def padded_codes(board):
+    size = len(board)
+    codes = [[EMPTY_CODE] * (size + 2) for _ in range(size + 2)]
+    for i in range(size):
+        codes[i + 1][0] = codes[i + 1][size + 1] = PLAYER_CODE[1]
+        codes[0][i + 1] = codes[size + 1][i + 1] = PLAYER_CODE[-1]
+        for j in range(size):
+            if board[i][j] != 0:
+                codes[i + 1][j + 1] = PLAYER_CODE[board[i][j]]
+    return codes
+
+
+# the index tables for a board size, worked out once.
+# neighbours[cell] is the padded index of each cell of its neighbourhood,
+# and affects[cell] lists (other cell, power of 3) for every pattern the cell is a part of
+_pattern_tables = dict()
+
+
+def pattern_tables(size):
+    tables = _pattern_tables.get(size)
+    if tables is None:
+        neighbours = []
+        affects = [[] for _ in range(size * size)]
+        for row, col in itertools.product(range(size), repeat=2):
+            cells = []
+            for k, (dy, dx) in enumerate(NEIGHBOURHOOD):
+                y, x = row + dy, col + dx
+                cells.append((y + 1) * (size + 2) + x + 1)
+                if 0 <= y < size and 0 <= x < size:
+                    affects[y * size + x].append((row * size + col, 3 ** k))
+            neighbours.append(cells)
+        tables = _pattern_tables[size] = (neighbours, affects)
+    return tables
+
+
+# the pattern index of every cell of the given boards, as an array of shape (N, size * size)
+def pattern_indices(boards):
+    require_numpy()
+    boards = np.asarray(boards, dtype=np.int8)
+    n, size, _ = boards.shape
+    codes = np.zeros((n, size + 2, size + 2), dtype=np.int64)
+    codes[:, 1:-1, 0] = codes[:, 1:-1, -1] = PLAYER_CODE[1]
+    codes[:, 0, 1:-1] = codes[:, -1, 1:-1] = PLAYER_CODE[-1]
+    codes[:, 1:-1, 1:-1] = np.where(boards == 1, PLAYER_CODE[1], np.where(boards == -1, PLAYER_CODE[-1], EMPTY_CODE))
+    neighbours = np.array(pattern_tables(size)[0])
+    powers = 3 ** np.arange(len(NEIGHBOURHOOD))
+    return codes.reshape(n, -1)[:, neighbours] @ powers
+
+
+# the winner of every board in a batch, found by spreading each player's stones out from one of their sides
+def batch_winners(boards):
+    require_numpy()
+    boards = np.asarray(boards, dtype=np.int8)
+    winners = np.zeros(len(boards), dtype=np.int64)
+    for player, grid in ((1, boards), (-1, boards.transpose(0, 2, 1))):
+        own = grid == player
+        reached = np.zeros(own.shape, dtype=bool)
+        reached[:, :, -1] = own[:, :, -1]
+        while True:
+            spread = reached.copy()
+            padded = np.pad(reached, ((0, 0), (1, 1), (1, 1)))
+            size = grid.shape[1]
             for dy, dx in ADJACENT:
-                next_row = row + dy
-                next_col = col + dx
+                spread |= padded[:, 1 + dy:size + 1 + dy, 1 + dx:size + 1 + dx]
+            spread &= own
+            if np.array_equal(spread, reached):
+                break
+            reached = spread
+        winners[reached[:, :, 0].any(axis=1)] = player
+    return winners
 
-                # efficiency optimization. faster than checking if the cell is out of bounds
-                try:
-                    if next_row < 0 or next_col < 0: continue
-                    else: board_val = board.board[next_row][next_col]
-                # if the position is not a legal board position, move on. faster than calling in-bounds
-                except IndexError: continue
-
-                if board_val == 0 and (next_row, next_col) not in searched:
-                    if best_neighbor[next_row][next_col] is None:
-                        best_neighbor[next_row][next_col] = neighbor
-                    elif best_neighbor[next_row][next_col] != neighbor:
-                        searched.add((next_row, next_col))
-                        heappush(searchq, (dist + 1, next_col if player == 1 else next_row, next_row, next_col, (next_row, next_col)))
-                        if debug: dist_grid[next_row][next_col] = '0123456789ABCDEFGHIJKLMNOP'[dist + 1]
-
-                elif board_val == player and (next_row, next_col) not in searched:
-                    if best_neighbor[next_row][next_col] is None:
-                        best_neighbor[next_row][next_col] = neighbor
-                        # we need to extend the neighborhood to the rest of the connected group
-                        # even though *this* cell doesnt have two neighbors, one of the connected cells might
-                        heappush(searchq, (dist, next_col if player == 1 else next_row, next_row, next_col, neighbor))
-                    elif best_neighbor[next_row][next_col] != neighbor:
-                        searched.add((next_row, next_col))
-                        best_neighbor[next_row][next_col] = neighbor
-                        heappush(searchq, (dist, next_col if player == 1 else next_row, next_row, next_col, neighbor))
-                        if debug: dist_grid[next_row][next_col] = '0123456789ABCDEFGHIJKLMNOP'[dist + 1]
 
-        if debug: board.pretty_print(chars=dist_grid)
+# reads a weight file written by train_patterns.py
+def load_weights(path=DEFAULT_WEIGHTS):
+    weights = array.array('h')
+    with open(path, 'rb') as f:
+        weights.frombytes(f.read())
+    if sys.byteorder != 'little':
+        weights.byteswap()
+    if len(weights) != NUM_PATTERNS + 1:
+        raise ValueError('%s has %d weights, expected %d' % (path, len(weights), NUM_PATTERNS + 1))
+    return list(weights)
 
-        # once the search is finished, build the list of the shortest path
-        if connected:
-            return dist
-        # if there is no way to reach the other side, treat it as infinite distance
+
+def save_weights(weights, path=DEFAULT_WEIGHTS):
+    weights = array.array('h', weights)
+    if sys.byteorder != 'little':
+        weights.byteswap()
+    with open(path, 'wb') as f:
+        f.write(weights.tobytes())
+
+
+# scores the pattern of stones around every cell with a trained weight, and adds them up.
+# the weights are learned from finished games by train_patterns.py.
+# the pattern indices are kept up to date as moves are played and undone,
+# so each evaluation during a search only looks at the few patterns the last move changed
+class PatternHeuristic(IncrementalHeuristic):
+    def __init__(self, weights=None):
+        super(PatternHeuristic, self).__init__()
+        if weights is None:
+            weights = load_weights() if os.path.exists(DEFAULT_WEIGHTS) else [0] * (NUM_PATTERNS + 1)
+        elif isinstance(weights, str):
+            weights = load_weights(weights)
+        # one integer weight for each pattern, and a last one for having the next move
+        self.weights = list(weights)
+        # the pattern index around every cell, and their total weight
+        self.patterns = None
+        self.total = 0
+
+    def get_value(self, board, debug=False):
+        if board.winner != 0:
+            return board.winner * inf
+        self.update(board)
+        return (self.total + board.turn * self.weights[NUM_PATTERNS]) / WEIGHT_SCALE
+
+    # a stone is in the patterns of itself and its six neighbours, and the move passes the turn on,
+    # so this bound always holds unless the move wins
+    @property
+    def futility_margin(self):
+        weights = self.weights[:NUM_PATTERNS]
+        return (len(NEIGHBOURHOOD) * (max(weights) - min(weights)) + 2 * abs(self.weights[NUM_PATTERNS])) / WEIGHT_SCALE
+
+    def reset(self, size):
+        super(PatternHeuristic, self).reset(size)
+        neighbours = pattern_tables(size)[0]
+        codes = sum(padded_codes([[0] * size for _ in range(size)]), [])
+        self.patterns = [sum(codes[cell] * 3 ** k for k, cell in enumerate(cells)) for cells in neighbours]
+        self.total = sum(self.weights[pattern] for pattern in self.patterns)
+
+    def play(self, move):
+        if move == SWAP_MOVE:
+            row, col = self.moves[0]
+            self.change(row * self.size + col, PLAYER_CODE[1], EMPTY_CODE)
+            self.change(col * self.size + row, EMPTY_CODE, PLAYER_CODE[-1])
         else:
-            return inf
+            player = 1 if len(self.moves) % 2 == 0 else -1
+            self.change(move[0] * self.size + move[1], EMPTY_CODE, PLAYER_CODE[player])
+        super(PatternHeuristic, self).play(move)
+
+    def unplay(self):
+        move = self.moves[-1]
+        super(PatternHeuristic, self).unplay()
+        if move == SWAP_MOVE:
+            row, col = self.moves[0]
+            self.change(col * self.size + row, PLAYER_CODE[-1], EMPTY_CODE)
+            self.change(row * self.size + col, EMPTY_CODE, PLAYER_CODE[1])
+        else:
+            player = 1 if len(self.moves) % 2 == 0 else -1
+            self.change(move[0] * self.size + move[1], PLAYER_CODE[player], EMPTY_CODE)
+
+    # changes the code of one cell, in every pattern it's a part of
+    def change(self, cell, old, new):
+        weights = self.weights
+        patterns = self.patterns
+        for other, power in pattern_tables(self.size)[1][cell]:
+            pattern = patterns[other]
+            patterns[other] = pattern + (new - old) * power
+            self.total += weights[patterns[other]] - weights[pattern]
+
+    # evaluates every board in the batch with one gather from the weights
+    def get_values(self, boards, turns=None):
+        require_numpy()
+        boards = np.asarray(boards, dtype=np.int8)
+        turns = batch_turns(boards, turns)
+        weights = np.array(self.weights, dtype=np.int64)
+        values = (weights[pattern_indices(boards)].sum(axis=1) + turns * weights[NUM_PATTERNS]) / WEIGHT_SCALE
+        winners = batch_winners(boards)
+        values[winners != 0] = winners[winners != 0] * inf
+        return values
 
 
 # unused class. Supposed to remember values from previous searches to aid search
@@ -219,23 +858,33 @@ class PastResultHeuristic(Heuristic):
 # supposed to represent choosing contested moves
 class ChargeHeuristic(Heuristic):
     _max_charge = 9
+    # the tables used for batches, for each board size
+    _batch_tables = dict()
+    # the charge of the sides of the board, for each board size
+    _base_charges = dict()
+    # 1 / distance ** 2 for every offset between two cells, for each size of charge grid
+    _inverse_squares = dict()
 
-    def __init__(self, size):
+    # with a radius, a stone only changes the charge of cells up to that many rows and columns away.
+    # the charge falls off with the square of the distance, so on a big board the far cells hardly change
+    def __init__(self, size, radius=None):
         super(ABC, self).__init__()
-        self._base_charge = self.base_charge(size)
+        self._base_charge = self.cached_base_charge(size)
         self.size = size
+        self.radius = radius
         self.states = []
 
     # finds an approximation of "curvature" if the board was an electric field
     def get_child_values(self, board, debug=False):
         same_moves = 0
         for move, state in zip(board.move_list, self.states):
-            if move == state[0][-1]:
-                same_moves += 1
+            if move != state[0][-1]:
+                break
+            same_moves += 1
         if same_moves == 0:
-            charge = deepcopy(self._base_charge)
+            charge = [row[:] for row in self._base_charge]
         else:
-            charge = deepcopy(self.states[same_moves-1][1])
+            charge = [row[:] for row in self.states[same_moves-1][1]]
         # remove the incorrect values
         self.states = self.states[:same_moves]
 
@@ -243,26 +892,111 @@ class ChargeHeuristic(Heuristic):
             y, x = board.move_list[i]
             # if they swapped, clear the board and mirror the first move
             if (y,x) == SWAP_MOVE:
-                charge = deepcopy(self._base_charge)
+                charge = [row[:] for row in self._base_charge]
                 x, y = board.move_list[0]
-            ChargeHeuristic.add_charge(board[y][x], charge, x, y)
+            ChargeHeuristic.add_charge(board[y][x], charge, x, y, self.radius)
 
             self.states.append((board.move_list[:i+1], charge))
             # copy the board so the one stored isnt modified
             if i+1 < len(board.move_list):
-                charge = deepcopy(charge)
+                charge = [row[:] for row in charge]
 
         # for row in charge:
         #     print(list((('%.4f'%x) if x >= 0 else ('%.3f'%x) for x in row)))
-        curve = [[0] * board.size for i in range(board.size)]
-        for y, x in itertools.product(range(1, board.size + 1), repeat=2):
+        return ChargeHeuristic.curvature(charge, board.size, board.turn)
+
+    # finds the curvature of a charge grid at every cell of the board
+    @staticmethod
+    def curvature(charge, size, turn):
+        curve = [[0] * size for i in range(size)]
+        for y, x in itertools.product(range(1, size + 1), repeat=2):
             k_e_w = ChargeHeuristic.curve(charge[y][x - 1], charge[y][x], charge[y][x + 1])
             k_ne_sw = ChargeHeuristic.curve(charge[y + 1][x - 1], charge[y][x], charge[y - 1][x + 1])
             k_nw_se = ChargeHeuristic.curve(charge[y + 1][x], charge[y][x], charge[y - 1][x])
-            curve[y - 1][x - 1] = min(k_e_w, k_ne_sw, k_nw_se) * max(k_e_w, k_ne_sw, k_nw_se)*-board.turn
-            # print('%.3f'%curve[y-1][x-1], end=',' if x < board.size else '\n')
+            curve[y - 1][x - 1] = min(k_e_w, k_ne_sw, k_nw_se) * max(k_e_w, k_ne_sw, k_nw_se)*-turn
+            # print('%.3f'%curve[y-1][x-1], end=',' if x < size else '\n')
         return curve
 
+    # the batch version of get_child_values. the charge of all the stones on a board is a convolution of the stones
+    # with the 1/distance^2 kernel, done here as one matrix product for the whole batch.
+    # get_child_values clamps the charge after every stone it adds, so the two can differ slightly on crowded boards
+    def get_child_values_batch(self, boards, turns=None):
+        require_numpy()
+        boards = np.asarray(boards, dtype=np.int8)
+        turns = batch_turns(boards, turns)
+        n, size, _ = boards.shape
+        kernel, base, frozen = ChargeHeuristic.batch_tables(size)
+        stones = boards.reshape(n, size * size).astype(np.float64)
+        charge = base.reshape(1, -1) + stones @ kernel
+        charge = charge.reshape(n, size + 2, size + 2)
+        # stones hold the maximum charge, and the edges never change
+        inner = charge[:, 1:-1, 1:-1]
+        inner[boards != 0] = boards[boards != 0] * ChargeHeuristic._max_charge
+        np.clip(charge, -ChargeHeuristic._max_charge, ChargeHeuristic._max_charge, out=charge)
+        charge[:, frozen] = base[frozen]
+        return ChargeHeuristic.batch_curvature(charge, turns)
+
+    # the kernel as a (size*size, (size+2)*(size+2)) matrix, the base charge, and the cells the base has frozen
+    @staticmethod
+    def batch_tables(size):
+        require_numpy()
+        tables = ChargeHeuristic._batch_tables.get(size)
+        if tables is None:
+            kernel = np.zeros((size * size, (size + 2) * (size + 2)))
+            for y, x in itertools.product(range(size), repeat=2):
+                for y2, x2 in itertools.product(range(size + 2), repeat=2):
+                    if (y2, x2) != (y + 1, x + 1):
+                        kernel[y * size + x, y2 * (size + 2) + x2] = \
+                            1 / ChargeHeuristic.distance(x + 1, y + 1, x2, y2) ** 2
+            base = np.array(ChargeHeuristic.cached_base_charge(size), dtype=np.float64)
+            frozen = np.abs(base) == ChargeHeuristic._max_charge
+            tables = ChargeHeuristic._batch_tables[size] = (kernel, base, frozen)
+        return tables
+
+    # the vectorized version of curvature, for a batch of charge grids
+    @staticmethod
+    def batch_curvature(charge, turns):
+        h2 = charge[:, 1:-1, 1:-1]
+        size = h2.shape[1]
+
+        def curve(h1, h3):
+            extreme = ((h2 <= h1) & (h2 <= h3)) | ((h2 >= h1) & (h2 >= h3))
+            return np.where(extreme, (h1 - h2) + (h3 - h2), 0.0)
+
+        k_e_w = curve(charge[:, 1:-1, :size], charge[:, 1:-1, 2:])
+        k_ne_sw = curve(charge[:, 2:, :size], charge[:, :size, 2:])
+        k_nw_se = curve(charge[:, 2:, 1:-1], charge[:, :size, 1:-1])
+        k = np.stack((k_e_w, k_ne_sw, k_nw_se))
+        return k.min(axis=0) * k.max(axis=0) * -np.asarray(turns).reshape(-1, 1, 1)
+
+    # the base charge is slow to work out, so it's kept for every size, and saved on disk for the next run.
+    # the grid is shared, so it must be copied before it's changed
+    @staticmethod
+    def cached_base_charge(size):
+        base = ChargeHeuristic._base_charges.get(size)
+        if base is not None:
+            return base
+        path = os.path.join(CACHE_DIR, 'charge_base_v%d_%d.json' % (CHARGE_CACHE_VERSION, size))
+        try:
+            with open(path) as f:
+                base = json.load(f)
+            if len(base) != size + 2 or any(len(row) != size + 2 for row in base):
+                base = None
+        except (OSError, ValueError):
+            base = None
+        if base is None:
+            base = ChargeHeuristic.base_charge(size)
+            # the cache is only a shortcut, so it doesn't matter if it can't be written
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(path + '.%d.tmp' % os.getpid(), 'w') as f:
+                    json.dump(base, f)
+                os.replace(path + '.%d.tmp' % os.getpid(), path)
+            except OSError:
+                pass
+        ChargeHeuristic._base_charges[size] = base
+        return base
+
     @staticmethod
     def base_charge(size):
         base = [[0] * (size + 2) for y in range(size + 2)]
@@ -280,18 +1014,41 @@ class ChargeHeuristic(Heuristic):
         diagonal = abs(x2 - x1) + abs(y2 - y1 + (x2 - x1))
         return min(manhattan, diagonal)
 
+    # the table of 1 / distance ** 2 for a charge grid with n rows, indexed [n - 1 + dy][n - 1 + dx]
+    @staticmethod
+    def inverse_squares(n):
+        table = ChargeHeuristic._inverse_squares.get(n)
+        if table is None:
+            table = ChargeHeuristic._inverse_squares[n] = [
+                [1 / ChargeHeuristic.distance(0, 0, dx, dy) ** 2 if (dy, dx) != (0, 0) else 0
+                 for dx in range(1 - n, n)] for dy in range(1 - n, n)]
+        return table
+
+    # adds a stone's charge to the grid. with a radius, only the cells within that many rows and columns change
     @staticmethod
-    def add_charge(sign, charge, x, y):
+    def add_charge(sign, charge, x, y, radius=None):
         x += 1
         y += 1
-        for y2, x2 in itertools.product(range(len(charge)), repeat=2):
-            if abs(charge[y2][x2]) == ChargeHeuristic._max_charge:
-                continue
-            if (y2, x2) == (y, x):
-                charge[y2][x2] = sign * ChargeHeuristic._max_charge
-            else:
-                charge[y2][x2] += sign * (1 / ChargeHeuristic.distance(x, y, x2, y2) ** 2)
-            charge[y2][x2] = max(min(charge[y2][x2], ChargeHeuristic._max_charge), -ChargeHeuristic._max_charge)
+        n = len(charge)
+        max_charge = ChargeHeuristic._max_charge
+        table = ChargeHeuristic.inverse_squares(n)
+        if radius is None:
+            rows = cols = range(n)
+        else:
+            rows = range(max(y - radius, 0), min(y + radius + 1, n))
+            cols = range(max(x - radius, 0), min(x + radius + 1, n))
+        for y2 in rows:
+            row = charge[y2]
+            weights = table[n - 1 + y2 - y]
+            for x2 in cols:
+                value = row[x2]
+                if value == max_charge or value == -max_charge:
+                    continue
+                if y2 == y and x2 == x:
+                    value = sign * max_charge
+                else:
+                    value += sign * weights[n - 1 + x2 - x]
+                row[x2] = max(min(value, max_charge), -max_charge)
 
     @staticmethod
     def inverse_radius(h1, h2, h3):
@@ -0,0 +1,106 @@
+"""
+Restricts the moves an alpha-beta search tries on big boards.
+A 19x19 board has hundreds of legal moves, but nearly all of the ones worth searching are close to the stones
+already played, or on one of the players' shortest paths across the board. The window counts the stones near every
+cell, and only changes the counts around the stones that differ from the last position it was given
+"""
+import itertools
+
+from board import SWAP_MOVE
+from heuristic import IncrementalHeuristic, ShortestPathHeuristic
+
+# the cells within a distance of each cell, as flat indices (row * size + col), for each (size, radius)
+_neighbourhoods = dict()
+
+
+def neighbourhoods(size, radius):
+    key = (size, radius)
+    table = _neighbourhoods.get(key)
+    if table is None:
+        # distance on a hex grid, where (-1, 1) and (1, -1) are neighbours
+        offsets = [(dy, dx) for dy, dx in itertools.product(range(-radius, radius + 1), repeat=2)
+                   if max(abs(dy), abs(dx), abs(dy + dx)) <= radius]
+        table = _neighbourhoods[key] = [[(row + dy) * size + col + dx for dy, dx in offsets
+                                         if 0 <= row + dy < size and 0 <= col + dx < size]
+                                        for row, col in itertools.product(range(size), repeat=2)]
+    return table
+
+
+# the moves worth searching: empty cells within radius of a stone, and the empty cells of each player's shortest path.
+# finding the paths costs about as much as evaluating the position, so they're only added with path_depth left
+class LocalityWindow(IncrementalHeuristic):
+    def __init__(self, radius=2, path_depth=2):
+        super(LocalityWindow, self).__init__()
+        self.radius = radius
+        self.path_depth = path_depth
+        self.paths = ShortestPathHeuristic()
+        # near[cell] is the number of stones within radius of the cell
+        self.near = None
+        self.neighbourhoods = None
+        self.flags = None
+
+    def reset(self, size):
+        super(LocalityWindow, self).reset(size)
+        self.near = [0] * (size * size)
+        self.neighbourhoods = neighbourhoods(size, self.radius)
+        self.flags = [False] * (size * size)
+
+    def play(self, move):
+        size = self.size
+        if move == SWAP_MOVE:
+            # the only stone moves to the mirrored cell
+            row, col = self.moves[0]
+            self.count(row * size + col, -1)
+            self.count(col * size + row, 1)
+        else:
+            self.count(move[0] * size + move[1], 1)
+        super(LocalityWindow, self).play(move)
+
+    def unplay(self):
+        move = self.moves[-1]
+        super(LocalityWindow, self).unplay()
+        size = self.size
+        if move == SWAP_MOVE:
+            row, col = self.moves[0]
+            self.count(col * size + row, -1)
+            self.count(row * size + col, 1)
+        else:
+            self.count(move[0] * size + move[1], -1)
+
+    def count(self, cell, change):
+        near = self.near
+        for other in self.neighbourhoods[cell]:
+            near[other] += change
+
+    # a flag for every cell, set if it's empty and inside the window. the list is reused by the next call,
+    # so it has to be used before searching any deeper. the swap is always worth searching, and isn't included
+    def allowed(self, board, depth):
+        self.update(board)
+        size = board.size
+        flags = self.flags
+        near = self.near
+        cell = 0
+        found = False
+        for row in board.board:
+            for value in row:
+                flag = flags[cell] = value == 0 and near[cell] > 0
+                found = found or flag
+                cell += 1
+        if not self.moves:
+            # with no stones yet, the window is around the centre
+            for other in self.neighbourhoods[(size // 2) * size + size // 2]:
+                flags[other] = True
+            found = True
+        if depth >= self.path_depth:
+            for player in (1, -1):
+                for row, col in self.paths.shortest_path(board, player):
+                    flags[row * size + col] = True
+                    found = True
+        if not found:
+            # every cell near a stone is full, so anything can be tried
+            cell = 0
+            for row in board.board:
+                for value in row:
+                    flags[cell] = value == 0
+                    cell += 1
+        return flags
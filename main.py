@@ -1,48 +1,59 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+from multiprocessing import Pool
 from timeit import default_timer
 
 from board import HexBoard
-from heuristic import TwoDistanceHeuristic, ShortestPathHeuristic, ChargeHeuristic
-from player import TextPlayer, RandomPlayer, AlphaBetaPlayer, ChargeHeuristicPlayer, GuiPlayer, MonteCarloPlayer
+from heuristic import TwoDistanceHeuristic, ShortestPathHeuristic, ChargeHeuristic, PatternHeuristic
+from player import TextPlayer, RandomPlayer, AlphaBetaPlayer, ChargeHeuristicPlayer, GuiPlayer, MonteCarloPlayer, \
+    build_player
+from record import GameRecorder, GameWriter, player_name, player_value
 import time
-from GUI import main as gui_main
 
-# preset settings for demonstrating the project
+# preset settings for demonstrating the project.
+# the players are only described here, and are built once a preset is chosen
 DEFAULTS = [
     None,
     {
         'size': 11,
         'swap': 'n',
         'players': [None,
-                    AlphaBetaPlayer(1, ShortestPathHeuristic(), 2, sorter=ChargeHeuristic(11)),
-                    AlphaBetaPlayer(-1, ShortestPathHeuristic(), 2, sorter=ChargeHeuristic(11))]
+                    {'type': 'alpha_beta', 'heuristic': 'shortest_path', 'depth': 2, 'sorter': 'charge'},
+                    {'type': 'alpha_beta', 'heuristic': 'shortest_path', 'depth': 2, 'sorter': 'charge'}]
     },
     {
         'size': 11,
         'swap': 'n',
         'players': [None,
-                    AlphaBetaPlayer(1, TwoDistanceHeuristic(), 2),
-                    AlphaBetaPlayer(-1, TwoDistanceHeuristic(), 2)]
+                    {'type': 'alpha_beta', 'heuristic': 'two_distance', 'depth': 2},
+                    {'type': 'alpha_beta', 'heuristic': 'two_distance', 'depth': 2}]
     },
     {
         'size':11,
         'swap':'n',
         'players': [None,
-                    AlphaBetaPlayer(1, ShortestPathHeuristic(), 2, sorter=ChargeHeuristic(11)),
-                    AlphaBetaPlayer(-1, TwoDistanceHeuristic(), 2, sorter=ChargeHeuristic(11))]
+                    {'type': 'alpha_beta', 'heuristic': 'shortest_path', 'depth': 2, 'sorter': 'charge'},
+                    {'type': 'alpha_beta', 'heuristic': 'two_distance', 'depth': 2, 'sorter': 'charge'}]
     },
     {
         'size': 7,
         'swap': 'n',
         'players': [None,
-                    GuiPlayer(1),
-                    AlphaBetaPlayer(-1, TwoDistanceHeuristic(), 3, sorter=ChargeHeuristic(7))]
+                    {'type': 'gui'},
+                    {'type': 'alpha_beta', 'heuristic': 'two_distance', 'depth': 3, 'sorter': 'charge'}]
     },
     {
         'size':11,
         'swap':'n',
         'players': [None,
-                    GuiPlayer (1),
-                    AlphaBetaPlayer(-1, TwoDistanceHeuristic(), 2, sorter=ChargeHeuristic(11))]
+                    {'type': 'gui'},
+                    {'type': 'alpha_beta', 'heuristic': 'two_distance', 'depth': 2, 'sorter': 'charge'}]
     },
 ]
 
@@ -66,10 +77,11 @@ def text_get_rules(default=0):
             swap = DEFAULTS[default]['swap']
     swap = (swap == 'y')
 
-    if not default:
-        player = [None] * 3
-    else:
-        player = DEFAULTS[default]['players']
+    player = [None] * 3
+    if default:
+        specs = DEFAULTS[default]['players']
+        for i in (1, -1):
+            player[i] = build_player(specs[i], i, size)
     for i in (1, -1):
         if player[i] is not None:
             continue
@@ -103,15 +115,17 @@ def text_get_rules(default=0):
 def build_alpha_beta_player(player_num, size):
     heuristic_type = -1
     heuristic = None
-    while not (0 <= heuristic_type <= 1):
+    while not (0 <= heuristic_type <= 2):
         try:
-            heuristic_type = int(input('0 - Shortest Path\n1 - Two Distance\nheuristic type?: '))
+            heuristic_type = int(input('0 - Shortest Path\n1 - Two Distance\n2 - Trained Patterns\nheuristic type?: '))
         except ValueError:
             pass
     if heuristic_type == 0:
         heuristic = ShortestPathHeuristic()
     elif heuristic_type == 1:
         heuristic = TwoDistanceHeuristic()
+    elif heuristic_type == 2:
+        heuristic = PatternHeuristic()
     use_sort = None
     sorter = None
     while use_sort not in ('y', 'n'):
@@ -137,7 +151,11 @@ def build_alpha_beta_player(player_num, size):
             killer_moves = int(input('number of killer-moves?: '))
         except ValueError:
             pass
-    return AlphaBetaPlayer(player_num, heuristic, search_depth, max_time, sorter, killer_moves)
+    ponder = None
+    while ponder not in ('y', 'n'):
+        ponder = input("search during the opponent's turn? (y/n): ")
+    return AlphaBetaPlayer(player_num, heuristic, search_depth, max_time, sorter, killer_moves,
+                           ponder=(ponder == 'y'))
 
 
 # Unused monte-carlo player builder - This method is staying for potential future development (if we ever add a monte-
@@ -149,20 +167,35 @@ def build_monte_carlo_player(player_num, size):
             max_time = int(input('max time per move?: '))
         except ValueError:
             pass
-    return MonteCarloPlayer(player_num, size, max_time)
+    ponder = None
+    while ponder not in ('y', 'n'):
+        ponder = input("search during the opponent's turn? (y/n): ")
+    return MonteCarloPlayer(player_num, size, max_time, ponder=(ponder == 'y'))
 
 
-# Text-based UI
-def text_game(board, player):
+# Text-based UI. if an Analysis is given, it analyses every position of the game and prints its reports as json
+def text_game(board, player, record_path=None, analysis=None):
     debug_heuristic = ChargeHeuristic(board.size)
+    recorder = GameRecorder(board, (player_name(player[1]), player_name(player[-1])))
+    # the pondering search shares the interpreter with the player that's moving, and slows it down
+    if not (player[1].is_human() or player[-1].is_human()) and (player[1].ponder or player[-1].ponder):
+        print('warning: both players are computers, so pondering slows down the player to move')
+    if analysis is not None:
+        from analysis import print_reports
+        stop_reports = threading.Event()
+        threading.Thread(target=print_reports, args=(analysis, sys.stdout, stop_reports), daemon=True).start()
     while board.winner == 0:
         board.pretty_print()
         debug_heuristic.get_child_values(board,True)
+        if analysis is not None:
+            analysis.follow(board)
 
         print('Player', board.turn%3, 'to move', '●' if board.turn > 0 else '○')
 
         start = default_timer()
-        player[board.turn].move(board)
+        mover = player[board.turn]
+        mover.move(board)
+        recorder.update(player_value(mover))
 
         print('took %.2f seconds' % (default_timer()-start))
 
@@ -170,11 +203,22 @@ def text_game(board, player):
         # if not (player[1].is_human() or player[2].is_human()):
         #     time.sleep(1)
 
+    # the winner might still be pondering
+    for i in (1, -1):
+        if not player[i].is_human():
+            player[i].stop_pondering()
+    if analysis is not None:
+        stop_reports.set()
+        analysis.stop()
+
     board.pretty_print()
     print('Player', board.winner%3, 'Wins!')
+    if record_path:
+        with GameWriter(record_path) as writer:
+            writer.write(recorder.record())
 
 
-def main(use_gui=True, default=0):
+def main(use_gui=True, default=0, record_path=None):
     board, player = text_get_rules(default)
 
     # if one of the players is a GUI player, we're forced to use the gui
@@ -184,14 +228,176 @@ def main(use_gui=True, default=0):
             has_gui_player = True
 
     if has_gui_player or use_gui:
-        gui_main(board, player)
+        # tkinter is only needed for the gui, so it isn't imported for text games
+        from GUI import main as gui_main
+        gui_main(board, player, record_path)
     else:
-        text_game(board, player)
+        text_game(board, player, record_path)
 #    import cProfile
 #    cProfile.run('text_game(use_default=True)', sort='time')
 
 
-if __name__ == '__main__':
+# the settings used for anything a config file or the command line leaves out
+DEFAULT_CONFIG = {
+    'size': 11,
+    'swap': False,
+    'player1': {'type': 'alpha_beta', 'heuristic': 'shortest_path', 'depth': 2},
+    'player2': {'type': 'alpha_beta', 'heuristic': 'shortest_path', 'depth': 2},
+    'games': 1,
+    'workers': 1,
+    'seed': None,
+    # in a batch, player1 and player2 take turns moving first
+    'alternate': True,
+    'gui': False,
+    # a game record file, a json lines file with the result of each game, and a json lines file of search statistics
+    'record': None,
+    'results': None,
+    'stats': None,
+    # a json description of a player that analyses every position of a single game
+    'analyze': None,
+}
+
+
+# reads a config file. toml needs python 3.11 or newer, anything else is read as json
+def load_config(path):
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+# combines the defaults, a preset, a config file and the command line, with later ones taking priority
+def build_config(args):
+    config = dict(DEFAULT_CONFIG)
+    if args.preset:
+        preset = DEFAULTS[args.preset]
+        config.update(size=preset['size'], swap=(preset['swap'] == 'y'),
+                      player1=preset['players'][1], player2=preset['players'][-1])
+    if args.config:
+        config.update(load_config(args.config))
+    for key in DEFAULT_CONFIG:
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+    # statistics are collected by the players, so the file is passed on to each of them
+    if config['stats']:
+        for key in ('player1', 'player2'):
+            config[key] = dict(config[key], stats_file=config[key].get('stats_file', config['stats']))
+    return config
+
+
+# a short description of a player, used to tell players apart in the results
+def spec_name(spec):
+    name = spec['type']
+    if 'heuristic' in spec:
+        name += '/' + spec['heuristic']
+    return name
+
+
+# plays one game of a batch without any output, and returns its result and encoded game record.
+# runs in a worker process
+def batch_game(args):
+    index, config = args
+    if config['seed'] is not None:
+        random.seed(config['seed'] + index)
+    keys = ['player1', 'player2']
+    if config['alternate'] and index % 2 == 1:
+        keys.reverse()
+    size = config['size']
+    board = HexBoard(size, config['swap'])
+    # both players are in this process, so a pondering player would only slow down the other one's search
+    player = [None, build_player(dict(config[keys[0]], ponder=False), 1, size),
+              build_player(dict(config[keys[1]], ponder=False), -1, size)]
+    recorder = GameRecorder(board, (spec_name(config[keys[0]]), spec_name(config[keys[1]])))
+    start = default_timer()
+    # the players print a lot while they search
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        while board.winner == 0:
+            mover = player[board.turn]
+            num_moves = len(board.move_list)
+            mover.move(board)
+            # a player that couldn't find a move loses, rather than holding up the batch
+            if board.winner == 0 and len(board.move_list) == num_moves:
+                board.resign()
+            recorder.update(player_value(mover))
+        for i in (1, -1):
+            player[i].stop_pondering()
+    result = {
+        'game': index,
+        'first': keys[0],
+        'winner': board.winner,
+        'winning_player': keys[0] if board.winner == 1 else keys[1],
+        'moves': len(board.move_list),
+        'seconds': default_timer() - start,
+    }
+    return result, recorder.record().encode()
+
+
+# plays many games unattended, spread over a pool of worker processes
+def play_batch(config, log=sys.stdout):
+    for key in ('player1', 'player2'):
+        if config[key]['type'] in ('text', 'gui'):
+            raise ValueError('batch games can only be played between computer players')
+    record_writer = GameWriter(config['record']) if config['record'] else None
+    results_file = open(config['results'], 'a') if config['results'] else None
+    wins = {'player1': 0, 'player2': 0}
+    games = [(i, config) for i in range(config['games'])]
+    pool = Pool(config['workers']) if config['workers'] > 1 else None
+    try:
+        for result, record in (pool.imap_unordered(batch_game, games) if pool else map(batch_game, games)):
+            wins[result['winning_player']] += 1
+            print('game %d: %s won in %d moves (%.1fs)' % (
+                result['game'], result['winning_player'], result['moves'], result['seconds']), file=log)
+            if record_writer:
+                record_writer.file.write(record)
+                record_writer.file.flush()
+            if results_file:
+                results_file.write(json.dumps(result) + '\n')
+                results_file.flush()
+    finally:
+        if pool:
+            pool.terminate()
+        if record_writer:
+            record_writer.close()
+        if results_file:
+            results_file.close()
+    print('player1 (%s) won %d, player2 (%s) won %d, elo difference %+.0f' % (
+        spec_name(config['player1']), wins['player1'], spec_name(config['player2']), wins['player2'],
+        elo_difference(wins['player1'], wins['player2'])), file=log)
+    return wins
+
+
+# how much stronger the first player is than the second on the elo scale, from their wins against each other
+def elo_difference(wins, losses):
+    if wins + losses == 0:
+        return 0.0
+    score = wins / (wins + losses)
+    if score in (0.0, 1.0):
+        return math.copysign(math.inf, score - 0.5)
+    return 400 * math.log10(score / (1 - score))
+
+
+# plays a single game, in the gui or the terminal, without asking for any settings
+def play_single(config):
+    if config['seed'] is not None:
+        random.seed(config['seed'])
+    board = HexBoard(config['size'], config['swap'])
+    player = [None, build_player(config['player1'], 1, board.size), build_player(config['player2'], -1, board.size)]
+    has_gui_player = any(isinstance(p, GuiPlayer) for p in player)
+    analysis = None
+    if config['analyze']:
+        from analysis import Analysis
+        analysis = Analysis(config['analyze'], board.size)
+    if has_gui_player or config['gui']:
+        from GUI import main as gui_main
+        gui_main(board, player, config['record'], analysis)
+    else:
+        text_game(board, player, config['record'], analysis)
+
+
+def interactive():
     use_gui = 0
     while use_gui not in ('y', 'n'):
         use_gui = input('use gui? (y/n): ')
@@ -203,4 +409,37 @@ if __name__ == '__main__':
             preset = int(input('Preset number 1-%d? (0 for custom):' % (len(DEFAULTS) - 1)))
         except ValueError:
             pass
-    main(use_gui, preset)
+    record_path = input('file to save the game to (blank for none): ').strip() or None
+    main(use_gui, preset, record_path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Play Hex. With no arguments, the settings are asked for')
+    parser.add_argument('--config', help='a json or toml file of settings')
+    parser.add_argument('--preset', type=int, choices=range(1, len(DEFAULTS)), help='start from one of the presets')
+    parser.add_argument('--size', type=int)
+    parser.add_argument('--swap', action='store_true', default=None, help='play with the swap rule')
+    parser.add_argument('--player1', type=json.loads, help='json description of player 1, '
+                        'e.g. {"type": "alpha_beta", "heuristic": "two_distance", "max_time": 2}')
+    parser.add_argument('--player2', type=json.loads, help='json description of player 2')
+    parser.add_argument('--games', type=int, help='the number of games to play. more than one plays a batch')
+    parser.add_argument('--workers', type=int, help='processes used to play a batch')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--gui', action='store_true', default=None)
+    parser.add_argument('--record', help='game record file to append the games to')
+    parser.add_argument('--results', help='json lines file to append the result of each batch game to')
+    parser.add_argument('--stats', help='json lines file to append the search statistics of every move to')
+    parser.add_argument('--analyze', type=json.loads, help='json description of a player that analyses the game '
+                        'as it goes, shown as a heatmap in the gui and printed as json lines in the terminal')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        interactive()
+    else:
+        config = build_config(parse_args())
+        if config['games'] > 1:
+            play_batch(config)
+        else:
+            play_single(config)
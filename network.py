@@ -0,0 +1,173 @@
+"""
+A small convolutional policy/value network for Hex that only needs NumPy, used by the monte carlo player to
+evaluate leaf positions in batches instead of playing them out randomly.
+Positions are turned around so the player to move always connects the left and right sides. Each layer looks at
+a cell and its 6 neighbours, and the sides of the board count as their owner's stones, like the pattern heuristic.
+The network gives a prior probability for every empty cell, and a value from -1 to 1 for the player to move
+"""
+import os
+
+import numpy as np
+
+from board import ADJACENT
+
+DEFAULT_NETWORK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'network_weights.npz')
+# the cell itself, then its neighbours
+TAPS = [(0, 0)] + ADJACENT
+# the input planes: the player to move's stones, the opponent's stones, and empty cells
+PLANES = 3
+
+
+# the boards turned around so the player to move is player 1, who connects the left and right sides.
+# turning player 2's position into player 1's mirrors it across the diagonal and swaps the colours
+def canonical(boards, turns):
+    boards = np.array(boards, dtype=np.int8)
+    flip = np.asarray(turns) == -1
+    boards[flip] = -np.transpose(boards[flip], (0, 2, 1))
+    return boards
+
+
+# the input planes of canonical boards, padded by one cell on each side, with shape (N, size + 2, size + 2, PLANES)
+def features(boards):
+    n, size = boards.shape[0], boards.shape[1]
+    x = np.zeros((n, size + 2, size + 2, PLANES), dtype=np.float32)
+    inner = x[:, 1:-1, 1:-1]
+    inner[..., 0] = boards == 1
+    inner[..., 1] = boards == -1
+    inner[..., 2] = boards == 0
+    # the left and right sides belong to the player to move, the top and bottom to the opponent
+    x[:, 1:-1, 0, 0] = x[:, 1:-1, -1, 0] = 1
+    x[:, 0, 1:-1, 1] = x[:, -1, 1:-1, 1] = 1
+    return x
+
+
+# the cells a tap of the layers reads for every cell, from a padded input. shape (N, size, size, channels)
+def shifted(padded, tap):
+    size = padded.shape[1] - 2
+    dy, dx = TAPS[tap]
+    return padded[:, 1 + dy:1 + dy + size, 1 + dx:1 + dx + size]
+
+
+class PolicyValueNetwork:
+    def __init__(self, path=None, filters=16, layers=3, seed=0):
+        if path is not None:
+            with np.load(path) as data:
+                self.params = {name: data[name] for name in data.files}
+        else:
+            rng = np.random.default_rng(seed)
+            self.params = dict()
+            channels = PLANES
+            for layer in range(layers):
+                fan_in = len(TAPS) * channels
+                self.params['conv%d_w' % layer] = (rng.standard_normal((fan_in, filters)) *
+                                                   np.sqrt(2 / fan_in)).astype(np.float32)
+                self.params['conv%d_b' % layer] = np.zeros(filters, dtype=np.float32)
+                channels = filters
+            self.params['policy_w'] = (rng.standard_normal(filters) * np.sqrt(1 / filters)).astype(np.float32)
+            self.params['policy_b'] = np.zeros((), dtype=np.float32)
+            self.params['value_w'] = (rng.standard_normal(filters) * np.sqrt(1 / filters)).astype(np.float32)
+            self.params['value_b'] = np.zeros((), dtype=np.float32)
+        self.layers = sum(1 for name in self.params if name.endswith('_w') and name.startswith('conv'))
+
+    def save(self, path=DEFAULT_NETWORK):
+        np.savez(path, **self.params)
+
+    # runs canonical boards through the network. returns the policy logits (N, size, size), with occupied cells
+    # at -inf, the values (N,), and what the backward pass needs.
+    # each layer adds up one product per tap, rather than multiplying every neighbourhood copied side by side,
+    # which would copy the whole input seven times
+    def forward(self, boards):
+        n, size = boards.shape[0], boards.shape[1]
+        padded = features(boards)
+        cache = []
+        hidden = None
+        for layer in range(self.layers):
+            if hidden is not None:
+                padded = np.zeros((n, size + 2, size + 2, hidden.shape[-1]), dtype=np.float32)
+                padded[:, 1:-1, 1:-1] = hidden
+            weights = self.params['conv%d_w' % layer]
+            channels = padded.shape[-1]
+            z = np.empty((n, size, size, weights.shape[1]), dtype=np.float32)
+            z[...] = self.params['conv%d_b' % layer]
+            for tap in range(len(TAPS)):
+                z += shifted(padded, tap) @ weights[tap * channels:(tap + 1) * channels]
+            hidden = np.maximum(z, 0)
+            cache.append((padded, z))
+        logits = hidden @ self.params['policy_w'] + self.params['policy_b']
+        logits = np.where(boards == 0, logits, -np.inf)
+        pooled = hidden.mean(axis=(1, 2))
+        values = np.tanh(pooled @ self.params['value_w'] + self.params['value_b'])
+        return logits, values, (cache, hidden, pooled)
+
+    # the prior of every cell (N, size, size) and the value for the player to move (N,), for boards in any
+    # orientation. this is what the monte carlo player calls with a batch of leaves
+    def evaluate(self, boards, turns):
+        turns = np.asarray(turns)
+        logits, values, _ = self.forward(canonical(boards, turns))
+        priors = softmax(logits)
+        flip = turns == -1
+        priors[flip] = np.transpose(priors[flip], (0, 2, 1))
+        return priors, values
+
+    # the loss on a batch of canonical boards, and its gradient for every parameter. the policy targets are
+    # probabilities over the cells (N, size, size), and the value targets are from the player to move's view
+    def gradients(self, boards, policy_targets, value_targets, weight_decay=1e-4):
+        n = len(boards)
+        logits, values, (cache, hidden, pooled) = self.forward(boards)
+        priors = softmax(logits)
+        log_priors = np.log(np.where(priors > 0, priors, 1))
+        policy_loss = -(policy_targets * log_priors).sum() / n
+        value_loss = ((values - value_targets) ** 2).mean()
+        grads = dict()
+
+        d_logits = (priors - policy_targets) / n
+        grads['policy_w'] = np.einsum('nhw,nhwf->f', d_logits, hidden)
+        grads['policy_b'] = d_logits.sum()
+        d_hidden = d_logits[..., None] * self.params['policy_w']
+
+        d_pre = 2 * (values - value_targets) / n * (1 - values ** 2)
+        grads['value_w'] = pooled.T @ d_pre
+        grads['value_b'] = d_pre.sum()
+        size = boards.shape[1]
+        d_hidden += (np.outer(d_pre, self.params['value_w']) / (size * size))[:, None, None, :]
+
+        for layer in reversed(range(self.layers)):
+            padded, z = cache[layer]
+            weights = self.params['conv%d_w' % layer]
+            channels = padded.shape[-1]
+            d_z = d_hidden * (z > 0)
+            flat_d_z = d_z.reshape(-1, d_z.shape[-1])
+            grads['conv%d_w' % layer] = np.concatenate([shifted(padded, tap).reshape(-1, channels).T @ flat_d_z
+                                                        for tap in range(len(TAPS))])
+            grads['conv%d_b' % layer] = d_z.sum(axis=(0, 1, 2))
+            if layer == 0:
+                break
+            d_padded = np.zeros(padded.shape, dtype=d_z.dtype)
+            for tap in range(len(TAPS)):
+                shifted(d_padded, tap)[...] += d_z @ weights[tap * channels:(tap + 1) * channels].T
+            d_hidden = d_padded[:, 1:-1, 1:-1]
+        for name, value in self.params.items():
+            if name.endswith('_w'):
+                grads[name] = grads[name] + weight_decay * value
+        return policy_loss, value_loss, grads
+
+
+# the softmax over each board's cells, skipping cells at -inf
+def softmax(logits):
+    flat = logits.reshape(len(logits), -1)
+    flat = np.exp(flat - flat.max(axis=1, keepdims=True))
+    return (flat / flat.sum(axis=1, keepdims=True)).reshape(logits.shape)
+
+
+_networks = dict()
+
+
+# loads a network once per path, so every player using it shares one copy.
+# a network with random weights is only for training, so it has to be made with PolicyValueNetwork()
+def load_network(path=DEFAULT_NETWORK):
+    network = _networks.get(path)
+    if network is None:
+        if not os.path.exists(path):
+            raise FileNotFoundError('no network weights at %s' % path)
+        network = _networks[path] = PolicyValueNetwork(path)
+    return network
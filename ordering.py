@@ -0,0 +1,95 @@
+"""
+Move ordering for alpha-beta search.
+Remembers which moves caused cutoffs, so they can be tried first elsewhere in the tree
+"""
+from board import SWAP_MOVE
+
+
+class MoveOrdering:
+    def __init__(self, killer_moves=6):
+        # the number of cutoff moves to remember for each move number
+        self.killer_moves = killer_moves
+        # killers are kept by the number of moves played, rather than the depth left in the search.
+        # that way they stay at the right level between iterations of iterative deepening, and between moves
+        self.killers = dict()
+        # history[player][row * size + col] scores how often a move caused a cutoff for a player, anywhere in the tree
+        self.size = 0
+        self.history = None
+        # a bonus below 1 for cells near the centre, which breaks ties between moves with the same history
+        self.centrality = None
+        # the move that last refuted each (player, opponent's move) pair
+        self.countermoves = dict()
+
+    # prepares the tables for a search on the given board
+    def new_search(self, board):
+        if self.size != board.size:
+            self.size = board.size
+            self.history = {1: [0] * (board.size * board.size), -1: [0] * (board.size * board.size)}
+            self.centrality = centrality(board.size)
+            self.killers.clear()
+            self.countermoves.clear()
+            return
+        # older results are less likely to apply to the new position, so they count for less
+        for scores in self.history.values():
+            for i, score in enumerate(scores):
+                scores[i] = score >> 1
+        # killers from before the current move can never be used again
+        num_moves = len(board.move_list)
+        for old in [n for n in self.killers if n < num_moves]:
+            del self.killers[old]
+
+    # the moves to try before any others: the transposition table's best move, killers, then the countermove.
+    # they aren't guaranteed to be legal
+    def first_moves(self, board, tt_move=None):
+        moves = []
+        if tt_move is not None:
+            moves.append(tt_move)
+        killers = self.killers.get(len(board.move_list))
+        if killers:
+            moves.extend(killers)
+        if board.move_list:
+            countermove = self.countermoves.get((board.turn, board.move_list[-1]))
+            if countermove is not None:
+                moves.append(countermove)
+        return moves
+
+    def is_killer(self, board, move):
+        killers = self.killers.get(len(board.move_list))
+        return killers is not None and move in killers
+
+    # sorts moves by how often they've caused cutoffs
+    def sort(self, board, options):
+        scores = self.history[board.turn]
+        bonus = self.centrality
+        size = board.size
+        options.sort(key=lambda m: 0 if m == SWAP_MOVE else -scores[m[0] * size + m[1]] - bonus[m[0] * size + m[1]])
+
+    # records a move that caused a cutoff with the given depth remaining
+    def cutoff(self, board, move, depth):
+        num_moves = len(board.move_list)
+        killers = self.killers.get(num_moves)
+        if killers is None:
+            killers = self.killers[num_moves] = []
+        if move not in killers and self.killer_moves > 0:
+            killers.append(move)
+            if len(killers) > self.killer_moves:
+                killers.pop(0)
+        if move != SWAP_MOVE:
+            # deeper cutoffs save more work, so they count for more
+            self.history[board.turn][move[0] * board.size + move[1]] += depth * depth
+        if board.move_list:
+            self.countermoves[(board.turn, board.move_list[-1])] = move
+
+
+# a score in [0, 1) for every cell, higher closer to the centre of the board
+def centrality(size):
+    centre = (size - 1) / 2
+    scores = []
+    for row in range(size):
+        for col in range(size):
+            dy = row - centre
+            dx = col - centre
+            # distance on a hex grid, where (-1, 1) and (1, -1) are neighbours
+            distance = max(abs(dy), abs(dx), abs(dy + dx))
+            scores.append(1 - (distance + 1) / (size + 1))
+    return scores
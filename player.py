@@ -5,16 +5,25 @@ Maybe these should be separated into their own files?
 
 import random
 import itertools
+import threading
 from abc import ABC, abstractmethod
-from copy import deepcopy
+from copy import copy
 
 import math
 from math import inf
 from timeit import default_timer
 
 from board import SWAP_MOVE, HexBoard
-from heuristic import ChargeHeuristic
+from heuristic import ChargeHeuristic, ShortestPathHeuristic, TwoDistanceHeuristic, PatternHeuristic
+from locality import LocalityWindow
+from clock import TimeManager
+from ordering import MoveOrdering
+from stats import SearchStats
+from transposition import TranspositionTable, SharedTranspositionTable
 
+# pondering has no clock, so it stops after searching this many nodes, or once the monte carlo tree is this big.
+# otherwise a slow opponent would let the tables grow until they used up the memory
+MAX_PONDER_NODES = 500000
 
 # a player interface
 class Player(ABC):
@@ -40,9 +49,82 @@ class HumanPlayer(Player, ABC):
 
 
 class ComputerPlayer(Player, ABC):
+    def __init__(self, player_num, collect_stats=True, stats_file=None):
+        super(ComputerPlayer, self).__init__(player_num)
+        # if statistics are turned off, the search skips all of its counters
+        self.collect_stats = collect_stats
+        # a file that the statistics of every move are appended to, as json lines
+        self.stats_file = stats_file
+        # the statistics of the current or most recent move
+        self.stats = None
+        # a summary of the best move found so far, for showing while the search is running
+        self.progress = None
+        # set when a search running on another thread should finish as soon as possible
+        self.stopped = False
+        # whether the player keeps searching during the opponent's turn
+        self.ponder = False
+        self._ponderer = None
+        self._ponder_thread = None
+
     def is_human(self):
         return False
 
+    # asks a search running on another thread to stop. the player still makes a move with what it found
+    def stop(self):
+        self.stopped = True
+
+    # starts searching the given position on another thread, while the opponent decides on their move.
+    # the search runs on a shallow copy of the player, so it fills the same tables without touching the stats
+    def start_pondering(self, board):
+        self.stop_pondering()
+        if board.winner != 0:
+            return
+        ponderer = self.ponder_copy()
+        self._ponderer = ponderer
+        self._ponder_thread = threading.Thread(target=ponderer.ponder_search, args=(board.copy(),), daemon=True)
+        self._ponder_thread.start()
+
+    # the copy of the player that searches while pondering. players with scratch space that's only meant for one
+    # search at a time give the copy its own
+    def ponder_copy(self):
+        ponderer = copy(self)
+        ponderer.stats = None
+        ponderer.stats_file = None
+        ponderer.progress = None
+        ponderer.stopped = False
+        return ponderer
+
+    # waits for the pondering search to stop, so its tables can be used safely
+    def stop_pondering(self):
+        if self._ponder_thread is not None:
+            self._ponderer.stopped = True
+            self._ponder_thread.join()
+            self._ponder_thread = None
+            self._ponderer = None
+
+    # the search done while pondering. players that can ponder override this
+    def ponder_search(self, board):
+        pass
+
+    # searches a position without making a move, and returns a summary of what was found.
+    # players that can explain their moves override this
+    def analyze(self, board, max_time=None):
+        return None
+
+    # starts a new set of statistics for a move
+    def new_stats(self):
+        self.stats = SearchStats(type(self).__name__) if self.collect_stats else None
+        return self.stats
+
+    # finishes the statistics for a move, and returns them
+    def finish_stats(self, value=None, move=None, depth=None):
+        stats = self.stats
+        if stats is not None:
+            stats.finish(value, move, depth)
+            if self.stats_file:
+                stats.write_json(self.stats_file)
+        return stats
+
 
 # a human player that gets moves from the terminal
 class TextPlayer(HumanPlayer):
@@ -90,87 +172,271 @@ class RandomPlayer(ComputerPlayer):
 
 # uses bounded min-max tree search with alpha beta pruning
 class AlphaBetaPlayer(ComputerPlayer):
-    def __init__(self, player_num, heuristic, search_depth=-1, max_time=0, sorter=None, killer_moves=6):
-        super(AlphaBetaPlayer, self).__init__(player_num)
+    def __init__(self, player_num, heuristic, search_depth=-1, max_time=0, sorter=None, killer_moves=6,
+                 collect_stats=True, stats_file=None, ponder=False, game_time=0, increment=0, clock_interval=16,
+                 sorter_depth=2, transposition_table=None, late_move_reductions=False, reduction_moves=4,
+                 reduction_depth=3, futility_pruning=False, futility_margin=None, negamax=False,
+                 candidate_radius=None, path_depth=2):
+        super(AlphaBetaPlayer, self).__init__(player_num, collect_stats, stats_file)
         # the number of moves deep to search in the tree
         self.search_depth = search_depth
-        # the amount of time given for iterative deepening. only used when search_depth < 0
+        # the amount of time given for iterative deepening. with a search_depth as well, the search stops at
+        # whichever comes first
         self.max_time = max_time
+        # instead of a fixed time per move, iterative deepening can share a budget for the whole game
+        self.time_manager = TimeManager(max_time, game_time, increment)
+        # the number of moves searched between checks of the clock
+        self.clock_interval = clock_interval
+        self._clock_countdown = clock_interval
         # the heuristic function used to evaluate leaf nodes
         self.heuristic = heuristic
         # the sorting function used to determine which branch to search first
         self.sorter = sorter
+        # the sorter is slow, so it's only used when at least this much depth is left. history is used below that
+        self.sorter_depth = sorter_depth
         # the number of cutoff moves to remember at each depth
         self.killer_moves = killer_moves
+        # killers, history and countermoves. kept between iterations and moves
+        self.ordering = MoveOrdering(killer_moves)
+        # search results are kept between moves, to order moves and so that pondering isn't wasted.
+        # a SharedTranspositionTable can be given instead, to share results with searches in other processes
+        self.ponder = ponder
+        self.transposition_table = TranspositionTable() if transposition_table is None else transposition_table
+        # selective search, which gives up exactness for depth. with late move reductions, the moves after the first
+        # reduction_moves are searched a ply shallower when at least reduction_depth is left, and searched again at
+        # full depth if they turn out better than the best so far
+        self.late_move_reductions = late_move_reductions
+        self.reduction_moves = reduction_moves
+        self.reduction_depth = reduction_depth
+        # with futility pruning, the moves one ply from the leaves are skipped if the position is so far below alpha
+        # (or above beta) that a single move isn't expected to make up the difference. moves that win are still tried
+        self.futility_pruning = futility_pruning
+        self.futility_margin = heuristic.futility_margin if futility_margin is None else futility_margin
+        # finds out whether the player to move is one stone from winning, without trying every move
+        self.win_check = ShortestPathHeuristic()
+        # searches with negamax instead of alpha_beta. it finds the same values and moves, with buffers that are
+        # made once and reused at every node instead of new lists
+        self.negamax = negamax
+        self._buffer_size = 0
+        # on big boards, only the moves within candidate_radius of a stone, and on the shortest paths when at least
+        # path_depth is left, are searched. every legal move is searched without a radius
+        self.window = None if candidate_radius is None else LocalityWindow(candidate_radius, path_depth)
+        # the expected moves from the last search, used to guess what the opponent will play
+        self.last_move_list = None
+        # the nodes left before the search stops, counted at each check of the clock. only pondering has a limit
+        self.node_budget = None
 
-        if search_depth < 0 and max_time <= 0:
-            raise ValueError('AlphaBetaPlayer needs either a search_depth, or a max_time')
+        if search_depth < 0 and max_time <= 0 and game_time <= 0:
+            raise ValueError('AlphaBetaPlayer needs either a search_depth, a max_time, or a game_time')
 
     def move(self, board):
-        transposition_table = dict()
-        if self.search_depth < 0:
-            val, move_list = self.iterative_deepening(board, self.max_time)
+        self.stop_pondering()
+        stats = self.new_stats()
+        transposition_table = self.transposition_table
+        transposition_table.clear_before(len(board.move_list))
+        self.ordering.new_search(board)
+        if self.search_depth < 0 or self.max_time > 0 or self.time_manager.remaining > 0:
+            self.time_manager.start_move(board)
+            val, move_list, depth = self.iterative_deepening(
+                board, self.time_manager, transposition_table,
+                max_depth=None if self.search_depth < 0 else self.search_depth)
+            self.time_manager.end_move()
         else:
-            val, move_list, time_up = self.alpha_beta(board, self.search_depth, -inf, inf, self.player_num, transposition_table, sorter=self.sorter)
+            depth = self.search_depth
+            if stats is not None:
+                stats.begin_iteration(depth)
+            val, move_list, time_up = self.search(board, self.search_depth, -inf, inf, self.player_num, transposition_table, sorter=self.sorter)
+            if stats is not None:
+                stats.end_iteration(depth, True, val)
             # val, move_list = self.MTD_f(board, self.heuristic.get_value(board)+self.player_num, self.search_depth
 
         print('expected value:', val)
         print('expected moves:', move_list)
 
+        self.last_move_list = move_list
         # if the game seems lost, resign
         if move_list is None or val*self.player_num <= -10000:
             board.resign()
+            return self.finish_stats(val, None, depth)
         else:
             board.play(*(move_list[0]))
+            if self.ponder:
+                self.start_pondering(board)
+            return self.finish_stats(val, move_list[0], depth)
 
-    def alpha_beta(self, board, depth, alpha, beta, player, transposition_table,
-                   killer_moves=None, sorter=None, start_time=None, max_time=None):
-        if killer_moves is None:
-            killer_moves = [[(board.size//2,board.size//2)]*self.killer_moves for _ in range(depth+1)]
-        elif len(killer_moves) < depth:
-            killer_moves.extend(([(board.size//2,board.size//2)]*self.killer_moves for _ in range(depth+1-len(killer_moves))))
+    # searches the position with iterative deepening, for max_time seconds or the player's usual limit.
+    # the tables are kept, so analysing the position before playing it isn't wasted
+    def analyze(self, board, max_time=None):
+        self.stop_pondering()
+        self.new_stats()
+        self.transposition_table.clear_before(len(board.move_list))
+        self.ordering.new_search(board)
+        max_depth = None
+        if max_time is None:
+            if self.search_depth >= 0:
+                max_depth = self.search_depth
+            max_time = self.max_time
+        if max_time or max_depth is not None:
+            time_manager = TimeManager(move_time=max_time or inf)
+        else:
+            # a player with only a game budget gets the time it would plan for a move, without spending the budget
+            time_manager = TimeManager(game_time=self.time_manager.remaining, increment=self.time_manager.increment)
+        time_manager.start_move(board)
+        val, move_list, depth = self.iterative_deepening(board, time_manager, self.transposition_table, False, max_depth)
+        self.finish_stats(val, move_list[0] if move_list else None, depth)
+        return {'value': val, 'depth': depth, 'pv': principal_variation(move_list)}
+
+    # searches the position after the opponent's expected reply, until the opponent actually moves
+    def ponder_search(self, board):
+        if self.last_move_list is None or self.last_move_list[1] is None:
+            return
+        board.play(*self.last_move_list[1][0])
+        if board.winner == 0:
+            time_manager = TimeManager(move_time=inf)
+            time_manager.start_move(board)
+            self.node_budget = MAX_PONDER_NODES
+            self.iterative_deepening(board, time_manager, self.transposition_table, verbose=False)
+
+    # counts off the nodes searched since the last check of the clock, and says whether the budget has run out
+    def out_of_nodes(self):
+        if self.node_budget is None:
+            return False
+        self.node_budget -= self.clock_interval
+        return self.node_budget <= 0
+
+    # the negamax buffers are marked with a stamp counted by each player, so the ponderer makes its own buffers.
+    # sharing them would leave marks from the ponderer's search that the player's next search takes as its own
+    def ponder_copy(self):
+        ponderer = super(AlphaBetaPlayer, self).ponder_copy()
+        ponderer._buffer_size = 0
+        return ponderer
+
+    # searches with whichever of alpha_beta and negamax the player uses. values are from player 1's point of view,
+    # and the expected moves are nested (move, rest of the moves) lists
+    def search(self, board, depth, alpha, beta, player, transposition_table, sorter=None, start_time=None,
+               max_time=None):
+        if not self.negamax:
+            return self.alpha_beta(board, depth, alpha, beta, player, transposition_table, sorter, start_time, max_time)
+        self.prepare_buffers(board.size, depth)
+        colour = board.turn
+        if colour == 1:
+            value, time_up = self.negamax_search(board, depth, alpha, beta, 0, transposition_table, sorter,
+                                                 start_time, max_time)
+        else:
+            value, time_up = self.negamax_search(board, depth, -beta, -alpha, 0, transposition_table, sorter,
+                                                 start_time, max_time)
+        return colour * value, self.nested_pv(0, 0), time_up
 
-        if depth == 0 or board.winner != 0:
-            # if we've reached the end, there is no move to make
-            return self.heuristic.get_value(board), None, False
+    def alpha_beta(self, board, depth, alpha, beta, player, transposition_table,
+                   sorter=None, start_time=None, max_time=None):
+        stats = self.stats
+        if stats is None:
+            if depth == 0 or board.winner != 0:
+                # if we've reached the end, there is no move to make
+                return self.heuristic.get_value(board), None, False
+        else:
+            ply = stats.visit(depth)
+            if depth != 0:
+                start = default_timer()
+                game_over = board.winner != 0
+                stats.win_check_time += default_timer() - start
+            if depth == 0 or game_over:
+                start = default_timer()
+                value = self.heuristic.get_value(board)
+                stats.heuristic_time += default_timer() - start
+                stats.leaf_evals += 1
+                return value, None, False
+            stats.expand(ply)
+            start = default_timer()
 
         # make a generator for all options
-        options = [(y, x) for (y, x) in itertools.product(range(board.size), repeat=2) if board[y][x] == 0]
+        if self.window is None:
+            allowed = None
+            options = [(y, x) for (y, x) in itertools.product(range(board.size), repeat=2) if board[y][x] == 0]
+        else:
+            # the window's flags are reused deeper in the tree, so they're copied for checking the first moves
+            allowed = self.window.allowed(board, depth)[:]
+            options = [(y, x) for (y, x) in itertools.product(range(board.size), repeat=2)
+                       if allowed[y * board.size + x]]
         if board.swap_rule and len(board.move_list) == 1:
             # options = itertools.chain((board.move_list[0],),options)
             options.append(SWAP_MOVE)
 
         # by default, the algorithm searches top-left to bottom-right. if we use a fast heuristic to sort the options,
-        # it can try to find moves that will result in cut-offs early
-        if sorter is not None:
+        # it can try to find moves that will result in cut-offs early.
+        # deeper in the tree, moves are sorted by how often they caused cutoffs elsewhere
+        ordering = self.ordering
+        if ordering.size != board.size:
+            ordering.new_search(board)
+        if sorter is not None and depth >= self.sorter_depth:
             child_val = sorter.get_child_values(board)
             options.sort(key=lambda m: 0 if m == SWAP_MOVE else child_val[m[0]][m[1]]*-board.turn)
+        else:
+            ordering.sort(board, options)
+
+        # the best move from an earlier search of this position is the most likely to cause a cutoff
+        tt_move = None
+        if transposition_table is not None:
+            tt_move = transposition_table.best_move(board.hashable(), len(board.move_list))
 
-        options = itertools.chain(killer_moves[depth], options)
+        if stats is not None:
+            stats.movegen_time += default_timer() - start
+
+        first_moves = ordering.first_moves(board, tt_move)
+        can_swap = board.swap_rule and len(board.move_list) == 1
         searched = set()
 
         # player 1 tries to maximize the board value, player 2 tries to minimize it
         value = -inf if player == 1 else inf
         best_move = None
         time_up = False
-        for move in options:
-            if board[move[0]][move[1]] != 0 or move in searched:
+        # the most a move can get to, if this position is too far behind for one move to catch up
+        futility_value = None
+        if self.futility_pruning and depth == 1 and self.futility_margin is not None:
+            static = self.heuristic.get_value(board)
+            if player > 0 and static + self.futility_margin <= alpha:
+                futility_value = static + self.futility_margin
+            elif player < 0 and static - self.futility_margin >= beta:
+                futility_value = static - self.futility_margin
+            # if no move wins, none of them can make up the difference
+            if futility_value is not None and self.win_check.shortest_distance(board, player) > 1:
+                if stats is not None:
+                    stats.futility_prunes += len(options)
+                return futility_value, None, False
+        reduce = self.late_move_reductions and depth >= self.reduction_depth
+        for move in itertools.chain(first_moves, options):
+            if move in searched:
+                continue
+            # the moves tried first come from other positions, so they might not be legal here,
+            # or might be outside the window
+            if move == SWAP_MOVE:
+                if not can_swap:
+                    continue
+            elif board[move[0]][move[1]] != 0 or (allowed is not None and not allowed[move[0] * board.size + move[1]]):
                 continue
             searched.add(move)
             board.play(*move)
-            board_state = board.hashable()
-            if transposition_table is not None:
-                if board_state in transposition_table:
-                    move_val, move_list = transposition_table[board_state]
-                else:
-                    move_val, move_list, time_up =\
-                        self.alpha_beta(board, depth-1, alpha, beta, -player, transposition_table,
-                                        killer_moves=killer_moves, sorter=sorter, start_time=start_time, max_time=max_time)
-                    if not time_up:
-                        transposition_table[board_state] = (move_val, move_list)
+            if futility_value is not None and board.winner == 0:
+                board.undo()
+                if stats is not None:
+                    stats.futility_prunes += 1
+                if (futility_value > value) if player > 0 else (futility_value < value):
+                    value = futility_value
+                continue
+            if reduce and len(searched) > self.reduction_moves and move not in first_moves:
+                if stats is not None:
+                    stats.reductions += 1
+                move_val, move_list, time_up = self.search_child(board, depth-2, alpha, beta, player,
+                                                                 transposition_table, sorter, start_time, max_time)
+                # a reduced move that looks better than the best so far is searched again properly
+                if not time_up and (move_val > alpha if player > 0 else move_val < beta):
+                    if stats is not None:
+                        stats.researches += 1
+                    move_val, move_list, time_up = self.search_child(board, depth-1, alpha, beta, player,
+                                                                     transposition_table, sorter, start_time, max_time)
             else:
-                move_val, move_list, time_up = self.alpha_beta(board, depth-1, alpha, beta, -player, transposition_table,
-                                                               killer_moves, sorter, start_time, max_time)
+                move_val, move_list, time_up = self.search_child(board, depth-1, alpha, beta, player,
+                                                                 transposition_table, sorter, start_time, max_time)
             board.undo()
 
             # if we didnt run out of time, we successfully explored this branch
@@ -187,46 +453,374 @@ class AlphaBetaPlayer(ComputerPlayer):
                     beta = min(beta, value)
                 # if we've found a better move, we can do a cutoff
                 if alpha >= beta:
+                    if stats is not None:
+                        stats.cutoff(len(searched) - 1, ordering.is_killer(board, move))
                     # record the move that caused the cutoff
-                    if move not in killer_moves[depth]:
-                        killer_moves[depth].append(move)
-                        killer_moves[depth].pop(0)
+                    ordering.cutoff(board, move, depth)
                     break
             # if we've run out of time, we need to get out of this tree search
-            if max_time and (time_up or (default_timer() - start_time > max_time)):
+            if time_up or self.stopped:
                 time_up = True
                 break
+            # reading the clock is slow compared to a move, so it's only checked every few moves
+            if max_time:
+                self._clock_countdown -= 1
+                if self._clock_countdown <= 0:
+                    self._clock_countdown = self.clock_interval
+                    if default_timer() - start_time > max_time or self.out_of_nodes():
+                        time_up = True
+                        break
         return value, best_move, time_up
 
-    # performs alphabeta searches at increasing depths to allow a time limit on each move
-    def iterative_deepening(self, board, max_time):
-        start_time = default_timer()
+    # searches the position after a move, with the given depth left, looking it up in the table first.
+    # player is the one who made the move
+    def search_child(self, board, depth, alpha, beta, player, transposition_table, sorter, start_time, max_time):
+        if transposition_table is None:
+            return self.alpha_beta(board, depth, alpha, beta, -player, transposition_table, sorter, start_time,
+                                   max_time)
+        stats = self.stats
+        board_state = board.hashable()
+        if stats is not None:
+            stats.tt_probes += 1
+        entry = transposition_table.probe(board_state, len(board.move_list), depth, alpha, beta)
+        if entry is not None:
+            if stats is not None:
+                stats.tt_hits += 1
+            return entry[0], entry[1], False
+        move_val, move_list, time_up = self.alpha_beta(board, depth, alpha, beta, -player, transposition_table,
+                                                       sorter=sorter, start_time=start_time, max_time=max_time)
+        if not time_up:
+            transposition_table.store(board_state, len(board.move_list), depth, move_val, move_list, alpha, beta)
+            if stats is not None:
+                stats.tt_stores += 1
+        return move_val, move_list, time_up
+
+    # makes the buffers negamax uses at each ply. moves are numbered row * size + col, with size * size for a swap
+    def prepare_buffers(self, size, depth):
+        cells = size * size
+        if self._buffer_size != size:
+            self._buffer_size = size
+            self._moves = [(row, col) for row in range(size) for col in range(size)] + [SWAP_MOVE]
+            self._identity = list(range(cells + 1))
+            self._order = []
+            self._keys = []
+            self._key_getters = []
+            self._searched = []
+            self._pv = []
+            self._pv_length = []
+            self._stamp = 0
+        while len(self._order) <= depth:
+            keys = [0] * (cells + 1)
+            self._order.append(self._identity[:])
+            self._keys.append(keys)
+            self._key_getters.append(keys.__getitem__)
+            self._searched.append([0] * (cells + 1))
+            # a game can't last more moves than there are cells, plus a swap
+            self._pv.append([0] * (cells + 1))
+            self._pv_length.append(0)
+
+    # the expected moves from a ply of the triangular pv table, as the nested lists alpha_beta returns
+    def nested_pv(self, ply, start):
+        row = self._pv[ply]
+        moves = self._moves
+        move_list = None
+        for i in range(self._pv_length[ply] - 1, start - 1, -1):
+            move_list = (moves[row[i]], move_list)
+        return move_list
+
+    # puts the nested expected moves from the transposition table into a ply of the pv table
+    def copy_pv(self, ply, move_list):
+        row = self._pv[ply]
+        size = self._buffer_size
+        length = 0
+        while move_list is not None:
+            move = move_list[0]
+            row[length] = size * size if move == SWAP_MOVE else move[0] * size + move[1]
+            length += 1
+            move_list = move_list[1]
+        self._pv_length[ply] = length
+
+    # alpha_beta in negamax form: values are from the point of view of the player to move, so both players
+    # maximise. moves are tried in exactly the same order, so the results are identical at a fixed depth.
+    # returns the value and whether time ran out, and leaves the expected moves in the ply's row of the pv table
+    def negamax_search(self, board, depth, alpha, beta, ply, transposition_table, sorter, start_time, max_time):
+        stats = self.stats
+        colour = board.turn
+        self._pv_length[ply] = 0
+        if stats is None:
+            if depth == 0 or board.winner != 0:
+                return colour * self.heuristic.get_value(board), False
+        else:
+            stats_ply = stats.visit(depth)
+            if depth == 0 or board.winner != 0:
+                start = default_timer()
+                value = colour * self.heuristic.get_value(board)
+                stats.heuristic_time += default_timer() - start
+                stats.leaf_evals += 1
+                return value, False
+            stats.expand(stats_ply)
+            start = default_timer()
+
+        size = board.size
+        cells = board.board
+        swap = size * size
+        can_swap = board.swap_rule and len(board.move_list) == 1
+        num_moves = len(board.move_list)
+        moves = self._moves
+        ordering = self.ordering
+        if ordering.size != size:
+            ordering.new_search(board)
+
+        # every move is kept in the ply's order buffer, and occupied cells are marked as already searched.
+        # the buffer is put back in board order first, so the stable sort breaks ties like alpha_beta does.
+        # each node marks its moves with a number no other node uses, so the marks never need clearing
+        self._stamp += 1
+        stamp = self._stamp
+        searched = self._searched[ply]
+        keys = self._keys[ply]
+        count = 1 if can_swap else 0
+        if sorter is not None and depth >= self.sorter_depth:
+            child_val = sorter.get_child_values(board)
+            cell = 0
+            for row in range(size):
+                values = child_val[row]
+                occupied = cells[row]
+                for col in range(size):
+                    if occupied[col] == 0:
+                        keys[cell] = values[col] * -colour
+                        count += 1
+                    else:
+                        keys[cell] = inf
+                        searched[cell] = stamp
+                    cell += 1
+        else:
+            scores = ordering.history[colour]
+            bonus = ordering.centrality
+            cell = 0
+            for row in range(size):
+                occupied = cells[row]
+                for col in range(size):
+                    if occupied[col] == 0:
+                        keys[cell] = -scores[cell] - bonus[cell]
+                        count += 1
+                    else:
+                        keys[cell] = inf
+                        searched[cell] = stamp
+                    cell += 1
+        if can_swap:
+            keys[swap] = 0
+        else:
+            keys[swap] = inf
+            searched[swap] = stamp
+        if self.window is not None:
+            # cells outside the window are treated like occupied ones
+            allowed = self.window.allowed(board, depth)
+            for cell in range(swap):
+                if not allowed[cell] and searched[cell] != stamp:
+                    keys[cell] = inf
+                    searched[cell] = stamp
+                    count -= 1
+        order = self._order[ply]
+        order[:] = self._identity
+        order.sort(key=self._key_getters[ply])
+
+        tt_move = None
+        if transposition_table is not None:
+            tt_move = transposition_table.best_move(board.hashable(), num_moves)
+
+        if stats is not None:
+            stats.movegen_time += default_timer() - start
+
+        # the futility pruning of alpha_beta, turned around for the player to move
+        futility_value = None
+        if self.futility_pruning and depth == 1 and self.futility_margin is not None:
+            static = colour * self.heuristic.get_value(board)
+            if static + self.futility_margin <= alpha:
+                futility_value = static + self.futility_margin
+                if self.win_check.shortest_distance(board, colour) > 1:
+                    if stats is not None:
+                        stats.futility_prunes += count
+                    return futility_value, False
+        reduce = self.late_move_reductions and depth >= self.reduction_depth
+
+        pv = self._pv[ply]
+        child_pv = self._pv[ply + 1]
+        pv_length = self._pv_length
+        value = -inf
+        tried = 0
+        time_up = False
+        # the moves from other positions come first: the table's best move, the killers, then the countermove.
+        # phase 0 is the table's move, 1 the killers, 2 the countermove and 3 the sorted moves
+        killers = ordering.killers.get(num_moves)
+        countermove = ordering.countermoves.get((colour, board.move_list[-1])) if num_moves else None
+        phase = 0
+        index = 0
+        while True:
+            first = True
+            if phase == 0:
+                phase = 1
+                if tt_move is None:
+                    continue
+                move = tt_move
+            elif phase == 1:
+                if killers is None or index >= len(killers):
+                    phase = 2
+                    index = 0
+                    continue
+                move = killers[index]
+                index += 1
+            elif phase == 2:
+                phase = 3
+                if countermove is None:
+                    continue
+                move = countermove
+            else:
+                if index > swap:
+                    break
+                code = order[index]
+                index += 1
+                if searched[code] == stamp:
+                    continue
+                move = moves[code]
+                first = False
+            if first:
+                # the moves tried first come from other positions, so they might not be legal here.
+                # illegal moves are already marked as searched
+                code = swap if move == SWAP_MOVE else move[0] * size + move[1]
+                if searched[code] == stamp:
+                    continue
+            searched[code] = stamp
+            tried += 1
+            board.play(*move)
+            if futility_value is not None and board.winner == 0:
+                board.undo()
+                if stats is not None:
+                    stats.futility_prunes += 1
+                if futility_value > value:
+                    value = futility_value
+                continue
+            if reduce and not first and tried > self.reduction_moves:
+                if stats is not None:
+                    stats.reductions += 1
+                score, time_up = self.negamax_child(board, depth - 2, alpha, beta, ply, colour, transposition_table,
+                                                    sorter, start_time, max_time)
+                if not time_up and score > alpha:
+                    if stats is not None:
+                        stats.researches += 1
+                    score, time_up = self.negamax_child(board, depth - 1, alpha, beta, ply, colour,
+                                                        transposition_table, sorter, start_time, max_time)
+            else:
+                score, time_up = self.negamax_child(board, depth - 1, alpha, beta, ply, colour, transposition_table,
+                                                    sorter, start_time, max_time)
+            board.undo()
+
+            if not time_up:
+                if score > value:
+                    value = score
+                    pv[0] = code
+                    length = pv_length[ply + 1]
+                    pv[1:length + 1] = child_pv[:length]
+                    pv_length[ply] = length + 1
+                if value > alpha:
+                    alpha = value
+                if alpha >= beta:
+                    if stats is not None:
+                        stats.cutoff(tried - 1, ordering.is_killer(board, move))
+                    ordering.cutoff(board, move, depth)
+                    break
+            if time_up or self.stopped:
+                time_up = True
+                break
+            if max_time:
+                self._clock_countdown -= 1
+                if self._clock_countdown <= 0:
+                    self._clock_countdown = self.clock_interval
+                    if default_timer() - start_time > max_time or self.out_of_nodes():
+                        time_up = True
+                        break
+        return value, time_up
+
+    # the negamax version of search_child. the table keeps values from player 1's point of view,
+    # and the child's expected moves go in the next ply of the pv table
+    def negamax_child(self, board, depth, alpha, beta, ply, colour, transposition_table, sorter, start_time,
+                      max_time):
+        if transposition_table is None:
+            value, time_up = self.negamax_search(board, depth, -beta, -alpha, ply + 1, transposition_table, sorter,
+                                                 start_time, max_time)
+            return -value, time_up
+        stats = self.stats
+        # the window from player 1's point of view
+        low, high = (alpha, beta) if colour == 1 else (-beta, -alpha)
+        board_state = board.hashable()
+        if stats is not None:
+            stats.tt_probes += 1
+        entry = transposition_table.probe(board_state, len(board.move_list), depth, low, high)
+        if entry is not None:
+            if stats is not None:
+                stats.tt_hits += 1
+            self.copy_pv(ply + 1, entry[1])
+            return colour * entry[0], False
+        value, time_up = self.negamax_search(board, depth, -beta, -alpha, ply + 1, transposition_table, sorter,
+                                             start_time, max_time)
+        if not time_up:
+            transposition_table.store(board_state, len(board.move_list), depth, -colour * value,
+                                      self.nested_pv(ply + 1, 0), low, high)
+            if stats is not None:
+                stats.tt_stores += 1
+        return -value, time_up
+
+    # performs alphabeta searches at increasing depths to allow a time limit on each move.
+    # the time manager must already have started the move.
+    # if no transposition table is given, each iteration gets a new one.
+    # on_iteration is called with the depth, value and expected moves every time a depth is completed
+    def iterative_deepening(self, board, time_manager, transposition_table=None, verbose=True, max_depth=None,
+                            on_iteration=None):
+        start_time = time_manager.start_time
+        max_time = time_manager.hard_limit
+        self._clock_countdown = self.clock_interval
         sorter = self.sorter
+        stats = self.stats
+        # searching deeper than the number of empty cells can't find anything new
+        empty = sum(row.count(0) for row in board.board)
+        max_depth = empty if max_depth is None else min(max_depth, empty)
         depth = 1
         val = 0
         move_list = None
         time_up = False
-        while not time_up:
-            transposition_table = dict()
-            next_val, next_move_list, time_up = self.alpha_beta(board, depth, -inf, inf, self.player_num, transposition_table,
+        while not time_up and depth <= max_depth:
+            table = transposition_table if transposition_table is not None else TranspositionTable()
+            if stats is not None:
+                stats.begin_iteration(depth)
+            iteration_start = default_timer()
+            next_val, next_move_list, time_up = self.search(board, depth, -inf, inf, board.turn, table,
                                              sorter=sorter, start_time=start_time, max_time=max_time)
-            print('depth',depth,'value',next_val,'moves',next_move_list, 'time up',time_up)
+            if stats is not None:
+                stats.end_iteration(depth, not time_up, next_val)
+            if verbose:
+                print('depth',depth,'value',next_val,'moves',next_move_list, 'time up',time_up)
 
             # if the search at this depth actually completed, record the result
             # keeping results of partial searches may lead to strange moves
             if not time_up:
                 val = next_val
                 move_list = next_move_list
+                self.progress = {'depth': depth, 'value': val, 'move': move_list[0] if move_list else None}
+                # remember the result, so the next iteration tries the best move first
+                table.store(board.hashable(), len(board.move_list), depth, val, move_list, -inf, inf)
+                time_manager.end_iteration(default_timer() - iteration_start, self.progress['move'])
+                if on_iteration is not None:
+                    on_iteration(depth, val, move_list)
                 # print(transposition_table.values())
                 depth += 1
-            # if we've already used the majority of our time, we wont have time to complete another iteration
-            if (default_timer() - start_time) / (max_time) > 0.2:
+            # don't start another iteration if it isn't expected to finish in time
+            if not time_manager.should_start_iteration():
                 time_up = True
             # if we've found a definite result, no reason to keep searching
             if abs(val) == math.inf:
                 time_up = True
-        print('depth reached:',(depth-1))
-        return val, move_list
+        if verbose:
+            print('depth reached:',(depth-1))
+        return val, move_list, depth-1
 
     # a supposed efficiency improvement on the minimax search algorithm that uses 0-width alpha beta calls
     # makes the players choose different moves than regular alpha-beta depending on the initial guess?
@@ -238,73 +832,313 @@ class AlphaBetaPlayer(ComputerPlayer):
         move_list = None
         while lower < upper:
             bound = max(val, lower + 1)
-            transposition_table = dict()
-            val, move_list, time_up = self.alpha_beta(board, depth, bound - 1, bound, self.player_num, transposition_table)
+            transposition_table = TranspositionTable()
+            val, move_list, time_up = self.search(board, depth, bound - 1, bound, self.player_num, transposition_table)
             if val < bound:
                 upper = val
             else:
                 lower = val
         return val, move_list
 
+# turns the nested (move, rest of the moves) lists returned by alpha-beta into a flat list of moves
+def principal_variation(move_list):
+    moves = []
+    while move_list is not None:
+        moves.append(move_list[0])
+        move_list = move_list[1]
+    return moves
+
+
 # a player that uses Monte Carlo Tree Search as opposed to the minimax search that AlphaBetaPlayer uses
-# Currently this player uses pure MCTS, meaning that rollouts are done randomly. This means that the
-# player does not take advantage of any of the heuristics to evaluate positions, and does not play very well
+# By default this player uses pure MCTS, meaning that rollouts are done randomly. This means that the
+# player does not take advantage of any of the heuristics to evaluate positions, and does not play very well.
+# With an evaluator, such as the PolicyValueNetwork, leaves are evaluated in batches instead, and the evaluator's
+# priors guide which moves are searched
 class MonteCarloPlayer(ComputerPlayer):
-    def __init__(self, player_num, size, max_time=1, num_samples=100):
-        super(MonteCarloPlayer, self).__init__(player_num)
+    def __init__(self, player_num, size, max_time=1, num_samples=100, collect_stats=True, stats_file=None,
+                 ponder=False, evaluator=None, batch_size=16, c_puct=1.5, virtual_loss=1):
+        super(MonteCarloPlayer, self).__init__(player_num, collect_stats, stats_file)
+        # evaluates a batch of positions at once, giving (priors, values) like PolicyValueNetwork.evaluate
+        self.evaluator = evaluator
+        # the number of leaves evaluated together, how strongly the priors are followed,
+        # and the losses added to a path while its leaf waits to be evaluated
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.virtual_loss = virtual_loss
+        # when pondering, the tree keeps growing from every possible reply while the opponent thinks
+        self.ponder = ponder
         # the amount of time given for searching.
         self.max_time = max_time
         # the number of rollouts to perform on a leaf node
         self.num_samples = num_samples
-        # a list of board states, their visit count, and their children
-        self.search_tree = {HexBoard(size).hashable():[1,0,set()]}
+        # a list of board states, their visit count, their total value, and their children.
+        # with an evaluator, the children are a dict of move: child, and a fourth item holds the priors of every move.
+        # the fifth item is 1 if the player to move is proven to win, -1 if they're proven to lose, or 0 if unknown
+        self.search_tree = {tree_key(HexBoard(size)): self.new_node()}
         # tunable exploration parameter for UCB
         self.C = 1
 
     def move(self, board):
         if board.winner != 0:
-            return
+            return None
 
-        # perform searches for the given amount of time
+        self.stop_pondering()
+        stats = self.new_stats()
+        root = self.tree_node(board)
+        # perform searches for the given amount of time, or until the result is proven
         start = default_timer()
         count = 0
-        while default_timer()-start < self.max_time:
-            count += 1
-            self.MCTS(board)
+        next_progress = 100
+        while default_timer()-start < self.max_time and not self.stopped and root[4] == 0:
+            count += self.search(board)
+            if count >= next_progress:
+                self.progress = {'searches': count}
+                next_progress += 100
         print('completed',count,'searches!')
+        if stats is not None:
+            stats.searches = count
+            stats.tree_size = len(self.search_tree)
 
-        # from the given board state, pick the child with the most visits
-        state = self.search_tree[board.hashable()]
-        best_move=None
-        best_visits = 0
+        # from the given board state, pick a proven win or the child with the most visits
+        visits = self.visit_counts(board)
+        # a stopped search might not have had time to try any moves
+        if not visits:
+            return self.finish_stats()
+        best_move = self.best_move(board)
+        # the value is from player 1's point of view, like an alpha-beta player's
+        value = self.root_value(board)
+        board.play(*best_move)
+        if self.ponder:
+            self.start_pondering(board)
+        return self.finish_stats(value, best_move)
+
+    # the tree nodes of the children of a board state that have been searched
+    def child_nodes(self, board):
+        state = self.search_tree.get(tree_key(board))
+        if state is None:
+            return dict()
+        if isinstance(state[2], dict):
+            return dict(state[2])
+        children = dict()
         for move in state[2]:
             board.play(*move)
-            visits = self.search_tree[board.hashable()][0]
+            children[move] = self.search_tree[tree_key(board)]
             board.undo()
-            if visits > best_visits:
-                best_move, best_visits = move, visits
-        board.play(*best_move)
+        return children
+
+    # the number of times each child of a board state has been visited
+    def visit_counts(self, board):
+        return {move: child[0] for move, child in self.child_nodes(board).items()}
+
+    # a move that's proven to win, or else the most visited move that isn't proven to lose
+    def best_move(self, board):
+        children = self.child_nodes(board)
+        # a child's proof is from the opponent's point of view
+        moves = ([move for move, child in children.items() if child[4] == -1] or
+                 [move for move, child in children.items() if child[4] != 1] or list(children))
+        return max(moves, key=lambda move: children[move][0], default=None)
+
+    # 1 if the player to move is proven to win from a board state, -1 if they're proven to lose, and 0 if unknown
+    def proven(self, board):
+        state = self.search_tree.get(tree_key(board))
+        return 0 if state is None else state[4]
+
+    # the average result of the searches through a board state, from player 1's point of view
+    def root_value(self, board):
+        state = self.search_tree.get(tree_key(board))
+        if state is not None and state[4] != 0:
+            return board.turn * state[4]
+        if state is None or state[0] == 0:
+            return 0
+        return board.turn * state[1] / state[0]
+
+    # grows the tree from the position for max_time seconds, and summarises the visits of each move
+    def analyze(self, board, max_time=None):
+        self.stop_pondering()
+        self.new_stats()
+        root = self.tree_node(board)
+        start = default_timer()
+        count = 0
+        while default_timer() - start < (self.max_time if max_time is None else max_time) and not self.stopped and \
+                root[4] == 0:
+            count += self.search(board)
+        return dict(self.summary(board), searches=count)
+
+    # the value of a position, the visits of each move, and the principal variation,
+    # which follows the move that would be played at every level
+    def summary(self, board):
+        pv = []
+        root_visits = self.visit_counts(board)
+        move = self.best_move(board)
+        while move is not None:
+            pv.append(move)
+            board.play(*move)
+            move = self.best_move(board)
+        for _ in pv:
+            board.undo()
+        return {'value': self.root_value(board), 'pv': pv, 'visits': root_visits}
+
+    # keeps growing the tree from the opponent's position, which covers all of their replies
+    def ponder_search(self, board):
+        root = self.tree_node(board)
+        while not self.stopped and board.winner == 0 and root[4] == 0 and len(self.search_tree) < MAX_PONDER_NODES:
+            self.search(board)
+
+    # the tree node of a position, which is added to the tree if it isn't there yet
+    def tree_node(self, board):
+        return self.search_tree.setdefault(tree_key(board), self.new_node())
+
+    def new_node(self):
+        return [1, 0, set(), None, 0] if self.evaluator is None else [0, 0, dict(), None, 0]
+
+    # searches the tree once, or a batch of times with an evaluator, and returns the number of searches
+    def search(self, board):
+        if self.evaluator is None:
+            self.MCTS(board)
+            return 1
+        return self.batched_search(board)
+
+    # sends a batch of searches down the tree. each one follows the priors and values down to a position that
+    # hasn't been evaluated, and leaves a virtual loss along its path so the next one tends to go somewhere else.
+    # the positions are then evaluated together, which costs much less per position than evaluating them one by one
+    def batched_search(self, board):
+        tree = self.search_tree
+        root = self.tree_node(board)
+        virtual_loss = self.virtual_loss
+        # the path to each leaf, with the leaf's board and player to move
+        leaves = []
+        count = 0
+        for _ in range(self.batch_size):
+            # a proven position has nothing left to search
+            if root[4] != 0:
+                break
+            path = [root]
+            node = root
+            depth = 0
+            while node[3] is not None and node[4] == 0 and board.winner == 0:
+                move = self.select(node)
+                board.play(*move)
+                depth += 1
+                child = node[2].get(move)
+                if child is None:
+                    child = node[2][move] = tree.setdefault(tree_key(board), self.new_node())
+                node = child
+                path.append(node)
+            if board.winner != 0 or node[4] != 0:
+                # the player to move has already lost, or the result is known without evaluating anything
+                self.prove(node, -1)
+                self.backup(path, node[4])
+                self.propagate(path)
+                count += 1
+            elif any(node is leaf[0][-1] for leaf in leaves):
+                # another search in the batch is already waiting on this leaf, so the batch is full enough
+                for _ in range(depth):
+                    board.undo()
+                break
+            else:
+                for visited in path:
+                    visited[0] += virtual_loss
+                for visited in path[1:]:
+                    visited[1] += virtual_loss
+                leaves.append((path, [row[:] for row in board.board], board.turn, legal_moves(board)))
+            for _ in range(depth):
+                board.undo()
+        if leaves:
+            priors, values = self.evaluator.evaluate([leaf[1] for leaf in leaves], [leaf[2] for leaf in leaves])
+            for (path, cells, turn, moves), prior, value in zip(leaves, priors, values):
+                for visited in path:
+                    visited[0] -= virtual_loss
+                for visited in path[1:]:
+                    visited[1] -= virtual_loss
+                # the evaluator doesn't know about swapping, so a swap is given an even share, and then the priors
+                # are scaled back down to add up to 1
+                priors = {move: 1 / len(moves) if move == SWAP_MOVE else float(prior[move]) for move in moves}
+                if SWAP_MOVE in priors:
+                    total = sum(priors.values())
+                    priors = {move: share / total for move, share in priors.items()}
+                path[-1][3] = priors
+                self.backup(path, float(value))
+            count += len(leaves)
+        if self.stats is not None:
+            self.stats.nodes += count
+        return count
+
+    # the child to search next: the one with the best value, plus a bonus for a high prior and few visits.
+    # proven children are never searched again, unless every child is proven
+    def select(self, node):
+        children = node[2]
+        scale = self.c_puct * max(node[0], 1) ** 0.5
+        best_move = None
+        best_score = -inf
+        for move, prior in node[3].items():
+            child = children.get(move)
+            if child is not None and child[4] != 0:
+                continue
+            if child is None or child[0] == 0:
+                score = scale * prior
+            else:
+                # the child's value is from the opponent's point of view
+                score = -child[1] / child[0] + scale * prior / (1 + child[0])
+            if score > best_score:
+                best_move = move
+                best_score = score
+        if best_move is None:
+            return max(children, key=lambda move: children[move][0])
+        return best_move
+
+    # passes proofs up a path to a proven node. a position is won if any of its moves wins,
+    # and lost once every one of its moves is proven to lose
+    def propagate(self, path):
+        for i in range(len(path) - 1, 0, -1):
+            child = path[i]
+            parent = path[i - 1]
+            if parent[4] != 0:
+                break
+            if child[4] == -1:
+                self.prove(parent, 1)
+            elif child[4] == 1 and all(move in parent[2] and parent[2][move][4] == 1 for move in parent[3]):
+                self.prove(parent, -1)
+            else:
+                break
+
+    # adds a value, from the point of view of the player to move at the end of the path, to every node on it
+    def backup(self, path, value):
+        for node in reversed(path):
+            node[0] += 1
+            node[1] += value
+            value = -value
 
     def MCTS(self, board):
-        state = board.hashable()
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+        state = tree_key(board)
         # if we're starting at a move we've never searched before, add it
         if state not in self.search_tree:
             # connect it to its parent node
             if board.move_list:
                 move = board.move_list[-1]
                 board.undo()
-                self.search_tree[board.hashable()][2].add(move)
+                # the parent might not be in the tree if the game started before the player joined it
+                parent = self.search_tree.get(tree_key(board))
+                if parent is not None:
+                    parent[2].add(move)
                 board.play(*move)
-            self.search_tree[state] = [1,0,set()]
+            self.search_tree[state] = self.new_node()
 
         tree_state = self.search_tree[state]
         # increase the visit count
         tree_state[0] += 1
 
-        # if this is a winning state, mark it as a win and back-propagate
+        # if this is a winning state, the player to move has lost. mark it as a win and back-propagate
         if board.winner != 0:
+            self.prove(tree_state, -1)
             tree_state[1] += board.turn * board.winner
             return board.winner
+        # a proven state gives the same result every time, so nothing below it is searched again
+        if tree_state[4] != 0:
+            tree_state[1] += tree_state[4]
+            return board.turn * tree_state[4]
 
         # if this isnt a final state, expand the monte carlo tree to more nodes
         options = {(y, x) for (y, x) in itertools.product(range(board.size), repeat=2) if board[y][x] == 0}
@@ -314,45 +1148,104 @@ class MonteCarloPlayer(ComputerPlayer):
             next_move = self.UCB(board, tree_state)
             board.play(*next_move)
             winner = self.MCTS(board)
+            child_state = self.search_tree[tree_key(board)]
             board.undo()
         else:
             # if there are unexplored children, search one
             next_move = random.choice(unvisited)
             tree_state[2].add(next_move)
             board.play(*next_move)
-            self.search_tree[board.hashable()] = [1,0,set()]
-            winner = self.playout(deepcopy(board))
+            # the child might already be in the tree, if another order of moves reached it
+            child_state = self.tree_node(board)
+            if board.winner != 0:
+                # the move wins, so there's no need for a playout
+                self.prove(child_state, -1)
+                winner = board.winner
+            elif child_state[4] != 0:
+                winner = board.turn * child_state[4]
+            elif stats is None:
+                winner = self.playout(board)
+            else:
+                # a playout fills in every empty cell
+                stats.playout_moves += sum(row.count(0) for row in board.board)
+                start = default_timer()
+                winner = self.playout(board)
+                stats.playout_time += default_timer() - start
+                stats.playouts += 1
             board.undo()
+        # the proofs are from the point of view of the player to move, so a child that's lost means this is won
+        if child_state[4] == -1:
+            self.prove(tree_state, 1)
+        elif child_state[4] == 1 and len(tree_state[2]) == len(options) and not (
+                board.swap_rule and len(board.move_list) == 1):
+            # this is lost once every move has been proven to lose. swapping is never searched, so it can't be
+            if all(child[4] == 1 for child in self.child_nodes(board).values()):
+                self.prove(tree_state, -1)
         tree_state[1] += board.turn * winner
         return winner
 
-    # returns a move based on a weighted distribution
+    # marks a node as proven to be won (1) or lost (-1) by the player to move
+    def prove(self, node, result):
+        if node[4] == 0:
+            node[4] = result
+            if self.stats is not None:
+                self.stats.proofs += 1
+
+    # returns a move based on a weighted distribution. proven children are never searched again,
+    # unless every child is proven
     def UCB(self, board, state):
         weights = []
-        children = list(state[2])
-        for next_move in children:
+        children = []
+        proven = []
+        tree = self.search_tree
+        # every child has the opponent to move, so its key is made here rather than with tree_key
+        turn = -board.turn
+        C = self.C
+        log_visits = math.log(state[0])
+        for next_move in state[2]:
             board.play(*next_move)
-            child_state = self.search_tree[board.hashable()]
+            child_state = tree[board.hashable(), turn]
             board.undo()
-            weight = child_state[1] + self.C * (math.log(state[0])/child_state[0])**0.5
+            if child_state[4] != 0:
+                proven.append(next_move)
+                continue
+            children.append(next_move)
+            # the child's value is from the opponent's point of view, so flip it into a win rate for this player.
+            # keeping the weight positive is required by random.choices
+            win_rate = (1 - child_state[1] / child_state[0]) / 2
+            weight = win_rate + C * (log_visits/child_state[0])**0.5
             weights.append(weight)
+        if not children:
+            return random.choice(proven)
         return random.choices(children,weights)[0]
 
-    # plays random moves from a board state to see who wins
+    # plays random moves from a board state to see who wins.
+    # hex can't end in a draw, and filling in more cells never changes who has connected their sides,
+    # so rather than checking for a winner after every move, the rest of the board is filled in randomly
+    # and checked once. the board is put back the way it was afterwards
     def playout(self, board):
-        while board.winner == 0:
-            options = [(y, x) for (y, x) in itertools.product(range(board.size), repeat=2) if board[y][x] == 0]
-            next_move = random.choice(options)
-            board.play(*next_move)
-        return board.winner
+        if board.winner != 0:
+            return board.winner
+        cells = board.board
+        empty = [(y, x) for y in range(board.size) for x in range(board.size) if cells[y][x] == 0]
+        random.shuffle(empty)
+        # the player to move gets the first of the shuffled cells, and every other one after that
+        turn = board.turn
+        for y, x in empty[::2]:
+            cells[y][x] = turn
+        for y, x in empty[1::2]:
+            cells[y][x] = -turn
+        winner = 1 if board.is_connected(1) else -1
+        for y, x in empty:
+            cells[y][x] = 0
+        return winner
 
     # performs multiple playouts and averages them
     def board_eval(self, board, samples):
         wins = 0
         losses = 0
         for i in range(samples):
-            rollout_board = deepcopy(board)
-            winner = self.playout(rollout_board)
+            winner = self.playout(board)
             if winner == board.turn:
                 wins += 1
             else:
@@ -360,6 +1253,20 @@ class MonteCarloPlayer(ComputerPlayer):
         return (wins-losses)/(wins+losses)
 
 
+# the key of a position in the monte carlo tree. after a swap the same stones can be reached with either player
+# to move, so the cells alone aren't enough
+def tree_key(board):
+    return board.hashable(), board.turn
+
+
+# the moves that can be played on a board, including a swap
+def legal_moves(board):
+    moves = [(y, x) for y in range(board.size) for x in range(board.size) if board[y][x] == 0]
+    if board.swap_rule and len(board.move_list) == 1:
+        moves.append(SWAP_MOVE)
+    return moves
+
+
 # this player is a mess. They try to find "saddle points" in the distance function
 # on the board to signify that a move is contested by both players
 class ChargeHeuristicPlayer(ComputerPlayer):
@@ -376,3 +1283,48 @@ class ChargeHeuristicPlayer(ComputerPlayer):
                 move = (y,x)
                 move_curvature = curve[y][x]*-board.turn
         board.play(*move)
+
+
+HEURISTICS = {
+    'shortest_path': ShortestPathHeuristic,
+    'two_distance': TwoDistanceHeuristic,
+    'pattern': PatternHeuristic,
+}
+
+
+# builds a player from a json-like description, e.g.
+# {"type": "alpha_beta", "heuristic": "shortest_path", "depth": 2} or {"type": "monte_carlo", "max_time": 1}.
+# an alpha-beta player can use a shared transposition table that another process made, by giving its "shared_table" name
+def build_player(spec, player_num, size):
+    if spec['type'] == 'alpha_beta':
+        sorter = ChargeHeuristic(size, spec.get('charge_radius')) if spec.get('sorter') == 'charge' else None
+        table = SharedTranspositionTable(name=spec['shared_table']) if spec.get('shared_table') else None
+        return AlphaBetaPlayer(player_num, HEURISTICS[spec.get('heuristic', 'shortest_path')](),
+                               spec.get('depth', -1), spec.get('max_time', 0), sorter, spec.get('killer_moves', 6),
+                               spec.get('collect_stats', True), spec.get('stats_file'),
+                               ponder=spec.get('ponder', False), game_time=spec.get('game_time', 0),
+                               increment=spec.get('increment', 0), transposition_table=table,
+                               late_move_reductions=spec.get('late_move_reductions', False),
+                               reduction_moves=spec.get('reduction_moves', 4),
+                               reduction_depth=spec.get('reduction_depth', 3),
+                               futility_pruning=spec.get('futility_pruning', False),
+                               futility_margin=spec.get('futility_margin'), negamax=spec.get('negamax', False),
+                               candidate_radius=spec.get('candidate_radius'), path_depth=spec.get('path_depth', 2))
+    if spec['type'] == 'monte_carlo':
+        evaluator = None
+        if spec.get('evaluator') == 'network':
+            # numpy is only needed for the network
+            from network import DEFAULT_NETWORK, load_network
+            evaluator = load_network(spec.get('network', DEFAULT_NETWORK))
+        return MonteCarloPlayer(player_num, size, spec.get('max_time', 1), spec.get('num_samples', 100),
+                                spec.get('collect_stats', True), spec.get('stats_file'), spec.get('ponder', False),
+                                evaluator, spec.get('batch_size', 16))
+    if spec['type'] == 'random':
+        return RandomPlayer(player_num)
+    if spec['type'] == 'charge':
+        return ChargeHeuristicPlayer(player_num, size)
+    if spec['type'] == 'text':
+        return TextPlayer(player_num)
+    if spec['type'] == 'gui':
+        return GuiPlayer(player_num)
+    raise ValueError('unknown player type %r' % spec['type'])
@@ -0,0 +1,341 @@
+"""
+A compact binary format for storing finished games, with a streaming writer and reader,
+and conversion to and from SGF text (as used by HexGui)
+
+A file starts with the 5 byte header b'HEXR' + version, followed by any number of games. Each game is:
+    size (u8), flags (u8), result (i8), number of moves (u16)
+    the two player names, each as a u8 length followed by utf-8 bytes
+    one byte per move (row * size + col, 255 for a swap). boards with more than 255 cells use two bytes per move
+    optionally, a float32 time per move, then a float32 value per move
+"""
+import argparse
+import math
+import re
+import struct
+import sys
+from timeit import default_timer
+
+from board import HexBoard, SWAP_MOVE
+
+MAGIC = b'HEXR'
+VERSION = 1
+FILE_HEADER = MAGIC + bytes([VERSION])
+GAME_HEADER = struct.Struct('<BBbH')
+
+# flags stored in each game header
+SWAP_RULE = 1
+HAS_TIMES = 2
+HAS_VALUES = 4
+RESIGNED = 8
+WIDE_MOVES = 16
+
+# the code used for a swap in the move bytes
+SWAP_CODE = 0xFF
+WIDE_SWAP_CODE = 0xFFFF
+
+
+# a finished game, with optional per-move search times and values
+class GameRecord:
+    def __init__(self, size, moves, result=0, swap_rule=False, players=('', ''), times=None, values=None,
+                 resigned=False):
+        self.size = size
+        self.moves = list(moves)
+        # the winning player, 1 or -1. 0 if the game wasn't finished
+        self.result = result
+        self.swap_rule = swap_rule
+        # the names of player 1 and player 2
+        self.players = tuple(players)
+        self.times = times
+        self.values = values
+        self.resigned = resigned
+
+    def __eq__(self, other):
+        return isinstance(other, GameRecord) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return 'GameRecord(size=%d, moves=%d, result=%d)' % (self.size, len(self.moves), self.result)
+
+    @staticmethod
+    def from_board(board, players=('', ''), times=None, values=None):
+        winner = board.winner
+        return GameRecord(board.size, board.move_list, winner, board.swap_rule, players, times, values,
+                          resigned=(winner != 0 and board.winning_group is None))
+
+    # plays the game's moves on a new board
+    def replay(self):
+        board = HexBoard(self.size, self.swap_rule)
+        for move in self.moves:
+            board.play(*move)
+        if self.resigned and board.winner == 0:
+            board.resign(-self.result)
+        return board
+
+    def encode(self):
+        flags = 0
+        if self.swap_rule:
+            flags |= SWAP_RULE
+        if self.times is not None:
+            flags |= HAS_TIMES
+        if self.values is not None:
+            flags |= HAS_VALUES
+        if self.resigned:
+            flags |= RESIGNED
+        wide = self.size * self.size >= SWAP_CODE
+        if wide:
+            flags |= WIDE_MOVES
+        data = bytearray(GAME_HEADER.pack(self.size, flags, self.result, len(self.moves)))
+        for name in self.players:
+            # a long name is cut short between characters, so it still decodes
+            name = name.encode('utf-8')[:255].decode('utf-8', 'ignore').encode('utf-8')
+            data.append(len(name))
+            data += name
+        codes = [encode_move(move, self.size, wide) for move in self.moves]
+        data += struct.pack('<%d%s' % (len(codes), 'H' if wide else 'B'), *codes)
+        for extra in (self.times, self.values):
+            if extra is not None:
+                data += struct.pack('<%df' % len(self.moves), *(math.nan if x is None else x for x in extra))
+        return bytes(data)
+
+
+def encode_move(move, size, wide=False):
+    if move == SWAP_MOVE:
+        return WIDE_SWAP_CODE if wide else SWAP_CODE
+    return move[0] * size + move[1]
+
+
+def decode_move(code, size, wide=False):
+    if code == (WIDE_SWAP_CODE if wide else SWAP_CODE):
+        return SWAP_MOVE
+    return divmod(code, size)
+
+
+# appends games to a file as they finish. the file is created with a header if it doesn't exist yet
+class GameWriter:
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER)
+            self.file.flush()
+
+    def write(self, record):
+        self.file.write(record.encode())
+        # flush every game, so a crash never loses more than the game in progress
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# yields the games in a file one at a time, so files of any size can be scanned
+def read_games(path):
+    with open(path, 'rb') as f:
+        header = f.read(len(FILE_HEADER))
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a game record file' % path)
+        if header[len(MAGIC)] != VERSION:
+            raise ValueError('unsupported game record version %d' % header[len(MAGIC)])
+        while True:
+            data = f.read(GAME_HEADER.size)
+            if not data:
+                return
+            if len(data) < GAME_HEADER.size:
+                raise ValueError('truncated game record in %s' % path)
+            size, flags, result, num_moves = GAME_HEADER.unpack(data)
+            players = []
+            for _ in range(2):
+                length = f.read(1)[0]
+                players.append(f.read(length).decode('utf-8'))
+            wide = bool(flags & WIDE_MOVES)
+            codes = struct.unpack('<%d%s' % (num_moves, 'H' if wide else 'B'), f.read(num_moves * (2 if wide else 1)))
+            moves = [decode_move(code, size, wide) for code in codes]
+            times = values = None
+            if flags & HAS_TIMES:
+                times = list(struct.unpack('<%df' % num_moves, f.read(4 * num_moves)))
+            if flags & HAS_VALUES:
+                values = list(struct.unpack('<%df' % num_moves, f.read(4 * num_moves)))
+            yield GameRecord(size, moves, result, bool(flags & SWAP_RULE), players, times, values,
+                             bool(flags & RESIGNED))
+
+
+# keeps track of the time taken and value expected for each move of a game as it's played.
+# undone moves are forgotten
+class GameRecorder:
+    def __init__(self, board, players=('', '')):
+        self.board = board
+        self.players = players
+        self.times = []
+        self.values = []
+        self._turn_start = default_timer()
+
+    # call after a player makes a move (or undoes one), with the value the player expected
+    def update(self, value=None):
+        moves = len(self.board.move_list)
+        if len(self.times) > moves:
+            del self.times[moves:]
+            del self.values[moves:]
+        while len(self.times) < moves:
+            self.times.append(default_timer() - self._turn_start)
+            self.values.append(math.nan if value is None else value)
+        self._turn_start = default_timer()
+
+    def record(self):
+        self.update()
+        return GameRecord.from_board(self.board, self.players, self.times, self.values)
+
+
+# the name saved for a player in a game record
+def player_name(player):
+    return type(player).__name__
+
+
+# the value a computer player expected for its last move, from player 1's point of view, if it kept statistics
+def player_value(player):
+    stats = getattr(player, 'stats', None)
+    if stats is None or stats.value is None:
+        return None
+    return stats.value
+
+
+# SGF uses a letter for the column and a number for the row, like a1.
+# player 1 is written as black (B), and player 2 as white (W)
+def sgf_move(move):
+    if move == SWAP_MOVE:
+        return 'swap-pieces'
+    row, col = move
+    return '%s%d' % (column_name(col), row + 1)
+
+
+def column_name(col):
+    name = ''
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        name = chr(ord('a') + rem) + name
+    return name
+
+
+def parse_sgf_move(text):
+    if text == 'swap-pieces':
+        return SWAP_MOVE
+    match = re.fullmatch(r'([a-z]+)(\d+)', text)
+    if not match:
+        raise ValueError('bad move %r' % text)
+    col = 0
+    for char in match.group(1):
+        col = col * 26 + ord(char) - ord('a') + 1
+    return int(match.group(2)) - 1, col - 1
+
+
+def sgf_escape(text):
+    return text.replace('\\', '\\\\').replace(']', '\\]')
+
+
+def to_sgf(record):
+    result = ''
+    if record.result:
+        result = 'RE[%s+%s]' % ('B' if record.result == 1 else 'W', 'Resign' if record.resigned else '')
+    text = '(;FF[4]AP[HexBoardGame]GM[11]SZ[%d]PB[%s]PW[%s]%s%s' % (
+        record.size, sgf_escape(record.players[0]), sgf_escape(record.players[1]), result,
+        'RU[swap]' if record.swap_rule else '')
+    for i, move in enumerate(record.moves):
+        text += '\n;%s[%s]' % ('B' if i % 2 == 0 else 'W', sgf_move(move))
+        comments = []
+        if record.times is not None and not math.isnan(record.times[i]):
+            comments.append('time=%.3f' % record.times[i])
+        if record.values is not None and not math.isnan(record.values[i]):
+            comments.append('value=%s' % record.values[i])
+        if comments:
+            text += 'C[%s]' % ' '.join(comments)
+    return text + ')\n'
+
+
+SGF_PROPERTY = re.compile(r'([A-Z]+)((?:\[(?:[^\]\\]|\\.)*\])+)')
+SGF_VALUE = re.compile(r'\[((?:[^\]\\]|\\.)*)\]')
+
+
+# reads every game in an SGF collection. only the main line of each game is kept
+def from_sgf(text):
+    records = []
+    for game in re.findall(r'\((;.*?)\)\s*(?=\(|$)', text, re.S):
+        size = 11
+        players = ['', '']
+        result = 0
+        resigned = False
+        swap_rule = False
+        moves = []
+        times = []
+        values = []
+        for node in game.split(';')[1:]:
+            for name, raw in SGF_PROPERTY.findall(node):
+                value = SGF_VALUE.findall(raw)[0].replace('\\]', ']').replace('\\\\', '\\')
+                if name == 'SZ':
+                    size = int(value.split(':')[0])
+                elif name == 'PB':
+                    players[0] = value
+                elif name == 'PW':
+                    players[1] = value
+                elif name == 'RE' and value[:2] in ('B+', 'W+'):
+                    result = 1 if value[0] == 'B' else -1
+                    resigned = value[2:].lower().startswith('r')
+                elif name == 'RU':
+                    swap_rule = 'swap' in value
+                elif name in ('B', 'W'):
+                    moves.append(parse_sgf_move(value))
+                    times.append(math.nan)
+                    values.append(math.nan)
+                elif name == 'C' and moves:
+                    for item in value.split():
+                        key, _, number = item.partition('=')
+                        if key == 'time':
+                            times[-1] = float(number)
+                        elif key == 'value':
+                            values[-1] = float(number)
+        if SWAP_MOVE in moves:
+            swap_rule = True
+        has_times = any(not math.isnan(t) for t in times)
+        has_values = any(not math.isnan(v) for v in values)
+        records.append(GameRecord(size, moves, result, swap_rule, players, times if has_times else None,
+                                  values if has_values else None, resigned))
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect and convert hex game records')
+    parser.add_argument('command', choices=('show', 'to-sgf', 'from-sgf'))
+    parser.add_argument('input')
+    parser.add_argument('output', nargs='?')
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        wins = {1: 0, -1: 0, 0: 0}
+        count = 0
+        for count, record in enumerate(read_games(args.input), 1):
+            wins[record.result] += 1
+            print('%6d: %dx%d %s vs %s, %d moves, winner %d%s' % (
+                count, record.size, record.size, record.players[0], record.players[1], len(record.moves),
+                record.result % 3, ' (resigned)' if record.resigned else ''))
+        print('%d games, player 1 won %d, player 2 won %d' % (count, wins[1], wins[-1]))
+    elif args.command == 'to-sgf':
+        out = open(args.output, 'w') if args.output else sys.stdout
+        for record in read_games(args.input):
+            out.write(to_sgf(record))
+        if args.output:
+            out.close()
+    elif args.command == 'from-sgf':
+        if not args.output:
+            parser.error('from-sgf needs an output file')
+        with open(args.input) as f:
+            records = from_sgf(f.read())
+        with GameWriter(args.output) as writer:
+            for record in records:
+                writer.write(record)
+
+
+if __name__ == '__main__':
+    main()
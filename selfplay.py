@@ -0,0 +1,303 @@
+"""
+Generates training data by having the computer players play themselves.
+Games run headless across a pool of worker processes, and every position is saved with the search's
+value and chosen move (or MCTS visit distribution) into chunked NumPy shards:
+
+    out_dir/shard_00000/boards.npy    int8   (N, size, size)  1 for player 1 stones, -1 for player 2
+    out_dir/shard_00000/turns.npy     int8   (N,)             the player to move
+    out_dir/shard_00000/values.npy    float32 (N,)            the search value, from player 1's point of view
+    out_dir/shard_00000/policies.npy  float32 (N, size*size)  visit share, or 1 for the chosen move
+    out_dir/shard_00000/results.npy   int8   (N,)             the winner of the game
+    out_dir/shard_00000/hashes.npy    uint64 (N,)             position hashes, used to skip duplicates
+
+Each position is also saved under the board's symmetries. The run can be stopped and resumed at any time
+
+    python3 selfplay.py out_dir --games 1000 --size 7 --workers 4
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+from board import HexBoard, SWAP_MOVE
+from player import MonteCarloPlayer, build_player
+from record import GameRecord, GameWriter
+
+PROGRESS_FILE = 'progress.json'
+FIELDS = ('boards', 'turns', 'values', 'policies', 'results', 'hashes')
+# the size of the filter of positions already saved, and the number of bits each position sets
+DEDUP_BYTES = 16 << 20
+DEDUP_HASHES = 7
+
+def position_hash(board, turn):
+    data = board.astype(np.int8).tobytes() + bytes([turn & 0xFF])
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+# every symmetry of a position, as (board, turn, value, policy) with the policy as a size x size grid.
+# turning the board 180 degrees keeps each player's sides, and mirroring across the diagonal while swapping
+# the colours gives the same position from the other player's side
+def symmetries(board, turn, value, policy):
+    rotated = (board[::-1, ::-1], turn, value, policy[::-1, ::-1])
+    mirrored = (-board.T, -turn, -value, policy.T)
+    mirrored_rotated = (-board.T[::-1, ::-1], -turn, -value, policy.T[::-1, ::-1])
+    return [(board, turn, value, policy), rotated, mirrored, mirrored_rotated]
+
+
+# plays a single game, and returns its samples and game record. runs in a worker process
+def play_game(args):
+    game_index, config = args
+    seed = config['seed'] + game_index
+    random.seed(seed)
+    size = config['size']
+    board = HexBoard(size, config.get('swap', False))
+    players = {1: build_player(config['players'][0], 1, size), -1: build_player(config['players'][1], -1, size)}
+    rng = random.Random(seed)
+    samples = []
+    times = []
+    values = []
+    # the players print a lot while they search
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # a few random opening moves, so that deterministic players don't repeat the same game
+        for _ in range(config.get('random_opening', 2)):
+            empty = [(y, x) for y in range(size) for x in range(size) if board[y][x] == 0]
+            board.play(*rng.choice(empty))
+            times.append(0.0)
+            values.append(float('nan'))
+        while board.winner == 0:
+            player = players[board.turn]
+            position = np.array(board.board, dtype=np.int8)
+            turn = board.turn
+            stats = player.move(board)
+            if not board.move_list or len(times) == len(board.move_list):
+                break
+            move = board.move_list[-1]
+            policy = np.zeros((size, size), dtype=np.float32)
+            if isinstance(player, MonteCarloPlayer):
+                board.undo()
+                visits = player.visit_counts(board)
+                value = player.root_value(board)
+                board.play(*move)
+                total = sum(visits.values())
+                for (y, x), count in visits.items():
+                    if (y, x) != SWAP_MOVE:
+                        policy[y, x] = count / total
+            else:
+                value = stats.value if stats is not None else 0.0
+                if move != SWAP_MOVE:
+                    policy[move] = 1
+            times.append(stats.total_time if stats is not None else 0.0)
+            values.append(value)
+            samples.append((position, turn, value, policy))
+    record = GameRecord.from_board(board, tuple(spec['type'] for spec in config['players']), times, values)
+    return game_index, board.winner, samples, record.encode()
+
+
+# a bloom filter of the position hashes already saved, so the memory used to skip duplicates stays the same
+# however much data there is. a position is never saved twice, but once the filter fills up a new position is
+# sometimes taken for a duplicate and skipped. the chance of that is about (1 - e^(-hashes * n / bits)) ^ hashes
+# after n positions: for the default 16MB and 7 hashes, 0.2% after 10 million positions, and 5% after 20 million
+class SeenFilter:
+    def __init__(self, size_bytes=DEDUP_BYTES, hashes=DEDUP_HASHES):
+        self.bits = np.zeros(size_bytes, dtype=np.uint8)
+        self.num_bits = size_bytes * 8
+        self.hashes = hashes
+
+    # the bits of a key, or of an array of keys. the position hashes are already random, so each of the hashes is
+    # the low half plus a multiple of the high half
+    def positions(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        low = (keys & np.uint64(0xFFFFFFFF))[..., None]
+        high = (keys >> np.uint64(32) | np.uint64(1))[..., None]
+        return (low + np.arange(self.hashes, dtype=np.uint64) * high) % np.uint64(self.num_bits)
+
+    def add_many(self, keys):
+        positions = self.positions(keys).ravel()
+        masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), masks)
+
+    # adds a key, and returns whether it was (probably) already there
+    def add(self, key):
+        positions = self.positions(key)
+        index = positions >> np.uint64(3)
+        masks = np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        if np.all(self.bits[index] & masks):
+            return True
+        self.bits[index] |= masks
+        return False
+
+
+# collects samples in memory until there are enough for a shard, then writes them out
+class ShardWriter:
+    def __init__(self, out_dir, size, shard_size, next_shard=0):
+        self.out_dir = out_dir
+        self.size = size
+        self.shard_size = shard_size
+        self.next_shard = next_shard
+        self.buffer = {field: [] for field in FIELDS}
+
+    def __len__(self):
+        return len(self.buffer['hashes'])
+
+    def add(self, board, turn, value, policy, result, position):
+        self.buffer['boards'].append(board)
+        self.buffer['turns'].append(turn)
+        self.buffer['values'].append(value)
+        self.buffer['policies'].append(policy.reshape(-1))
+        self.buffer['results'].append(result)
+        self.buffer['hashes'].append(position)
+
+    def full(self):
+        return len(self) >= self.shard_size
+
+    # writes the buffered samples. the shard is written to a temporary directory first,
+    # so a shard directory only ever exists once it's complete
+    def flush(self):
+        if not len(self):
+            return
+        name = 'shard_%05d' % self.next_shard
+        tmp = os.path.join(self.out_dir, name + '.tmp')
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, 'boards.npy'), np.stack(self.buffer['boards']).astype(np.int8))
+        np.save(os.path.join(tmp, 'turns.npy'), np.array(self.buffer['turns'], dtype=np.int8))
+        np.save(os.path.join(tmp, 'values.npy'), np.array(self.buffer['values'], dtype=np.float32))
+        np.save(os.path.join(tmp, 'policies.npy'), np.stack(self.buffer['policies']).astype(np.float32))
+        np.save(os.path.join(tmp, 'results.npy'), np.array(self.buffer['results'], dtype=np.int8))
+        np.save(os.path.join(tmp, 'hashes.npy'), np.array(self.buffer['hashes'], dtype=np.uint64))
+        os.replace(tmp, os.path.join(self.out_dir, name))
+        self.next_shard += 1
+        self.buffer = {field: [] for field in FIELDS}
+
+
+def shard_dirs(out_dir):
+    return sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir)
+                  if name.startswith('shard_') and not name.endswith('.tmp'))
+
+
+# opens every field of every shard as memory mapped arrays, without loading them
+def load_shards(out_dir):
+    for path in shard_dirs(out_dir):
+        yield {field: np.load(os.path.join(path, field + '.npy'), mmap_mode='r') for field in FIELDS}
+
+
+# the progress of a run. games are only counted once their samples are safely in a shard
+def load_progress(out_dir):
+    path = os.path.join(out_dir, PROGRESS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_progress(out_dir, progress):
+    path = os.path.join(out_dir, PROGRESS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(progress, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def generate(out_dir, config, games, workers=1, shard_size=50000, augment=True, log=sys.stderr,
+             dedup_bytes=DEDUP_BYTES):
+    os.makedirs(out_dir, exist_ok=True)
+    # anything left over from a run that was interrupted while writing a shard
+    for name in os.listdir(out_dir):
+        if name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+
+    progress = load_progress(out_dir)
+    if progress is None:
+        progress = {'config': config, 'completed': [], 'shards': 0, 'samples': 0, 'duplicates': 0}
+    elif progress['config'] != config:
+        raise ValueError('%s was generated with a different configuration' % out_dir)
+    # only games whose samples were written to a shard are counted, anything after that is played again
+    completed = set(progress['completed'])
+
+    # the positions already saved, to skip duplicates
+    seen = SeenFilter(dedup_bytes)
+    for shard in load_shards(out_dir):
+        seen.add_many(shard['hashes'])
+
+    writer = ShardWriter(out_dir, config['size'], shard_size, len(shard_dirs(out_dir)))
+    record_writer = GameWriter(os.path.join(out_dir, 'games.hexr'))
+    # the games whose samples are still in memory, and their encoded game records
+    pending = []
+    todo = [(i, config) for i in range(games) if i not in completed]
+
+    # shards are only written between games, so a game is either entirely saved or played again
+    def checkpoint():
+        writer.flush()
+        for game_index, record in pending:
+            record_writer.file.write(record)
+            completed.add(game_index)
+        record_writer.file.flush()
+        pending.clear()
+        progress['completed'] = sorted(completed)
+        progress['shards'] = writer.next_shard
+        save_progress(out_dir, progress)
+
+    pool = Pool(workers) if workers > 1 else None
+    results = pool.imap_unordered(play_game, todo) if pool else map(play_game, todo)
+    try:
+        for game_index, winner, samples, record in results:
+            for position, turn, value, policy in samples:
+                variants = symmetries(position, turn, value, policy) if augment else [(position, turn, value, policy)]
+                for sym_board, sym_turn, sym_value, sym_policy in variants:
+                    key = position_hash(sym_board, sym_turn)
+                    if seen.add(key):
+                        progress['duplicates'] += 1
+                        continue
+                    # the winner is also mirrored when the colours are swapped
+                    sym_result = winner if sym_turn * turn > 0 else -winner
+                    writer.add(np.ascontiguousarray(sym_board), sym_turn, sym_value, sym_policy, sym_result, key)
+                    progress['samples'] += 1
+            pending.append((game_index, record))
+            if writer.full():
+                checkpoint()
+            print('game %d finished, winner %d, %d samples' % (game_index, winner % 3, progress['samples']), file=log)
+        checkpoint()
+    finally:
+        if pool:
+            pool.terminate()
+        record_writer.close()
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate self-play training data')
+    parser.add_argument('out_dir')
+    parser.add_argument('--games', type=int, default=100, help='total number of games in the data set')
+    parser.add_argument('--size', type=int, default=7)
+    parser.add_argument('--swap', action='store_true')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--shard-size', type=int, default=50000, help='samples per shard')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--random-opening', type=int, default=2, help='random moves at the start of each game')
+    parser.add_argument('--player', action='append', type=json.loads,
+                        help='json description of a player, given once per side '
+                             '(default {"type": "alpha_beta", "heuristic": "shortest_path", "depth": 2})')
+    parser.add_argument('--no-augment', action='store_true', help="don't save the symmetries of each position")
+    parser.add_argument('--dedup-mb', type=int, default=DEDUP_BYTES >> 20,
+                        help='memory for skipping duplicate positions. more keeps fewer new positions from being '
+                             'mistaken for duplicates on big runs (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    players = args.player or [{'type': 'alpha_beta', 'heuristic': 'shortest_path', 'depth': 2}]
+    if len(players) == 1:
+        players = players * 2
+    config = {'size': args.size, 'swap': args.swap, 'seed': args.seed, 'random_opening': args.random_opening,
+              'players': players}
+    progress = generate(args.out_dir, config, args.games, args.workers, args.shard_size, not args.no_augment,
+                        dedup_bytes=args.dedup_mb << 20)
+    print('%d games, %d samples, %d duplicates skipped' % (
+        len(progress['completed']), progress['samples'], progress['duplicates']))
+
+
+if __name__ == '__main__':
+    main()
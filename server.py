@@ -0,0 +1,457 @@
+"""
+Hosts many games at once for clients on a local socket, with human players, bots and analysis in any mix.
+The bots' moves are worked out by a shared pool of worker processes, so hundreds of games don't need a process each.
+Games waiting for a bot take turns on the pool, each going to the back of the queue once it has had a move
+
+    python3 server.py --port 8765 --workers 4 --record games.hexr
+
+Clients send one JSON object per line and get JSON lines back. Moves are written like a1, and players 1 and 2
+are numbered 1 and -1. A player of type "client" is played by the clients, and any other type is a bot:
+
+    {"cmd": "new", "size": 7, "swap": false, "game_time": 60, "increment": 1,
+     "players": [{"type": "client"}, {"type": "alpha_beta", "heuristic": "two_distance", "max_time": 1}]}
+    {"cmd": "watch", "game": 1}
+    {"cmd": "play", "game": 1, "move": "d4"}
+    {"cmd": "resign", "game": 1}
+    {"cmd": "analyze", "game": 1, "seconds": 2, "player": {"type": "monte_carlo"}}
+    {"cmd": "list"}
+    {"cmd": "close", "game": 1}
+
+The server answers with events: created, state, move, end, analysis, games, closed and error.
+Everyone watching a game (including whoever made it) gets its move and end events as they happen.
+Bots only take the settings in BOT_SETTINGS, clamped to BOT_LIMITS, and client players are charged
+the time the server measures from the start of their turn
+A finished game is closed once nobody is watching it, or after FINISHED_GAME_TIME seconds
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from math import isfinite
+from timeit import default_timer
+
+from board import HexBoard
+from clock import TimeManager
+from player import HEURISTICS, AlphaBetaPlayer, MonteCarloPlayer, build_player
+from record import GameRecord, GameWriter, sgf_move, parse_sgf_move, player_value
+
+DEFAULT_PORT = 8765
+# the settings a client can give each type of bot, and the type of each. anything that names a file,
+# a shared table or a network is only for players built on the server's own machine
+BOT_SETTINGS = {
+    'alpha_beta': {'heuristic': str, 'depth': int, 'max_time': float, 'sorter': str, 'charge_radius': int,
+                   'killer_moves': int, 'late_move_reductions': bool, 'reduction_moves': int, 'reduction_depth': int,
+                   'futility_pruning': bool, 'futility_margin': int, 'negamax': bool, 'candidate_radius': int,
+                   'path_depth': int},
+    'monte_carlo': {'max_time': float, 'num_samples': int, 'evaluator': str, 'batch_size': int},
+    'random': {},
+    'charge': {},
+}
+# the range each numeric setting is clamped to, so one game can't hold a worker for long
+BOT_LIMITS = {
+    'depth': (-1, 6),
+    'max_time': (0, 30),
+    'batch_size': (1, 256),
+    'num_samples': (1, 1000),
+    'killer_moves': (0, 16),
+}
+# the seconds per move for an alpha-beta bot that wasn't given any. a bot with a depth stops at whichever comes first
+DEFAULT_BOT_TIME = 1
+# the most time an analysis can be given
+MAX_ANALYSIS_TIME = 60
+# seconds a finished game is kept for its watchers, unless they all stop watching it sooner
+FINISHED_GAME_TIME = 300
+# a client that lets this many bytes of events pile up without reading them is disconnected
+MAX_WRITE_BUFFER = 1 << 20
+# the players each worker process keeps between moves. a game's moves usually land on different workers,
+# but when one comes back to a worker that still has its player, the player's tables carry over
+MAX_CACHED_PLAYERS = 32
+
+_players = OrderedDict()
+
+
+# a request that can't be carried out. the message is sent back as an error event
+class RequestError(Exception):
+    pass
+
+
+# worker processes throw away everything the players print
+def quiet_worker():
+    sys.stdout = open(os.devnull, 'w')
+
+
+# checks a bot's settings from a client, and clamps them to what the server allows
+def bot_spec(spec):
+    bot_type = spec.get('type')
+    if bot_type not in BOT_SETTINGS:
+        raise RequestError('unknown player type %r' % bot_type)
+    settings = BOT_SETTINGS[bot_type]
+    checked = {'type': bot_type}
+    for key, value in spec.items():
+        if key == 'type' or value is None:
+            continue
+        if key not in settings:
+            raise RequestError('%s players have no setting %r' % (bot_type, key))
+        if settings[key] is bool:
+            if not isinstance(value, bool):
+                raise RequestError('%s must be true or false' % key)
+        elif settings[key] is not str:
+            value = float(value)
+            if not isfinite(value):
+                raise RequestError('%s must be a number' % key)
+            value = settings[key](value)
+        if key in BOT_LIMITS:
+            low, high = BOT_LIMITS[key]
+            value = min(max(value, low), high)
+        checked[key] = value
+    if checked.get('heuristic', 'shortest_path') not in HEURISTICS:
+        raise RequestError('unknown heuristic %r' % checked['heuristic'])
+    if checked.get('sorter', 'charge') != 'charge':
+        raise RequestError('unknown sorter %r' % checked['sorter'])
+    if checked.get('evaluator', 'network') != 'network':
+        raise RequestError('unknown evaluator %r' % checked['evaluator'])
+    if bot_type == 'alpha_beta' and not checked.get('max_time'):
+        checked['max_time'] = DEFAULT_BOT_TIME
+    return checked
+
+
+def replay(size, swap, moves):
+    board = HexBoard(size, swap)
+    for move in moves:
+        board.play(*move)
+    return board
+
+
+# finds a bot's move in a worker process. with a game budget, the move is planned from the time left.
+# returns the move (None to resign), the seconds it took, and the value the player expected
+def bot_move(key, spec, size, swap, moves, remaining=None, increment=0):
+    player = _players.pop(key, None)
+    if player is None:
+        # a pondering search would keep running in the worker after the move
+        player = build_player(dict(spec, ponder=False), 1, size)
+    _players[key] = player
+    while len(_players) > MAX_CACHED_PLAYERS:
+        _players.popitem(last=False)
+    board = replay(size, swap, moves)
+    player.player_num = board.turn
+    player.stopped = False
+    start = default_timer()
+    if remaining is not None and isinstance(player, AlphaBetaPlayer):
+        player.time_manager = TimeManager(0, remaining, increment)
+    elif remaining is not None and isinstance(player, MonteCarloPlayer):
+        clock = TimeManager(0, remaining, increment)
+        clock.start_move(board)
+        player.max_time = clock.soft_limit
+    player.move(board)
+    seconds = default_timer() - start
+    move = board.move_list[len(moves)] if len(board.move_list) > len(moves) else None
+    return move, seconds, player_value(player)
+
+
+# analyses a position in a worker process
+def analyze_position(spec, size, swap, moves, seconds):
+    board = replay(size, swap, moves)
+    spec = dict(spec, collect_stats=False)
+    # a player without a time limit of its own is given the analysis time, so it can be built
+    spec.setdefault('max_time', seconds)
+    player = build_player(spec, board.turn, size)
+    result = player.analyze(board, seconds)
+    if result is None:
+        return None
+    result['pv'] = [sgf_move(move) for move in result['pv']]
+    if 'visits' in result:
+        result['visits'] = {sgf_move(move): count for move, count in result['visits'].items()}
+    return result
+
+
+# a client connected to the server
+class Connection:
+    def __init__(self, writer):
+        self.writer = writer
+
+    def send(self, event):
+        if self.writer.is_closing():
+            return
+        self.writer.write((json.dumps(event) + '\n').encode('utf-8'))
+        # a client that isn't reading would make the server hold on to everything sent to it
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            self.writer.close()
+
+
+# a game being played on the server, and the clients watching it
+class Game:
+    def __init__(self, game_id, size, swap, players, game_time=0, increment=0):
+        self.id = game_id
+        self.board = HexBoard(size, swap)
+        self.players = {1: players[0], -1: players[1]}
+        # the time each player has left for the rest of the game, if the game has a time limit
+        self.clocks = {1: game_time, -1: game_time} if game_time > 0 else None
+        self.increment = increment
+        self.watchers = set()
+        self.times = []
+        self.values = []
+        # whether the game is waiting in the queue for a bot's move
+        self.queued = False
+        # when the player to move started their turn. clients are charged from this, not from what they report
+        self.turn_start = default_timer()
+        self.closed = False
+
+    def is_bot(self, side):
+        return self.players[side]['type'] != 'client'
+
+    def state(self):
+        board = self.board
+        return {'event': 'state', 'game': self.id, 'size': board.size, 'swap': board.swap_rule,
+                'players': [self.players[1], self.players[-1]], 'moves': [sgf_move(m) for m in board.move_list],
+                'turn': board.turn, 'winner': board.winner, 'clocks': self.clocks and [self.clocks[1], self.clocks[-1]]}
+
+    def broadcast(self, event):
+        for connection in list(self.watchers):
+            connection.send(event)
+
+    def record(self):
+        names = tuple(spec['type'] for spec in (self.players[1], self.players[-1]))
+        return GameRecord.from_board(self.board, names, self.times, self.values)
+
+
+class MatchServer:
+    def __init__(self, workers=os.cpu_count(), record_path=None):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(workers, initializer=quiet_worker)
+        self.record_writer = GameWriter(record_path) if record_path else None
+        self.games = dict()
+        self.next_id = 1
+        # games waiting for a bot's move, in the order they'll get one
+        self.ready = None
+        self.commands = {
+            'new': self.new_game,
+            'watch': self.watch,
+            'unwatch': self.unwatch,
+            'play': self.play,
+            'resign': self.resign,
+            'analyze': self.analyze,
+            'list': self.list_games,
+            'close': self.close_game,
+        }
+
+    # runs the server until it's cancelled. one task per worker takes games from the queue,
+    # so the pool always has work and the queue decides which game goes next
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, path=None):
+        self.ready = asyncio.Queue()
+        dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+        if path:
+            server = await asyncio.start_unix_server(self.handle_client, path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in dispatchers:
+                task.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            if self.record_writer:
+                self.record_writer.close()
+
+    async def handle_client(self, reader, writer):
+        connection = Connection(writer)
+        try:
+            while not writer.is_closing():
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    command = self.commands.get(request.get('cmd'))
+                    if command is None:
+                        raise RequestError('unknown command %r' % request.get('cmd'))
+                    await command(connection, request)
+                except (RequestError, ValueError, KeyError, TypeError, AttributeError) as error:
+                    connection.send({'event': 'error', 'message': str(error)})
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game in list(self.games.values()):
+                self.unwatch_game(game, connection)
+            writer.close()
+
+    def get_game(self, request):
+        game = self.games.get(request.get('game'))
+        if game is None:
+            raise RequestError('no game %r' % request.get('game'))
+        return game
+
+    # puts a game at the back of the queue, if a bot is to move in it
+    def schedule(self, game):
+        if not game.queued and not game.closed and game.board.winner == 0 and game.is_bot(game.board.turn):
+            game.queued = True
+            self.ready.put_nowait(game)
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            game = await self.ready.get()
+            game.queued = False
+            board = game.board
+            if game.closed or board.winner != 0 or not game.is_bot(board.turn):
+                continue
+            side = board.turn
+            moves = list(board.move_list)
+            remaining = game.clocks[side] if game.clocks else None
+            try:
+                move, seconds, value = await loop.run_in_executor(
+                    self.executor, bot_move, (game.id, side), game.players[side], board.size, board.swap_rule,
+                    moves, remaining, game.increment)
+            except Exception as error:
+                game.broadcast({'event': 'error', 'game': game.id, 'message': 'bot failed: %s' % error})
+                move, seconds, value = None, 0, None
+            # the game might have been closed, or a player resigned, while the bot was thinking
+            if game.closed or board.move_list != moves or board.winner != 0:
+                continue
+            try:
+                self.make_move(game, side, move, seconds, value)
+            except RequestError as error:
+                game.broadcast({'event': 'error', 'game': game.id, 'message': str(error)})
+                self.make_move(game, side, None)
+
+    # applies a move (None to resign) and tells the watchers
+    def make_move(self, game, side, move, seconds=0.0, value=None):
+        board = game.board
+        if game.clocks and seconds > game.clocks[side]:
+            # running out of time loses the game
+            move = None
+        if move is not None and not board.play(*move):
+            raise RequestError('illegal move %s' % sgf_move(move))
+        if game.clocks:
+            game.clocks[side] = max(game.clocks[side] - seconds, 0) + game.increment
+        if move is None:
+            board.resign(side)
+        else:
+            game.times.append(seconds)
+            game.values.append(value)
+            game.turn_start = default_timer()
+            game.broadcast({'event': 'move', 'game': game.id, 'player': side, 'move': sgf_move(move),
+                            'seconds': seconds, 'value': value,
+                            'clocks': game.clocks and [game.clocks[1], game.clocks[-1]]})
+        if board.winner != 0:
+            game.broadcast({'event': 'end', 'game': game.id, 'winner': board.winner,
+                            'resigned': board.winning_group is None})
+            if self.record_writer:
+                self.record_writer.write(game.record())
+            # the game is only kept so its watchers can look at the result
+            asyncio.get_running_loop().call_later(FINISHED_GAME_TIME, self.remove_game, game)
+        else:
+            self.schedule(game)
+
+    async def new_game(self, connection, request):
+        size = int(request.get('size', 11))
+        if not 1 <= size <= 26:
+            raise RequestError('board size must be between 1 and 26')
+        players = request.get('players', [{'type': 'client'}, {'type': 'client'}])
+        if len(players) != 2:
+            raise RequestError('a game needs two players')
+        players = [{'type': 'client'} if spec['type'] == 'client' else bot_spec(spec) for spec in players]
+        game = Game(self.next_id, size, bool(request.get('swap', False)), players,
+                    float(request.get('game_time', 0)), float(request.get('increment', 0)))
+        self.next_id += 1
+        self.games[game.id] = game
+        game.watchers.add(connection)
+        connection.send({'event': 'created', 'game': game.id})
+        self.schedule(game)
+
+    async def watch(self, connection, request):
+        game = self.get_game(request)
+        game.watchers.add(connection)
+        connection.send(game.state())
+
+    async def unwatch(self, connection, request):
+        self.unwatch_game(self.get_game(request), connection)
+
+    # a finished game is forgotten as soon as nobody is watching it
+    def unwatch_game(self, game, connection):
+        game.watchers.discard(connection)
+        if not game.watchers and game.board.winner != 0:
+            self.remove_game(game)
+
+    # a move for a player that the clients play
+    async def play(self, connection, request):
+        game = self.get_game(request)
+        board = game.board
+        if board.winner != 0:
+            raise RequestError('the game is over')
+        if game.is_bot(board.turn):
+            raise RequestError('it is a bot\'s turn')
+        move = parse_sgf_move(str(request['move']).lower())
+        self.make_move(game, board.turn, move, default_timer() - game.turn_start)
+
+    async def resign(self, connection, request):
+        game = self.get_game(request)
+        side = int(request.get('player', game.board.turn))
+        if game.board.winner != 0:
+            raise RequestError('the game is over')
+        if side not in (1, -1) or game.is_bot(side):
+            raise RequestError('only a client player can resign')
+        self.make_move(game, side, None)
+
+    # analyses the current position on the pool, without holding up the client's other requests
+    async def analyze(self, connection, request):
+        game = self.get_game(request)
+        board = game.board
+        if board.winner != 0:
+            raise RequestError('the game is over')
+        spec = bot_spec(request.get('player', {'type': 'monte_carlo'}))
+        if spec['type'] not in ('alpha_beta', 'monte_carlo'):
+            raise RequestError('%s players cannot analyze positions' % spec['type'])
+        seconds = min(float(request.get('seconds', 1)), MAX_ANALYSIS_TIME)
+        moves = list(board.move_list)
+        loop = asyncio.get_running_loop()
+
+        async def run():
+            try:
+                result = await loop.run_in_executor(self.executor, analyze_position, spec, board.size,
+                                                    board.swap_rule, moves, seconds)
+            except Exception as error:
+                connection.send({'event': 'error', 'game': game.id, 'message': 'analysis failed: %s' % error})
+                return
+            connection.send({'event': 'analysis', 'game': game.id, 'moves': len(moves), 'result': result})
+
+        asyncio.create_task(run())
+
+    async def list_games(self, connection, request):
+        connection.send({'event': 'games', 'games': [
+            {'game': game.id, 'size': game.board.size, 'moves': len(game.board.move_list),
+             'winner': game.board.winner, 'players': [game.players[1]['type'], game.players[-1]['type']]}
+            for game in self.games.values()]})
+
+    async def close_game(self, connection, request):
+        self.remove_game(self.get_game(request))
+
+    def remove_game(self, game):
+        if game.closed:
+            return
+        game.closed = True
+        del self.games[game.id]
+        game.broadcast({'event': 'closed', 'game': game.id})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Host many games at once on a local socket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='listen on a unix socket at this path instead')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes that work out bot moves')
+    parser.add_argument('--record', help='game record file to append finished games to')
+    args = parser.parse_args(argv)
+
+    server = MatchServer(args.workers, args.record)
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Counters collected by the search players during a move,
+used to see where search time is spent when tuning
+"""
+import json
+from timeit import default_timer
+
+
+# the statistics of a single call to a player's move function.
+# players only update the counters that apply to their search
+class SearchStats:
+    def __init__(self, player_type=None):
+        self.player_type = player_type
+        # the number of nodes visited, and how many of them were evaluated by the heuristic
+        self.nodes = 0
+        self.leaf_evals = 0
+        # transposition table usage
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_stores = 0
+        # cutoffs[i] is the number of cutoffs caused by the i-th move searched at a node
+        self.cutoffs = []
+        # the number of cutoffs caused by a killer move
+        self.killer_hits = 0
+        # selective search: moves searched at reduced depth, reduced moves searched again at full depth,
+        # and moves skipped by futility pruning
+        self.reductions = 0
+        self.researches = 0
+        self.futility_prunes = 0
+        # seconds spent in each part of the search
+        self.heuristic_time = 0.0
+        self.movegen_time = 0.0
+        self.win_check_time = 0.0
+        # the depth the current search started at, so that remaining depth can be turned into a ply
+        self.root_depth = 0
+        # nodes visited at each ply from the root, and how many of them were expanded
+        self.nodes_per_ply = []
+        self.expanded_per_ply = []
+        # one entry for each iteration of iterative deepening
+        self.iterations = []
+        # monte carlo tree search counters
+        self.searches = 0
+        self.playouts = 0
+        self.playout_moves = 0
+        self.playout_time = 0.0
+        self.tree_size = 0
+        # tree nodes proven to be won or lost during the move
+        self.proofs = 0
+        # the final result of the move
+        self.depth = 0
+        self.value = None
+        self.move = None
+        self._start_time = default_timer()
+        self.total_time = 0.0
+
+    # records a visit to a node with the given remaining depth, and returns its ply
+    def visit(self, depth):
+        self.nodes += 1
+        ply = self.root_depth - depth
+        while len(self.nodes_per_ply) <= ply:
+            self.nodes_per_ply.append(0)
+            self.expanded_per_ply.append(0)
+        self.nodes_per_ply[ply] += 1
+        return ply
+
+    def expand(self, ply):
+        self.expanded_per_ply[ply] += 1
+
+    # records a cutoff caused by the index-th move searched at a node
+    def cutoff(self, index, killer=False):
+        while len(self.cutoffs) <= index:
+            self.cutoffs.append(0)
+        self.cutoffs[index] += 1
+        if killer:
+            self.killer_hits += 1
+
+    def begin_iteration(self, depth):
+        self.root_depth = depth
+        self._iteration_nodes = self.nodes
+        self._iteration_start = default_timer()
+
+    def end_iteration(self, depth, completed, value=None):
+        self.iterations.append({
+            'depth': depth,
+            'nodes': self.nodes - self._iteration_nodes,
+            'seconds': default_timer() - self._iteration_start,
+            'completed': completed,
+            'value': value,
+        })
+
+    # the average number of children searched at each ply
+    def branching_factors(self):
+        return [self.nodes_per_ply[ply + 1] / self.expanded_per_ply[ply]
+                for ply in range(len(self.nodes_per_ply) - 1) if self.expanded_per_ply[ply]]
+
+    # the growth in nodes from one iterative deepening iteration to the next
+    def iteration_branching_factors(self):
+        factors = []
+        for prev, curr in zip(self.iterations, self.iterations[1:]):
+            if prev['nodes']:
+                factors.append(curr['nodes'] / prev['nodes'])
+        return factors
+
+    def finish(self, value=None, move=None, depth=None):
+        self.total_time = default_timer() - self._start_time
+        self.value = value
+        self.move = move
+        if depth is not None:
+            self.depth = depth
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.total_time if self.total_time else 0.0
+
+    def as_dict(self):
+        result = {key: value for key, value in vars(self).items() if not key.startswith('_')}
+        result['branching_factors'] = self.branching_factors()
+        result['iteration_branching_factors'] = self.iteration_branching_factors()
+        result['nodes_per_second'] = self.nodes_per_second
+        return result
+
+    # appends the stats to a file as a single line of json
+    def write_json(self, path):
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.as_dict()) + '\n')
@@ -0,0 +1,96 @@
+"""
+Trains the policy/value network used by the monte carlo player from self-play data (requires NumPy).
+The policy learns the moves (or visit shares) the searches chose, and the value learns who went on to win.
+The data is the shard directories written by selfplay.py, which already include every symmetry of each position
+
+    python3 train_network.py data/ more_data/ --epochs 20 --output network_weights.npz
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from network import DEFAULT_NETWORK, PolicyValueNetwork, canonical
+from selfplay import load_shards
+
+
+# every position in the data sets, grouped by board size, as canonical boards with their targets
+def load_data(paths):
+    by_size = dict()
+    for path in paths:
+        for shard in load_shards(path):
+            boards = np.asarray(shard['boards'])
+            turns = np.asarray(shard['turns'])
+            size = boards.shape[1]
+            policies = np.array(shard['policies']).reshape(-1, size, size)
+            flip = turns == -1
+            policies[flip] = np.transpose(policies[flip], (0, 2, 1))
+            values = np.asarray(shard['results'], dtype=np.float32) * turns
+            by_size.setdefault(size, []).append((canonical(boards, turns), policies, values))
+    return {size: tuple(np.concatenate(parts) for parts in zip(*chunks)) for size, chunks in by_size.items()}
+
+
+# adam, with the moments kept for each parameter
+class Adam:
+    def __init__(self, params, rate=1e-3, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        self.rate = rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.steps = 0
+        self.m = {name: np.zeros_like(value) for name, value in params.items()}
+        self.v = {name: np.zeros_like(value) for name, value in params.items()}
+
+    def step(self, params, grads):
+        self.steps += 1
+        correction = np.sqrt(1 - self.beta2 ** self.steps) / (1 - self.beta1 ** self.steps)
+        for name, grad in grads.items():
+            self.m[name] = self.beta1 * self.m[name] + (1 - self.beta1) * grad
+            self.v[name] = self.beta2 * self.v[name] + (1 - self.beta2) * grad * grad
+            params[name] = (params[name] - self.rate * correction * self.m[name] /
+                            (np.sqrt(self.v[name]) + self.epsilon)).astype(params[name].dtype)
+
+
+def train(paths, epochs=20, batch_size=256, rate=1e-3, filters=16, layers=3, seed=0, log=sys.stderr):
+    data = load_data(paths)
+    if not data:
+        raise ValueError('no self-play data found')
+    rng = np.random.default_rng(seed)
+    network = PolicyValueNetwork(filters=filters, layers=layers, seed=seed)
+    optimizer = Adam(network.params, rate)
+    for epoch in range(epochs):
+        totals = np.zeros(2)
+        count = 0
+        batches = [(size, start) for size, (boards, _, _) in data.items() for start in range(0, len(boards), batch_size)]
+        order = {size: rng.permutation(len(boards)) for size, (boards, _, _) in data.items()}
+        for i in rng.permutation(len(batches)):
+            size, start = batches[i]
+            boards, policies, values = data[size]
+            index = order[size][start:start + batch_size]
+            policy_loss, value_loss, grads = network.gradients(boards[index], policies[index], values[index])
+            optimizer.step(network.params, grads)
+            totals += (policy_loss * len(index), value_loss * len(index))
+            count += len(index)
+        print('epoch %d: policy loss %.4f, value loss %.4f' % (epoch + 1, *(totals / count)), file=log)
+    return network
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the policy/value network from self-play data')
+    parser.add_argument('data', nargs='+', help='directories written by selfplay.py')
+    parser.add_argument('--output', '-o', default=DEFAULT_NETWORK)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--rate', type=float, default=1e-3, help='learning rate')
+    parser.add_argument('--filters', type=int, default=16)
+    parser.add_argument('--layers', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    network = train(args.data, args.epochs, args.batch_size, args.rate, args.filters, args.layers, args.seed)
+    network.save(args.output)
+    print('saved the network to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
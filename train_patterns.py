@@ -0,0 +1,125 @@
+"""
+Trains the weights of the PatternHeuristic from finished games (requires NumPy).
+Every position of every game is labelled with the game's winner, and the weights are fit by ridge regression,
+so the summed pattern weights predict who goes on to win. The colour swapped mirror of each position is
+added as well, so the weights treat both players the same way
+
+    python3 train_patterns.py games.hexr more_games.hexr --output pattern_weights.bin
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from board import SWAP_MOVE
+from heuristic import NUM_PATTERNS, WEIGHT_SCALE, DEFAULT_WEIGHTS, pattern_indices, save_weights
+from record import read_games
+
+# positions are turned into features this many at a time, to keep memory use down
+CHUNK_SIZE = 4096
+
+
+# every position of a game before its last move, with the player to move
+def game_positions(record):
+    board = np.zeros((record.size, record.size), dtype=np.int8)
+    turn = 1
+    for move in record.moves:
+        yield board.copy(), turn
+        if move == SWAP_MOVE:
+            row, col = record.moves[0]
+            board[row, col] = 0
+            board[col, row] = -1
+        else:
+            board[move] = turn
+        turn = -turn
+
+
+# one row of pattern counts for each board, with the player to move as the last column
+def features(boards, turns):
+    indices = pattern_indices(boards)
+    rows = np.repeat(np.arange(len(boards)), indices.shape[1])
+    counts = np.zeros((len(boards), NUM_PATTERNS + 1))
+    np.add.at(counts, (rows, indices.reshape(-1)), 1)
+    counts[:, NUM_PATTERNS] = turns
+    return counts
+
+
+# the normal equations of the least squares fit, added up a chunk of positions at a time
+class Accumulator:
+    def __init__(self):
+        self.xtx = np.zeros((NUM_PATTERNS + 1, NUM_PATTERNS + 1))
+        self.xty = np.zeros(NUM_PATTERNS + 1)
+        self.boards = []
+        self.turns = []
+        self.results = []
+        self.count = 0
+
+    def add(self, board, turn, result):
+        # the same position with the colours swapped is mirrored across the diagonal, and the winner swapped
+        for sym_board, sym_turn, sym_result in ((board, turn, result), (-board.T, -turn, -result)):
+            self.boards.append(sym_board)
+            self.turns.append(sym_turn)
+            self.results.append(sym_result)
+        if len(self.boards) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.boards:
+            return
+        # boards of different sizes can't be stacked together
+        by_size = {}
+        for board, turn, result in zip(self.boards, self.turns, self.results):
+            by_size.setdefault(len(board), []).append((board, turn, result))
+        for samples in by_size.values():
+            x = features(np.stack([board for board, _, _ in samples]), np.array([turn for _, turn, _ in samples]))
+            y = np.array([result for _, _, result in samples], dtype=np.float64)
+            self.xtx += x.T @ x
+            self.xty += x.T @ y
+            self.count += len(samples)
+        self.boards, self.turns, self.results = [], [], []
+
+    # solves for the weights, with the given amount of ridge regularization
+    def solve(self, ridge):
+        self.flush()
+        return np.linalg.solve(self.xtx + ridge * np.eye(len(self.xty)), self.xty)
+
+
+# rounds the weights to the integers stored in a weight file
+def quantize(weights):
+    info = np.iinfo(np.int16)
+    return np.clip(np.round(weights * WEIGHT_SCALE), info.min, info.max).astype(np.int16)
+
+
+def train(paths, ridge=100.0, skip_opening=0, log=sys.stderr):
+    accumulator = Accumulator()
+    games = 0
+    for path in paths:
+        for record in read_games(path):
+            if record.result == 0:
+                continue
+            games += 1
+            for i, (board, turn) in enumerate(game_positions(record)):
+                if i >= skip_opening:
+                    accumulator.add(board, turn, record.result)
+    accumulator.flush()
+    print('%d games, %d positions' % (games, accumulator.count), file=log)
+    if not accumulator.count:
+        raise ValueError('no finished games to train on')
+    return quantize(accumulator.solve(ridge))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the pattern heuristic weights from game records')
+    parser.add_argument('records', nargs='+', help='game record files, as written by record.py or selfplay.py')
+    parser.add_argument('--output', '-o', default=DEFAULT_WEIGHTS)
+    parser.add_argument('--ridge', type=float, default=100.0, help='regularization, larger keeps the weights smaller')
+    parser.add_argument('--skip-opening', type=int, default=0, help="don't train on the first moves of each game")
+    args = parser.parse_args(argv)
+
+    weights = train(args.records, args.ridge, args.skip_opening)
+    save_weights(weights, args.output)
+    print('saved %d weights to %s, %d non-zero' % (len(weights), args.output, np.count_nonzero(weights)))
+
+
+if __name__ == '__main__':
+    main()
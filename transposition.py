@@ -0,0 +1,237 @@
+"""
+A table of previously searched positions,
+used by players to avoid searching the same position twice.
+SharedTranspositionTable keeps its entries in shared memory, so searches in several processes can use one table
+"""
+import os
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+from board import SWAP_MOVE
+
+# alpha-beta search only finds the exact value of a position if it lands inside the search window.
+# otherwise, the value is only a bound on the real value
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class TranspositionTable:
+    def __init__(self):
+        # positions are grouped by the number of moves played to reach them.
+        # once a move is made, positions with fewer moves can never be seen again and are cheap to throw away
+        self.tables = dict()
+
+    def __len__(self):
+        return sum(len(table) for table in self.tables.values())
+
+    # returns the stored (value, move_list) for a position, if the stored result is deep enough
+    # and its value can be trusted inside the given window. otherwise returns None
+    def probe(self, board_state, num_moves, depth, alpha, beta):
+        table = self.tables.get(num_moves)
+        if table is None:
+            return None
+        entry = table.get(board_state)
+        if entry is None:
+            return None
+        entry_depth, bound, value, move_list = entry
+        if entry_depth < depth:
+            return None
+        if bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha):
+            return value, move_list
+        return None
+
+    # the best move found by an earlier search of a position, or None
+    def best_move(self, board_state, num_moves):
+        table = self.tables.get(num_moves)
+        if table is None:
+            return None
+        entry = table.get(board_state)
+        if entry is None or entry[3] is None:
+            return None
+        return entry[3][0]
+
+    # remembers the result of searching a position with the window (alpha, beta)
+    def store(self, board_state, num_moves, depth, value, move_list, alpha, beta):
+        if value <= alpha:
+            bound = UPPER
+        elif value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        table = self.tables.get(num_moves)
+        if table is None:
+            table = self.tables[num_moves] = dict()
+        entry = table.get(board_state)
+        # a shallower result never replaces a deeper one
+        if entry is None or entry[0] <= depth:
+            table[board_state] = (depth, bound, value, move_list)
+
+    # throws away every position reached in fewer than num_moves moves
+    def clear_before(self, num_moves):
+        for old in [n for n in self.tables if n < num_moves]:
+            del self.tables[old]
+
+    def clear(self):
+        self.tables.clear()
+
+
+# an entry of the shared table: a check word, then the value, best move, depth + 1 (0 for an empty entry),
+# and the bound with the position's age.
+# the check word is the top of the position's hash xor'd with the rest of the entry, so an entry that's half written
+# by one process while another reads it doesn't match any position, and is ignored
+ENTRY = struct.Struct('<IdHBB')
+ENTRY_DATA = struct.Struct('<dHBB')
+ENTRY_WORDS = struct.Struct('<III')
+# move codes for a swap and for no move. other moves are row * 256 + col
+SWAP_CODE = 0xFFFE
+NO_MOVE = 0xFFFF
+# the number of moves played is kept modulo this, to tell which entries are left over from earlier in the game
+AGES = 64
+
+
+# a fixed size table in shared memory that any number of processes can probe and store into at the same time,
+# without locks. positions hash to a bucket of two entries: one kept for the deepest result, and one that's always
+# replaced. only the best move of each position is kept, rather than every expected move
+class SharedTranspositionTable:
+    # entries is rounded up to a power of two. with a name, the table is shared memory that already exists
+    def __init__(self, entries=1 << 20, name=None):
+        buckets = 1
+        while buckets * 2 < entries:
+            buckets *= 2
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=buckets * 2 * ENTRY.size)
+            self.memory.buf[:] = bytes(len(self.memory.buf))
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            # attaching registers the memory with this process's resource tracker, which frees it when the process
+            # exits, even though other processes are still using it. only the owner should free it
+            if os.name == 'posix':
+                resource_tracker.unregister(self.memory._name, 'shared_memory')
+            buckets = len(self.memory.buf) // (2 * ENTRY.size)
+        self.name = self.memory.name
+        self.buckets = buckets
+        # entries for positions before this many moves can be replaced by anything
+        self.min_moves = 0
+
+    # the table is sent to other processes by name, and they attach to the same memory
+    def __getstate__(self):
+        return {'name': self.name, 'min_moves': self.min_moves}
+
+    def __setstate__(self, state):
+        self.__init__(name=state['name'])
+        self.min_moves = state['min_moves']
+
+    # the number of entries in use. reads the whole table, so it's slow
+    def __len__(self):
+        count = 0
+        for offset in range(0, self.buckets * 2 * ENTRY.size, ENTRY.size):
+            if self._read(offset) is not None:
+                count += 1
+        return count
+
+    # the position's key, and the offset of the first entry of its bucket.
+    # tuples of ints hash the same way in every process
+    def _locate(self, board_state, num_moves):
+        key = hash((board_state, num_moves)) & 0xFFFFFFFFFFFFFFFF
+        return key >> 32, (key % self.buckets) * 2 * ENTRY.size
+
+    # the entry at an offset as (check, value, move code, depth, flags), or None if it's empty.
+    # given the check of a position, entries for other positions and torn entries are None as well
+    def _read(self, offset, check=None):
+        entry = ENTRY.unpack_from(self.memory.buf, offset)
+        if entry[3] == 0:
+            return None
+        a, b, c = ENTRY_WORDS.unpack_from(self.memory.buf, offset + 4)
+        stored = entry[0] ^ a ^ b ^ c
+        if check is not None and stored != check:
+            return None
+        return stored, entry[1], entry[2], entry[3] - 1, entry[4]
+
+    def _find(self, board_state, num_moves):
+        check, offset = self._locate(board_state, num_moves)
+        for slot in (offset, offset + ENTRY.size):
+            entry = self._read(slot, check)
+            if entry is not None:
+                return entry
+        return None
+
+    # returns the stored (value, move_list) for a position, if the stored result is deep enough
+    # and its value can be trusted inside the given window. otherwise returns None
+    def probe(self, board_state, num_moves, depth, alpha, beta):
+        entry = self._find(board_state, num_moves)
+        if entry is None:
+            return None
+        _, value, move_code, entry_depth, flags = entry
+        if entry_depth < depth:
+            return None
+        bound = flags & 3
+        if bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha):
+            move = decode_move(move_code)
+            return value, (None if move is None else (move, None))
+        return None
+
+    # the best move found by an earlier search of a position, or None
+    def best_move(self, board_state, num_moves):
+        entry = self._find(board_state, num_moves)
+        if entry is None:
+            return None
+        return decode_move(entry[2])
+
+    # remembers the result of searching a position with the window (alpha, beta)
+    def store(self, board_state, num_moves, depth, value, move_list, alpha, beta):
+        if value <= alpha:
+            bound = UPPER
+        elif value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        check, offset = self._locate(board_state, num_moves)
+        # the first entry keeps the deepest result, unless it's for a position that can't come up again
+        deep = self._read(offset)
+        if deep is None or deep[0] == check and deep[3] <= depth or self._is_old(deep[4]):
+            slot = offset
+        else:
+            slot = offset + ENTRY.size
+        data = ENTRY_DATA.pack(value, NO_MOVE if move_list is None else encode_move(move_list[0]), min(depth, 254) + 1,
+                               bound | (num_moves % AGES) << 2)
+        a, b, c = ENTRY_WORDS.unpack(data)
+        buf = self.memory.buf
+        buf[slot + 4:slot + ENTRY.size] = data
+        struct.pack_into('<I', buf, slot, check ^ a ^ b ^ c)
+
+    # whether an entry was stored for a position from before the current move
+    def _is_old(self, flags):
+        return 0 < (self.min_moves - (flags >> 2)) % AGES < AGES // 2
+
+    # old positions are left for newer ones to replace
+    def clear_before(self, num_moves):
+        self.min_moves = num_moves
+
+    def clear(self):
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+
+    # stops using the table. the process that made it also frees the memory, once every process is finished
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            # a process that attached and shares the owner's resource tracker (like a worker it started) has
+            # unregistered the memory there too, and unlinking expects it to be registered
+            if os.name == 'posix':
+                resource_tracker.register(self.memory._name, 'shared_memory')
+            self.memory.unlink()
+
+
+def encode_move(move):
+    if move == SWAP_MOVE:
+        return SWAP_CODE
+    return move[0] << 8 | move[1]
+
+
+def decode_move(code):
+    if code == NO_MOVE:
+        return None
+    if code == SWAP_CODE:
+        return SWAP_MOVE
+    return code >> 8, code & 0xFF
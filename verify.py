@@ -0,0 +1,889 @@
+"""
+A differential test harness for the fast paths of the board, the heuristics and the alpha-beta search.
+Random and adversarial positions are checked against reference implementations that are slow, but simple enough
+to trust: winners against a flood fill, shortest and two-distances against relaxing every cell until nothing
+changes, child values against evaluating every move on a fresh board, fixed depth alpha-beta against plain
+minimax, the locality window's stone counts against counting every stone, and the monte carlo player's proven
+wins and losses against solving the game, along with perft counts of the positions at each depth.
+The shared transposition table is checked from a pool of worker processes and from a separate program,
+and game records are written and read back with player names too long to keep whole
+
+    python3 verify.py                  # a smoke test that takes about ten seconds
+    python3 verify.py --exhaustive     # every position of the smallest boards, bigger boards and deeper searches
+
+Every mismatch is printed with the position it was found in, and the exit status is 1 if there were any
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from math import inf, isnan
+from timeit import default_timer
+
+from board import ADJACENT, SWAP_MOVE, HexBoard
+from heuristic import (ChargeHeuristic, PatternHeuristic, ShortestPathHeuristic, TwoDistanceHeuristic, NUM_PATTERNS,
+                       NEIGHBOURHOOD, PLAYER_CODE, WEIGHT_SCALE)
+from locality import LocalityWindow, neighbourhoods
+from player import AlphaBetaPlayer, MonteCarloPlayer, principal_variation
+from record import GameRecord, GameWriter, read_games, sgf_move
+from transposition import SharedTranspositionTable, TranspositionTable
+
+# numpy is only needed for the batch heuristics, which are skipped without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the settings of each mode. random positions are made for every size, with and without the swap rule
+MODES = {
+    'smoke': {
+        'sizes': (1, 2, 3, 4, 5, 7),
+        'games': 1,
+        # every position of boards up to this size is checked
+        'enumerate': 2,
+        # the deepest alpha-beta search checked, for each board size
+        'search_depths': {2: 3, 3: 2, 4: 2},
+        # positions of each game that the child values are checked at, and how many of them are searched
+        'samples': 2,
+        'searches': 1,
+        # perft counts, as (size, swap rule, depth)
+        'perft': ((3, False, 4), (3, True, 3), (4, False, 3)),
+        # positions the monte carlo solver has to prove, as (size, swap rule, positions)
+        'solver': ((3, False, 4), (3, True, 2), (4, False, 2)),
+    },
+    'exhaustive': {
+        'sizes': (1, 2, 3, 4, 5, 6, 7, 8, 9, 11),
+        'games': 6,
+        'enumerate': 3,
+        'search_depths': {2: 4, 3: 3, 4: 3, 5: 2, 6: 2, 7: 2},
+        'samples': 8,
+        'searches': 2,
+        'perft': ((2, True, 5), (3, False, 9), (3, True, 5), (4, False, 4), (5, True, 3)),
+        'solver': ((2, True, 8), (3, False, 20), (3, True, 10), (4, False, 12), (4, True, 6), (5, False, 4)),
+    },
+}
+# the enumerated positions of boards bigger than this are too many to search at every one of them
+ENUMERATE_SEARCH_SIZE = 2
+# the solver's positions are solved by plain minimax, so they can't have more empty cells than this
+SOLVER_EMPTY_CELLS = 7
+# the most searches the monte carlo player gets to prove a position
+SOLVER_SEARCHES = 20000
+
+
+# counts the checks made and the mismatches found, and prints the first few mismatches in full
+class Checker:
+    def __init__(self, max_failures=10, out=sys.stdout):
+        self.max_failures = max_failures
+        self.out = out
+        # name: [checks, failures]
+        self.counts = dict()
+        self.failures = 0
+        # name: total, for numbers that are reported rather than checked
+        self.totals = dict()
+
+    def check(self, name, expected, actual, position):
+        counts = self.counts.setdefault(name, [0, 0])
+        counts[0] += 1
+        if same(expected, actual):
+            return True
+        counts[1] += 1
+        self.failures += 1
+        if self.failures <= self.max_failures:
+            self.out.write('MISMATCH %s at %s\n    expected %r\n    got      %r\n' %
+                           (name, describe(position), expected, actual))
+        return False
+
+    def add(self, name, amount):
+        self.totals[name] = self.totals.get(name, 0) + amount
+
+    def report(self, elapsed):
+        width = max(map(len, itertools.chain(self.counts, self.totals)), default=0)
+        for name, (checks, failures) in sorted(self.counts.items()):
+            self.out.write('%-*s %9d checks  %s\n' % (width, name, checks,
+                                                     'ok' if failures == 0 else '%d FAILED' % failures))
+        for name, total in sorted(self.totals.items()):
+            self.out.write('%-*s %9d\n' % (width, name, total))
+        self.out.write('%d mismatches in %.1f seconds\n' % (self.failures, elapsed))
+
+
+# equality that treats nan as equal to itself, and looks inside lists
+def same(expected, actual):
+    if isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)):
+        return len(expected) == len(actual) and all(same(e, a) for e, a in zip(expected, actual))
+    if isinstance(expected, float) and isinstance(actual, float) and isnan(expected) and isnan(actual):
+        return True
+    return expected == actual
+
+
+def board_name(size, swap):
+    return '%dx%d%s' % (size, size, ' swap' if swap else '')
+
+
+# a position is (size, swap rule, moves)
+def describe(position):
+    size, swap, moves = position
+    return '%s [%s]' % (board_name(size, swap), ' '.join(sgf_move(move) for move in moves))
+
+
+def load_board(position):
+    size, swap, moves = position
+    board = HexBoard(size, swap)
+    for move in moves:
+        board.play(*move)
+    return board
+
+
+# ----- reference implementations. none of these use HexBoard or the heuristics
+
+# the cells of a position and the player to move, worked out from the moves alone
+def reference_cells(size, moves):
+    cells = [[0] * size for _ in range(size)]
+    player = 1
+    for move in moves:
+        if move == SWAP_MOVE:
+            row, col = moves[0]
+            cells[row][col] = 0
+            cells[col][row] = -1
+        else:
+            cells[move[0]][move[1]] = player
+        player = -player
+    return cells, player
+
+
+# the cells next to each cell, worked out once for each size
+_neighbours = dict()
+
+
+def neighbours(size, row, col):
+    table = _neighbours.get(size)
+    if table is None:
+        table = _neighbours[size] = [[[(y + dy, x + dx) for dy, dx in ADJACENT if 0 <= y + dy < size and
+                                       0 <= x + dx < size] for x in range(size)] for y in range(size)]
+    return table[row][col]
+
+
+# the player whose stones connect their sides, found by flood filling from the first of them
+def reference_winner(cells):
+    size = len(cells)
+    for player in (1, -1):
+        start = [(i, 0) if player == 1 else (0, i) for i in range(size)]
+        stack = [cell for cell in start if cells[cell[0]][cell[1]] == player]
+        seen = set(stack)
+        while stack:
+            row, col = stack.pop()
+            if (col if player == 1 else row) == size - 1:
+                return player
+            for other in neighbours(size, row, col):
+                if other not in seen and cells[other[0]][other[1]] == player:
+                    seen.add(other)
+                    stack.append(other)
+    return 0
+
+
+def reference_moves(size, swap, moves, cells):
+    legal = [(row, col) for row in range(size) for col in range(size) if cells[row][col] == 0]
+    if swap and len(moves) == 1:
+        legal.append(SWAP_MOVE)
+    return legal
+
+
+# the number of empty cells a player still has to fill to connect their sides. every cell's distance
+# from the far side is lowered from its neighbours until nothing changes
+def reference_distance(cells, player):
+    size = len(cells)
+    cost = [[0 if value == player else 1 if value == 0 else inf for value in row] for row in cells]
+    dist = [[inf] * size for _ in range(size)]
+    for i in range(size):
+        row, col = (i, size - 1) if player == 1 else (size - 1, i)
+        dist[row][col] = cost[row][col]
+    changed = True
+    while changed:
+        changed = False
+        for row, col in itertools.product(range(size), repeat=2):
+            for other in neighbours(size, row, col):
+                value = dist[other[0]][other[1]] + cost[row][col]
+                if value < dist[row][col]:
+                    dist[row][col] = value
+                    changed = True
+    return min((dist[i][0] if player == 1 else dist[0][i] for i in range(size)), default=inf)
+
+
+def reference_shortest_path_value(cells):
+    winner = reference_winner(cells)
+    if winner != 0:
+        return winner * inf
+    return reference_distance(cells, -1) - reference_distance(cells, 1)
+
+
+# the empty cells next to a cell, seeing through the player's groups, and whether the cell or one of those groups
+# touches the side the player is heading for (the right for player 1, the bottom for player 2)
+def reference_group_neighbours(cells, player, row, col):
+    size = len(cells)
+    on_target = lambda r, c: (c if player == 1 else r) == size - 1
+    touches = on_target(row, col)
+    found = set()
+    stack = []
+    seen = set()
+    for other in neighbours(size, row, col):
+        if cells[other[0]][other[1]] == player:
+            seen.add(other)
+            stack.append(other)
+        elif cells[other[0]][other[1]] == 0:
+            found.add(other)
+    while stack:
+        stone = stack.pop()
+        touches = touches or on_target(*stone)
+        for other in neighbours(size, *stone):
+            if cells[other[0]][other[1]] == player and other not in seen:
+                seen.add(other)
+                stack.append(other)
+            elif cells[other[0]][other[1]] == 0:
+                found.add(other)
+    found.discard((row, col))
+    return found, touches
+
+
+# the two-distance of every empty cell, lowered from the second best of its neighbours until nothing changes
+def reference_two_distance_labels(cells, player):
+    size = len(cells)
+    empty = [(row, col) for row in range(size) for col in range(size) if cells[row][col] == 0]
+    links = {cell: reference_group_neighbours(cells, player, *cell) for cell in empty}
+    labels = {cell: inf for cell in empty}
+    changed = True
+    while changed:
+        changed = False
+        for cell in empty:
+            found, touches = links[cell]
+            if touches:
+                value = 1
+            else:
+                values = sorted(labels[other] for other in found)
+                value = values[1] + 1 if len(values) > 1 else inf
+            if value < labels[cell]:
+                labels[cell] = value
+                changed = True
+    return labels, links
+
+
+# the two-distance across the board, or the plain distance through the same cells plus a penalty
+def reference_two_distance(cells, player):
+    size = len(cells)
+    labels, links = reference_two_distance_labels(cells, player)
+    sources = set()
+    for i in range(size):
+        row, col = (i, 0) if player == 1 else (0, i)
+        if cells[row][col] == 0:
+            sources.add((row, col))
+        elif cells[row][col] == player:
+            # the liberties of the group, which are the neighbours of any of its stones
+            sources |= reference_group_neighbours(cells, player, row, col)[0]
+    values = sorted(labels[cell] for cell in sources)
+    if len(values) > 1 and values[1] < inf:
+        return values[1]
+    distance = {cell: 1 if links[cell][1] else inf for cell in labels}
+    changed = True
+    while changed:
+        changed = False
+        for cell, (found, _) in links.items():
+            for other in found:
+                if distance[other] + 1 < distance[cell]:
+                    distance[cell] = distance[other] + 1
+                    changed = True
+    return TwoDistanceHeuristic.DISCONNECTED + min((distance[cell] for cell in sources), default=inf)
+
+
+def reference_two_distance_value(cells):
+    winner = reference_winner(cells)
+    if winner != 0:
+        return winner * inf
+    return reference_two_distance(cells, -1) - reference_two_distance(cells, 1)
+
+
+# the sum of the weight of the pattern around every cell, with the sides of the board belonging to their owners
+def reference_pattern_value(cells, turn, weights):
+    winner = reference_winner(cells)
+    if winner != 0:
+        return winner * inf
+    size = len(cells)
+
+    def code(row, col):
+        row_inside = 0 <= row < size
+        col_inside = 0 <= col < size
+        if row_inside and col_inside:
+            return PLAYER_CODE[cells[row][col]] if cells[row][col] else 0
+        # the corners of the padding belong to nobody
+        if row_inside:
+            return PLAYER_CODE[1]
+        return PLAYER_CODE[-1] if col_inside else 0
+    total = 0
+    for row, col in itertools.product(range(size), repeat=2):
+        index = sum(code(row + dy, col + dx) * 3 ** k for k, (dy, dx) in enumerate(NEIGHBOURHOOD))
+        total += weights[index]
+    return (total + turn * weights[NUM_PATTERNS]) / WEIGHT_SCALE
+
+
+# the value of every child of a position, or the position's own value everywhere if the game is over
+def reference_child_values(position, evaluate):
+    size, swap, moves = position
+    cells, turn = reference_cells(size, moves)
+    if reference_winner(cells) != 0:
+        value = evaluate(cells, turn)
+        return [[value] * size for _ in range(size)]
+    values = [[0] * size for _ in range(size)]
+    for row, col in itertools.product(range(size), repeat=2):
+        if cells[row][col] == 0:
+            values[row][col] = evaluate(*reference_cells(size, moves + [(row, col)]))
+    return values
+
+
+# plain minimax, with no pruning, no tables and no move ordering. returns the value and the number of nodes
+def reference_minimax(position, depth, evaluate):
+    size, swap, moves = position
+    cells, turn = reference_cells(size, moves)
+    if depth == 0 or reference_winner(cells) != 0:
+        return evaluate(cells, turn), 1
+    best = -inf if turn == 1 else inf
+    nodes = 1
+    for move in reference_moves(size, swap, moves, cells):
+        value, count = reference_minimax((size, swap, moves + [move]), depth - 1, evaluate)
+        nodes += count
+        best = max(best, value) if turn == 1 else min(best, value)
+    return best, nodes
+
+
+# the number of positions reached after exactly depth moves, counting a finished game as a dead end
+def reference_perft(position, depth):
+    size, swap, moves = position
+    if depth == 0:
+        return 1
+    cells, _ = reference_cells(size, moves)
+    if reference_winner(cells) != 0:
+        return 0
+    return sum(reference_perft((size, swap, moves + [move]), depth - 1)
+               for move in reference_moves(size, swap, moves, cells))
+
+
+# the same count on one board, playing and undoing moves
+def board_perft(board, depth):
+    if depth == 0:
+        return 1
+    if board.winner != 0:
+        return 0
+    options = [(row, col) for row in range(board.size) for col in range(board.size) if board[row][col] == 0]
+    if board.swap_rule and len(board.move_list) == 1:
+        options.append(SWAP_MOVE)
+    count = 0
+    for move in options:
+        board.play(*move)
+        count += board_perft(board, depth - 1)
+        board.undo()
+    return count
+
+
+# ----- positions
+
+# a game of random moves, played until someone wins. with the swap rule, the second move is sometimes a swap
+def random_game(size, swap, rng):
+    board = HexBoard(size, swap)
+    cells = [(row, col) for row in range(size) for col in range(size)]
+    rng.shuffle(cells)
+    for move in cells:
+        if board.winner != 0:
+            break
+        if swap and len(board.move_list) == 1 and rng.random() < 0.5:
+            board.play(*SWAP_MOVE)
+        board.play(*move)
+    return list(board.move_list)
+
+
+# a game where one player builds a long winding chain across the board, while the other plays randomly.
+# long chains are the worst case for following groups, and the game ends when the chain is finished
+def snake_game(size, swap, rng, player):
+    # a random walk across the board that never touches itself, found by depth first search
+    path = None
+    for start in rng.sample(range(size), size):
+        stack = [[(start, 0) if player == 1 else (0, start)]]
+        while stack and path is None:
+            walk = stack.pop()
+            row, col = walk[-1]
+            if (col if player == 1 else row) == size - 1:
+                path = walk
+                break
+            options = [other for other in neighbours(size, row, col) if other not in walk and
+                       not any(n in walk[:-1] for n in neighbours(size, *other))]
+            rng.shuffle(options)
+            stack.extend(walk + [other] for other in options)
+            if len(stack) > 2000:
+                stack = stack[-200:]
+        if path is not None:
+            break
+    path = path or []
+    others = [(row, col) for row in range(size) for col in range(size) if (row, col) not in path]
+    rng.shuffle(others)
+    rng.shuffle(path)
+    board = HexBoard(size, swap)
+    while board.winner == 0 and (path or others):
+        own = path if board.turn == player else others
+        if not own:
+            own = others or path
+        board.play(*own.pop())
+    return list(board.move_list)
+
+
+# a game played only on the cells around the edge of the board, then anywhere
+def edge_game(size, swap, rng):
+    edge = [(row, col) for row in range(size) for col in range(size) if row in (0, size - 1) or col in (0, size - 1)]
+    inner = [(row, col) for row in range(size) for col in range(size) if (row, col) not in edge]
+    rng.shuffle(edge)
+    rng.shuffle(inner)
+    board = HexBoard(size, swap)
+    for move in edge + inner:
+        if board.winner != 0:
+            break
+        board.play(*move)
+    return list(board.move_list)
+
+
+# the games checked for a board size and swap rule
+def games(size, swap, count, rng):
+    found = [random_game(size, swap, rng) for _ in range(count)]
+    found.append(snake_game(size, swap, rng, 1))
+    found.append(snake_game(size, swap, rng, -1))
+    found.append(edge_game(size, swap, rng))
+    return found
+
+
+# every position that can come up on a board, as move lists in depth first order
+def enumerate_positions(size, swap):
+    seen = set()
+    board = HexBoard(size, swap)
+    positions = []
+
+    def visit():
+        key = (board.hashable(), board.turn, len(board.move_list) == 1)
+        if key in seen:
+            return
+        seen.add(key)
+        positions.append(list(board.move_list))
+        if board.winner != 0:
+            return
+        options = [(row, col) for row in range(size) for col in range(size) if board[row][col] == 0]
+        if swap and len(board.move_list) == 1:
+            options.append(SWAP_MOVE)
+        for move in options:
+            board.play(*move)
+            visit()
+            board.undo()
+    visit()
+    return positions
+
+
+# ----- checks
+
+# the winner and winning group of a board, against the flood fill
+def check_winner(checker, position, board):
+    cells, _ = reference_cells(position[0], position[2])
+    checker.check('board.cells', cells, board.board, position)
+    winner = reference_winner(cells)
+    # the cached winner, then the connection checked again from scratch
+    checker.check('board.winner', winner, board.winner, position)
+    fresh = board.copy()
+    fresh._winner = None
+    fresh._mover = None
+    checker.check('board.winner.fresh', winner, fresh.winner, position)
+    if winner != 0:
+        group = board.winning_group or []
+        size = board.size
+        axis = [col if winner == 1 else row for row, col in group]
+        valid = (all(cells[row][col] == winner for row, col in group) and
+                 all(b in set(neighbours(size, *a)) for a, b in zip(group, group[1:])) and
+                 0 in axis and size - 1 in axis)
+        checker.check('board.winning_group', True, valid, position)
+    checker.check('board.hashable', tuple(map(tuple, cells)), board.hashable(), position)
+
+
+def check_distances(checker, position, board, shortest_path):
+    cells, _ = reference_cells(position[0], position[2])
+    for player in (1, -1):
+        checker.check('shortest_distance', reference_distance(cells, player),
+                      shortest_path.shortest_distance(board, player), position)
+    if np is not None:
+        boards = np.array([cells], dtype=np.int8)
+        checker.check('shortest_distance.batch', [reference_distance(cells, 1), reference_distance(cells, -1)],
+                      [float(ShortestPathHeuristic.batch_distance(boards, 1)[0]),
+                       float(ShortestPathHeuristic.batch_distance(boards.transpose(0, 2, 1), -1)[0])], position)
+
+
+# the two-distance value from a heuristic that has only seen this position, and from one that is kept between
+# positions, so that it has to undo and replay its way there
+def check_two_distance(checker, position, board, kept, expected=None):
+    if expected is None:
+        expected = reference_two_distance_value(reference_cells(position[0], position[2])[0])
+    checker.check('two_distance.fresh', expected, TwoDistanceHeuristic().get_value(board), position)
+    checker.check('two_distance.incremental', expected, kept.get_value(board), position)
+    return expected
+
+
+# the stone counts of a locality window kept between positions against counting every stone, and each player's
+# shortest path against the reference distance. filling in the path's cells has to connect the player's sides
+def check_locality(checker, position, board, kept):
+    size, _, _ = position
+    cells, _ = reference_cells(size, position[2])
+    kept.update(board)
+    nearby = neighbourhoods(size, kept.radius)
+    expected = [sum(1 for other in nearby[cell] if cells[other // size][other % size]) for cell in range(size * size)]
+    checker.check('locality.incremental', expected, kept.near, position)
+    for player in (1, -1):
+        path = kept.paths.shortest_path(board, player)
+        distance = reference_distance(cells, player)
+        checker.check('shortest_path.length', distance, len(path) if path or distance == 0 else inf, position)
+        filled = [row[:] for row in cells]
+        for row, col in path:
+            filled[row][col] = player
+        if distance < inf:
+            checker.check('shortest_path.connects', player, reference_winner(filled), position)
+
+
+def check_pattern(checker, position, board, kept):
+    cells, turn = reference_cells(position[0], position[2])
+    expected = reference_pattern_value(cells, turn, kept.weights)
+    checker.check('pattern.incremental', expected, kept.get_value(board), position)
+    if np is not None:
+        checker.check('pattern.batch', expected, float(kept.get_values(np.array([cells], dtype=np.int8), [turn])[0]),
+                      position)
+
+
+# the child value grids of every heuristic, against evaluating each child on its own
+def check_child_values(checker, position, board, heuristics):
+    size = position[0]
+    shortest_path, two_distance, pattern, charge = heuristics
+    expected = reference_child_values(position, lambda cells, turn: reference_shortest_path_value(cells))
+    checker.check('shortest_path.get_child_values', expected, shortest_path.get_child_values(board), position)
+    checker.check('two_distance.get_child_values',
+                  reference_child_values(position, lambda cells, turn: reference_two_distance_value(cells)),
+                  two_distance.get_child_values(board), position)
+    pattern_expected = reference_child_values(position, lambda cells, turn:
+                                              reference_pattern_value(cells, turn, pattern.weights))
+    checker.check('pattern.get_child_values', pattern_expected, pattern.get_child_values(board), position)
+    # the charge heuristic remembers the charges of earlier positions, so it's checked against a new one
+    if board.winner == 0:
+        checker.check('charge.get_child_values', ChargeHeuristic(size).get_child_values(board),
+                      charge.get_child_values(board), position)
+    if np is not None:
+        cells = np.array([board.board], dtype=np.int8)
+        checker.check('shortest_path.get_child_values_batch', expected,
+                      ShortestPathHeuristic().get_child_values_batch(cells, [board.turn])[0].tolist(), position)
+        checker.check('pattern.get_child_values_batch', pattern_expected,
+                      pattern.get_child_values_batch(cells, [board.turn])[0].tolist(), position)
+
+
+# fixed depth alpha-beta with each combination of its fast paths, against plain minimax.
+# the value has to match exactly, and the best move has to be worth that value. with a table, every depth is
+# searched in turn with the same player, like iterative deepening
+def check_search(checker, position, board, max_depth):
+    if board.winner != 0:
+        return
+    for name, evaluate, heuristic in (
+            ('shortest_path', lambda cells, turn: reference_shortest_path_value(cells), ShortestPathHeuristic),
+            ('two_distance', lambda cells, turn: reference_two_distance_value(cells), TwoDistanceHeuristic)):
+        configs = {
+            'plain': lambda: dict(killer_moves=0),
+            'table': lambda: dict(),
+            'sorted': lambda: dict(sorter=ChargeHeuristic(board.size), sorter_depth=1),
+            # reductions, pruning and the locality window change the values, so these are only compared with negamax
+            'reduced': lambda: dict(late_move_reductions=True, reduction_depth=2, futility_pruning=True),
+            'local': lambda: dict(candidate_radius=1, path_depth=2),
+            # each search follows a ponder on a copy of the player, after the first empty cell is played
+            'ponder': lambda: dict(ponder=True),
+        }
+        # each negamax player has its own tables, which should end up the same as its alpha_beta twin's
+        players = {config: (AlphaBetaPlayer(board.turn, heuristic(), max_depth, **kwargs()),
+                            AlphaBetaPlayer(board.turn, heuristic(), max_depth, negamax=True, **kwargs()))
+                   for config, kwargs in configs.items()}
+        for depth in range(1, max_depth + 1):
+            expected, nodes = reference_minimax(position, depth, evaluate)
+            checker.add('nodes.minimax', nodes)
+            for config, (player, twin) in players.items():
+                if config == 'ponder':
+                    ponder(player, board, depth)
+                    ponder(twin, board, depth)
+                table = None if config == 'plain' else player.transposition_table
+                stats = player.new_stats()
+                stats.begin_iteration(depth)
+                value, move_list, _ = player.alpha_beta(board, depth, -inf, inf, board.turn, table,
+                                                        sorter=player.sorter)
+                checker.add('nodes.alpha_beta.%s' % config, stats.nodes)
+                check_name = 'alpha_beta.%s.%s' % (name, config)
+                twin_stats = twin.new_stats()
+                twin_stats.begin_iteration(depth)
+                twin_value, twin_list, _ = twin.search(board, depth, -inf, inf, board.turn,
+                                                       None if config == 'plain' else twin.transposition_table,
+                                                       sorter=twin.sorter)
+                checker.check('negamax.%s.%s.value' % (name, config), value, twin_value, position)
+                checker.check('negamax.%s.%s.pv' % (name, config), principal_variation(move_list),
+                              principal_variation(twin_list), position)
+                checker.check('negamax.%s.%s.nodes' % (name, config), stats.nodes, twin_stats.nodes, position)
+                checker.check('board.unchanged_by_search', position[2], board.move_list, position)
+                if config in ('reduced', 'local'):
+                    continue
+                checker.check(check_name + '.value', expected, value, position)
+                if move_list is None:
+                    # no move is returned when every move loses
+                    checker.check(check_name + '.best_move', -board.turn * inf, value, position)
+                else:
+                    size, swap, moves = position
+                    child = reference_minimax((size, swap, moves + [move_list[0]]), depth - 1, evaluate)[0]
+                    checker.check(check_name + '.best_move', expected, child, position)
+
+
+# searches the position after the first empty cell with a copy of the player made for pondering, which shares the
+# player's move ordering but has a table of its own, so both twins see the same orderings afterwards
+def ponder(player, board, depth):
+    move = next(((row, col) for row in range(board.size) for col in range(board.size) if board[row][col] == 0), None)
+    if move is None or not board.play(*move):
+        return
+    if board.winner == 0:
+        ponderer = player.ponder_copy()
+        ponderer.search(board, depth, -inf, inf, board.turn, TranspositionTable(), sorter=ponderer.sorter)
+    board.undo()
+
+
+# the number of entries each process stores in the shared table
+SHARED_ENTRIES = 32
+# a separate program that attaches to the shared table by name, like a search started by hand would
+SHARED_TABLE_SCRIPT = '''
+import sys
+from math import inf
+from player import build_player
+table = build_player({"type": "alpha_beta", "depth": 1, "shared_table": sys.argv[1]}, 1, 3).transposition_table
+found = table.probe((0, 1), 1, 1, -inf, inf)
+table.store((3, 0), 0, 2, 3.0, None, -inf, inf)
+table.close()
+print(found[0])
+'''
+
+
+# stores entries into the shared table from a pool worker, and reads back the entries the first process stored
+def shared_table_worker(table, worker):
+    for i in range(SHARED_ENTRIES):
+        table.store((worker, i), i, 2, float(worker * 1000 + i), ((worker, i % 5), None), -inf, inf)
+    return [table.probe((0, i), i, 1, -inf, inf) for i in range(SHARED_ENTRIES)]
+
+
+# the shared transposition table, used from a pool of workers it was sent to and from a separate program that
+# attaches to it by name. every process has to see the others' entries, and the memory has to outlive the processes
+# that attached to it, until the process that made it closes it
+def check_shared_table(checker):
+    position = (0, False, [])
+    table = SharedTranspositionTable(entries=1 << 12)
+    try:
+        for i in range(SHARED_ENTRIES):
+            table.store((0, i), i, 2, float(i), ((0, i % 5), None), -inf, inf)
+        with multiprocessing.Pool(2) as pool:
+            found = pool.starmap(shared_table_worker, [(table, 1), (table, 2)])
+        for worker in (1, 2):
+            for i in range(SHARED_ENTRIES):
+                checker.check('shared_table.worker_reads', (float(i), ((0, i % 5), None)), found[worker - 1][i],
+                              position)
+                checker.check('shared_table.reads_worker', (float(worker * 1000 + i), ((worker, i % 5), None)),
+                              table.probe((worker, i), i, 1, -inf, inf), position)
+
+        result = subprocess.run([sys.executable, '-c', SHARED_TABLE_SCRIPT, table.name], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        checker.check('shared_table.process_reads', '1.0', result.stdout.strip(), position)
+        checker.check('shared_table.process_leaks', False, 'leaked' in result.stderr, position)
+        # the resource tracker of the other program frees anything left registered just after the program exits
+        time.sleep(0.2)
+        try:
+            other = SharedTranspositionTable(name=table.name)
+        except FileNotFoundError:
+            other = None
+        checker.check('shared_table.outlives_processes', True, other is not None, position)
+        if other is not None:
+            checker.check('shared_table.reads_process', (3.0, None), other.probe((3, 0), 0, 1, -inf, inf), position)
+            other.close()
+    finally:
+        table.close()
+
+
+# games written to a record file and read back, with names longer than the format keeps. a name is cut short
+# between characters, so it decodes to the start of itself, and the games after it still read
+def check_records(checker, rng):
+    names = [('é' * 200, 'ab'), ('日本' * 100, ''), ('x' * 300, 'y' * 254 + 'é')]
+    games = []
+    for size, swap in ((5, False), (11, True), (17, False)):
+        for players in names:
+            moves = random_game(size, swap, rng)
+            games.append(GameRecord(size, moves, rng.choice((1, -1)), swap, players,
+                                    [float(i) for i in range(len(moves))], [0.5] * len(moves)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'games.hexr')
+        with GameWriter(path) as writer:
+            for game in games:
+                writer.write(game)
+        try:
+            found = list(read_games(path))
+        except (UnicodeDecodeError, ValueError) as error:
+            found = [repr(error)]
+    if not checker.check('record.games', len(games), len(found), (0, False, [])):
+        return
+    for game, read in zip(games, found):
+        position = (game.size, game.swap_rule, game.moves)
+        checker.check('record.moves', game.moves, read.moves, position)
+        for name, read_name in zip(game.players, read.players):
+            checker.check('record.name_prefix', True, name.startswith(read_name), position)
+            # at most the last character that would have gone past 255 bytes is lost
+            checker.check('record.name_length', True, read_name == name or len(read_name.encode('utf-8')) > 251,
+                          position)
+
+
+def check_perft(checker, size, swap, max_depth):
+    board = HexBoard(size, swap)
+    position = (size, swap, [])
+    for depth in range(1, max_depth + 1):
+        expected = reference_perft(position, depth)
+        checker.check('perft', expected, board_perft(board, depth), position)
+        checker.add('perft %s depth %d' % (board_name(size, swap), depth), expected)
+
+
+# checks every prefix of a game with the cheap checks, going forwards and then back with the same heuristics,
+# and the expensive checks on a few of them
+def check_game(checker, size, swap, moves, heuristics, samples, searches, search_depth, rng):
+    shortest_path, two_distance, pattern, _ = heuristics
+    board = HexBoard(size, swap)
+    window = LocalityWindow()
+    prefixes = list(range(len(moves) + 1))
+    sampled = rng.sample(prefixes, min(samples, len(prefixes)))
+    searched = set(sampled[:searches])
+    sampled = set(sampled)
+    values = dict()
+    for step in prefixes + prefixes[::-1]:
+        while len(board.move_list) > step:
+            board.undo()
+        while len(board.move_list) < step:
+            board.play(*moves[len(board.move_list)])
+        position = (size, swap, moves[:step])
+        check_winner(checker, position, board)
+        check_distances(checker, position, board, shortest_path)
+        values[step] = check_two_distance(checker, position, board, two_distance, values.get(step))
+        check_pattern(checker, position, board, pattern)
+        check_locality(checker, position, board, window)
+        if step in sampled:
+            sampled.discard(step)
+            check_child_values(checker, position, board, heuristics)
+            if step in searched and search_depth:
+                check_search(checker, position, board, search_depth)
+
+
+# checks that whatever the monte carlo player proves about a position, with and without an evaluator, is what
+# solving it by minimax finds. the rollout search never swaps, so it can't always prove the first moves
+def check_solver(checker, position, board, evaluators):
+    if board.winner != 0:
+        return
+    size, swap, moves = position
+    empty = sum(row.count(0) for row in board.board)
+    expected = reference_minimax(position, empty + 1, lambda cells, turn: reference_winner(cells))[0]
+    for name, evaluator in evaluators.items():
+        player = MonteCarloPlayer(board.turn, size, collect_stats=False, evaluator=evaluator)
+        root = player.tree_node(board)
+        count = 0
+        while root[4] == 0 and count < SOLVER_SEARCHES:
+            count += player.search(board)
+        checker.add('searches.solver.%s' % name, count)
+        if root[4] == 0:
+            checker.add('unproven.solver.%s' % name, 1)
+            continue
+        checker.check('solver.%s.result' % name, expected, board.turn * root[4], position)
+        # a proven win has to be played with a winning move
+        best = player.best_move(board)
+        result = reference_minimax((size, swap, moves + [best]), empty, lambda cells, turn: reference_winner(cells))[0]
+        checker.check('solver.%s.best_move' % name, expected if root[4] == 1 else result, result, position)
+        checker.check('board.unchanged_by_search', moves, board.move_list, position)
+
+
+# a position from a random game with only a few empty cells left, or None if the game ended too soon
+def endgame_position(size, swap, rng):
+    moves = random_game(size, swap, rng)
+    step = max(0, size * size - SOLVER_EMPTY_CELLS)
+    if step > len(moves):
+        return None
+    return size, swap, moves[:step]
+
+
+# what is being checked, on stderr so it stays out of the report
+def progress(message, start):
+    sys.stderr.write('[%6.1fs] %s\n' % (default_timer() - start, message))
+
+
+def run(mode, seed=1, sizes=None, checker=None):
+    settings = MODES[mode]
+    checker = checker or Checker()
+    rng = random.Random(seed)
+    start = default_timer()
+    for size in range(1, settings['enumerate'] + 1):
+        for swap in (False, True):
+            heuristics = (ShortestPathHeuristic(), TwoDistanceHeuristic(), PatternHeuristic(), ChargeHeuristic(size))
+            window = LocalityWindow(radius=1)
+            positions = enumerate_positions(size, swap)
+            progress('every position of %s: %d positions' % (board_name(size, swap), len(positions)), start)
+            for moves in positions:
+                position = (size, swap, moves)
+                board = load_board(position)
+                check_winner(checker, position, board)
+                check_distances(checker, position, board, heuristics[0])
+                check_two_distance(checker, position, board, heuristics[1])
+                check_pattern(checker, position, board, heuristics[2])
+                check_locality(checker, position, board, window)
+                check_child_values(checker, position, board, heuristics)
+                if size <= ENUMERATE_SEARCH_SIZE:
+                    check_search(checker, position, board, settings['search_depths'].get(size, 0))
+    for size in sizes or settings['sizes']:
+        for swap in (False, True):
+            heuristics = (ShortestPathHeuristic(), TwoDistanceHeuristic(), PatternHeuristic(), ChargeHeuristic(size))
+            progress('games on %s' % board_name(size, swap), start)
+            for moves in games(size, swap, settings['games'], rng):
+                check_game(checker, size, swap, moves, heuristics, settings['samples'], settings['searches'],
+                           settings['search_depths'].get(size, 0), rng)
+    evaluators = {'rollout': None}
+    if np is not None:
+        from network import load_network
+        evaluators['network'] = load_network()
+    for size, swap, count in settings['solver']:
+        progress('monte carlo solver on %s' % board_name(size, swap), start)
+        for _ in range(count):
+            position = endgame_position(size, swap, rng)
+            if position is not None:
+                check_solver(checker, position, load_board(position), evaluators)
+    for size, swap, depth in settings['perft']:
+        progress('perft on %s to depth %d' % (board_name(size, swap), depth), start)
+        check_perft(checker, size, swap, depth)
+    progress('game records', start)
+    check_records(checker, rng)
+    progress('shared transposition table across processes', start)
+    check_shared_table(checker)
+    if np is None:
+        checker.out.write('numpy is not installed, so the batch heuristics were not checked\n')
+    checker.report(default_timer() - start)
+    return checker
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the fast paths of the board, heuristics and search '
+                                                 'against reference implementations')
+    parser.add_argument('--exhaustive', action='store_true', help='check many more positions, sizes and depths')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random positions')
+    parser.add_argument('--sizes', type=int, nargs='+', help='board sizes for the random positions')
+    parser.add_argument('--max-failures', type=int, default=10, help='the number of mismatches to print in full')
+    args = parser.parse_args(argv)
+
+    checker = run('exhaustive' if args.exhaustive else 'smoke', args.seed, args.sizes, Checker(args.max_failures))
+    sys.exit(1 if checker.failures else 0)
+
+
+if __name__ == '__main__':
+    main()